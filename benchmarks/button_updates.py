@@ -0,0 +1,66 @@
+"""Measures how long setting the icon, text and alignment of every key on a Stream Deck XL
+takes, with one setter call at a time and in a batch. The setters don't wait for the Stream
+Deck, so both the time until they return and until the device shows the changes are measured.
+
+Run from the repository root with: python -m benchmarks.button_updates
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+from time import perf_counter
+
+from benchmarks.common import ASSETS_PATH, StreamDeckXLMock
+from streamdeck_ui.api import StreamDeckServer
+from streamdeck_ui.config import PAGES
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.state_persister import StatePersister
+
+ICONS = [os.path.join(ASSETS_PATH, "smile.jpg"), os.path.join(ASSETS_PATH, "dog.gif")]
+
+
+def run(batch: bool, state_file: str) -> None:
+    server = StreamDeckServer()
+    server.persister = StatePersister(server._export_state, lambda state: server._write_config(state_file, state))
+    streamdeck = StreamDeckXLMock(None)
+    display = DisplayGrid(threading.Lock(), streamdeck, PAGES, None)
+    server.display_handlers["deck"] = display
+    display.set_page(0)
+    display.start()
+    display.synchronize()
+
+    start = perf_counter()
+    if batch:
+        with server.batch() as changes:
+            update_keys(server, streamdeck.key_count())
+        shown = changes.shown
+    else:
+        shown = update_keys(server, streamdeck.key_count())
+    returned = perf_counter() - start
+    shown.result()
+    elapsed = perf_counter() - start
+    server.persister.stop()
+    display.stop()
+
+    stats = server.get_save_stats()
+    mode = "batch" if batch else "one by one"
+    print(f"{mode:<11} returned after {returned * 1000:6.1f} ms, shown after {elapsed * 1000:6.1f} ms  {stats['requested']:>3} saves requested, {stats['performed']} written")
+
+
+def update_keys(server: StreamDeckServer, key_count: int) -> Future:
+    """Changes every key and returns the future of the last change"""
+    for button in range(key_count):
+        server.set_button_icon("deck", 0, button, ICONS[button % len(ICONS)])
+        server.set_button_text("deck", 0, button, f"Key {button}")
+        shown = server.set_text_vertical_align("deck", 0, button, "top")
+    return shown
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        for batch in (False, True):
+            run(batch, os.path.join(directory, "state.json"))
+
+
+if __name__ == "__main__":
+    main()
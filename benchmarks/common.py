@@ -0,0 +1,42 @@
+"""Helpers shared by the benchmarks"""
+import os
+from typing import List
+
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.display.filter import Filter
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.mock_streamdeck import StreamDeckMock
+
+ASSETS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "assets")
+ANIMATIONS = [os.path.join(ASSETS_PATH, "dog.gif"), os.path.join(ASSETS_PATH, "firework.gif")]
+
+
+class StreamDeckXLMock(StreamDeckMock):
+    """A mock Stream Deck with the layout and image format of a Stream Deck XL"""
+
+    KEY_COUNT = 32
+    KEY_COLS = 8
+    KEY_ROWS = 4
+
+    KEY_PIXEL_WIDTH = 96
+    KEY_PIXEL_HEIGHT = 96
+    KEY_IMAGE_FORMAT = "JPEG"
+    KEY_FLIP = (True, True)
+    KEY_ROTATION = 0
+
+    DECK_TYPE = "Stream Deck XL"
+
+
+def animated_filters(button: int) -> List[Filter]:
+    """Returns the filters for an animated button"""
+    return [ImageFilter(ANIMATIONS[button % len(ANIMATIONS)])]
+
+
+def clear_caches(display: DisplayGrid) -> None:
+    """Empties every cache of a display, so the next frame is rendered from scratch"""
+    display.frame_cache.clear()
+    if display.process_renderer is not None:
+        display.process_renderer.clear_caches()
+    for page in display.pages.values():
+        for pipeline in page.values():
+            pipeline.clear_caches()
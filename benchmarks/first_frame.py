@@ -0,0 +1,52 @@
+"""Measures how long it takes from configuring a Stream Deck XL until every key of the
+current page shows its image, for different numbers of configured pages.
+
+Every key of every page gets an icon and its own label.
+
+Run from the repository root with: python -m benchmarks.first_frame
+"""
+import os
+import statistics
+from time import perf_counter, sleep
+from typing import List
+
+from benchmarks.common import ASSETS_PATH
+from benchmarks.page_switch import TimedStreamDeckXLMock
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.device_lock import DeviceLock, EnumerationBarrier
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.text_filter import TextFilter
+
+ROUNDS = 5
+ICON = os.path.join(ASSETS_PATH, "smile.jpg")
+
+
+def run(pages: int) -> List[float]:
+    """Configures a display ROUNDS times and returns the time to the first full frame of each"""
+    latencies = []
+    for round in range(ROUNDS):
+        streamdeck = TimedStreamDeckXLMock()
+        start = perf_counter()
+        # The same steps StreamDeckServer.update_streamdeck_filters takes
+        display = DisplayGrid(DeviceLock(EnumerationBarrier()), streamdeck, pages, None)
+        display.set_page(0)
+        for page in range(pages):
+            for button in range(streamdeck.key_count()):
+                display.replace(page, button, [ImageFilter(ICON), TextFilter(f"{round}:{page}:{button}", DEFAULT_FONT, "")])
+        display.start()
+        while streamdeck.writes < streamdeck.key_count():
+            sleep(0.0005)
+        latencies.append(streamdeck.last_write - start)
+        display.stop()
+    return latencies
+
+
+def main() -> None:
+    for pages in (1, 10, 50):
+        latencies = run(pages)
+        print(f"{pages:>3} pages  mean {statistics.mean(latencies) * 1000:7.1f} ms  median {statistics.median(latencies) * 1000:7.1f} ms to the first frame")
+
+
+if __name__ == "__main__":
+    main()
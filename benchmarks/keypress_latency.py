@@ -0,0 +1,75 @@
+"""Measures how long it takes from a key press until the pressed image of the key was written
+to a Stream Deck XL, while the other keys play animations.
+
+Writing a key image to the device takes WRITE_TIME, like it does over USB.
+
+Run from the repository root with: python -m benchmarks.keypress_latency
+"""
+import os
+import statistics
+import threading
+from time import perf_counter, sleep
+from typing import List
+
+from benchmarks.common import ASSETS_PATH, StreamDeckXLMock, animated_filters
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.text_filter import TextFilter
+
+PRESSES = 50
+WRITE_TIME = 0.002
+ICON = os.path.join(ASSETS_PATH, "smile.jpg")
+
+
+class SlowStreamDeckXLMock(StreamDeckXLMock):
+    """A mock Stream Deck XL that takes WRITE_TIME per key image, and remembers when each key was last written"""
+
+    def __init__(self):
+        super().__init__(None)
+        self.written = threading.Condition()
+        self.write_times = {}
+
+    def set_key_image(self, key, image):
+        sleep(WRITE_TIME)
+        with self.written:
+            self.write_times[key] = perf_counter()
+            self.written.notify_all()
+
+
+def run(animated: bool) -> List[float]:
+    """Presses and releases the first key PRESSES times and returns the latency of each press and release"""
+    streamdeck = SlowStreamDeckXLMock()
+    display = DisplayGrid(threading.Lock(), streamdeck, 1, None)
+    display.set_page(0)
+    display.replace(0, 0, [ImageFilter(ICON), TextFilter("Press", DEFAULT_FONT, "")])
+    for button in range(1, streamdeck.key_count()):
+        display.replace(0, button, animated_filters(button) if animated else [ImageFilter(ICON)])
+    display.start()
+    display.synchronize()
+    sleep(0.5)
+
+    latencies = []
+    for press in range(2 * PRESSES):
+        start = perf_counter()
+        display.set_keypress(0, press % 2 == 0)
+        with streamdeck.written:
+            while streamdeck.write_times.get(0, 0) < start:
+                streamdeck.written.wait()
+            latencies.append(streamdeck.write_times[0] - start)
+        # Presses are a human's pace apart
+        sleep(0.05)
+
+    display.stop()
+    return latencies
+
+
+def main() -> None:
+    for animated in (False, True):
+        latencies = run(animated)
+        name = "animated" if animated else "static"
+        print(f"{name:<9} mean {statistics.mean(latencies) * 1000:6.2f} ms  median {statistics.median(latencies) * 1000:6.2f} ms  max {max(latencies) * 1000:6.2f} ms key to write")
+
+
+if __name__ == "__main__":
+    main()
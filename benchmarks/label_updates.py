@@ -0,0 +1,44 @@
+"""Measures how many times per second the label of a button can change, for a 4-digit counter
+drawn the usual way and from the glyph atlas.
+
+Only the text filter is timed: for every update a new text filter is created and initialized,
+and the label is pasted onto the icon, as when StreamDeckServer.set_button_text rebuilds the
+filters of a button. The rest of set_button_text (saving the state, building the pipeline,
+encoding the image and sending it to the device) is the same for both modes and left out, so
+the rates are an upper bound for changing a label through the server.
+
+Run from the repository root with: python -m benchmarks.label_updates
+"""
+from time import perf_counter
+
+from PIL import Image
+
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display.pipeline import no_output
+from streamdeck_ui.display.text_filter import TEXT_MODE_ATLAS, TEXT_MODE_LABEL, TextFilter, label_cache
+
+UPDATES = 2000
+SIZE = (72, 72)
+
+
+def run(mode: str) -> float:
+    """Counts up UPDATES times and returns the number of updates per second"""
+    icon = Image.new("RGB", SIZE)
+    # Warm up the font and glyph caches, but not the label cache
+    TextFilter("0123456789", DEFAULT_FONT, "", mode).initialize(SIZE)
+    label_cache.clear()
+    start = perf_counter()
+    for count in range(UPDATES):
+        text_filter = TextFilter(f"{count:04}", DEFAULT_FONT, "", mode)
+        text_filter.initialize(SIZE)
+        text_filter.transform(icon, no_output, True, 0)
+    return UPDATES / (perf_counter() - start)
+
+
+def main() -> None:
+    for name, mode in (("label", TEXT_MODE_LABEL), ("atlas", TEXT_MODE_ATLAS)):
+        print(f"{name}  {run(mode):8.0f} updates per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Measures how much attached Stream Decks hold each other up when they all share one
+lock (the old behaviour), compared to a lock per device behind an enumeration barrier.
+
+Each round, every key of every deck gets a new label and the time from there until all
+the decks show it is measured. Writing an image to the mock takes a few milliseconds, like a USB
+transfer does.
+
+Run from the repository root with: python -m benchmarks.lock_contention
+"""
+import statistics
+import threading
+from time import perf_counter, sleep
+from typing import ContextManager, List
+
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.device_lock import DeviceLock, EnumerationBarrier
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.display.text_filter import TextFilter
+from streamdeck_ui.mock_streamdeck import StreamDeckMock
+
+DECKS = 3
+ROUNDS = 10
+WRITE_TIME = 0.002
+
+
+class SlowStreamDeckMock(StreamDeckMock):
+    """A mock Stream Deck that takes WRITE_TIME seconds to write a key image"""
+
+    def set_key_image(self, key, image):
+        sleep(WRITE_TIME)
+
+
+def run(locks: List[ContextManager]) -> List[float]:
+    """Updates every key on every deck ROUNDS times and returns the duration of each round"""
+    displays = []
+    for lock in locks:
+        display = DisplayGrid(lock, SlowStreamDeckMock(None), 1, None)
+        for button in range(display.streamdeck.key_count()):
+            display.replace(0, button, [])
+        display.set_page(0)
+        display.start()
+        displays.append(display)
+
+    durations = []
+    for round in range(ROUNDS):
+        for display in displays:
+            for button in range(display.streamdeck.key_count()):
+                display.replace(0, button, [TextFilter(f"{round}:{button}", DEFAULT_FONT, "")])
+        start = perf_counter()
+        for display in displays:
+            display.synchronize()
+        durations.append(perf_counter() - start)
+
+    for display in displays:
+        display.stop()
+    return durations
+
+
+def report(name: str, durations: List[float]) -> None:
+    print(f"{name:<20} mean {statistics.mean(durations) * 1000:7.1f} ms  max {max(durations) * 1000:7.1f} ms per round")
+
+
+def main() -> None:
+    print(f"{DECKS} decks, {StreamDeckMock.KEY_COUNT} keys each, {WRITE_TIME * 1000:.0f} ms per key write")
+    shared_lock = threading.Lock()
+    report("shared lock", run([shared_lock] * DECKS))
+
+    barrier = EnumerationBarrier()
+    report("per device locks", run([DeviceLock(barrier) for _ in range(DECKS)]))
+
+
+if __name__ == "__main__":
+    main()
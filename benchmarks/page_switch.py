@@ -0,0 +1,79 @@
+"""Measures how long it takes for a page switch to reach every key of a Stream Deck XL,
+with and without prerendering the target page.
+
+Before every switch, the keys of the target page get new labels, so nothing is cached
+from the previous round.
+
+Run from the repository root with: python -m benchmarks.page_switch
+"""
+import os
+import statistics
+import threading
+from time import perf_counter, sleep
+from typing import List
+
+from benchmarks.common import ASSETS_PATH, StreamDeckXLMock
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.text_filter import TextFilter
+
+ROUNDS = 20
+ICON = os.path.join(ASSETS_PATH, "smile.jpg")
+
+
+class TimedStreamDeckXLMock(StreamDeckXLMock):
+    """A mock Stream Deck XL that remembers when the last key image was written"""
+
+    def __init__(self):
+        super().__init__(None)
+        self.writes = 0
+        self.last_write = 0.0
+
+    def set_key_image(self, key, image):
+        self.writes += 1
+        self.last_write = perf_counter()
+
+
+def run(prerender: bool) -> List[float]:
+    """Switches ROUNDS times to a freshly configured page and returns the latency of each switch"""
+    streamdeck = TimedStreamDeckXLMock()
+    display = DisplayGrid(threading.Lock(), streamdeck, 2, None)
+    for button in range(streamdeck.key_count()):
+        display.replace(0, button, [])
+    display.set_page(0)
+    display.start()
+    if prerender:
+        display.prerender([1])
+
+    latencies = []
+    for round in range(ROUNDS):
+        for button in range(streamdeck.key_count()):
+            display.replace(1, button, [ImageFilter(ICON), TextFilter(f"{round}:{button}", DEFAULT_FONT, "")])
+        # Give the display the idle time it would have while the user looks at the page
+        display.synchronize()
+        sleep(0.1)
+
+        writes = streamdeck.writes
+        start = perf_counter()
+        display.set_page(1)
+        while streamdeck.writes < writes + streamdeck.key_count():
+            sleep(0.0005)
+        latencies.append(streamdeck.last_write - start)
+
+        display.set_page(0)
+        display.synchronize()
+
+    display.stop()
+    return latencies
+
+
+def main() -> None:
+    for prerender in (False, True):
+        latencies = run(prerender)
+        name = "prerendered" if prerender else "cold"
+        print(f"{name:<12} mean {statistics.mean(latencies) * 1000:6.1f} ms  median {statistics.median(latencies) * 1000:6.1f} ms per page switch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Compares the time it takes to render a frame of a Stream Deck XL page with 32 animated
+keys, with the pipelines processed one after the other ("serial" renderer), on the shared
+thread pool ("thread" renderer) or in worker processes ("process" renderer).
+
+The caches and compiled animations are emptied before every frame and the time moves past the
+frame duration of the animations, so every key is rendered and encoded from scratch. Nothing is
+written to a device.
+
+Run from the repository root with: python -m benchmarks.parallel_render
+"""
+import statistics
+import threading
+from time import perf_counter
+from typing import List
+
+from benchmarks.common import StreamDeckXLMock, animated_filters, clear_caches
+from streamdeck_ui.display.display_grid import RENDER_THREADS, RENDERERS, DisplayGrid
+from streamdeck_ui.display.process_renderer import RENDER_PROCESSES
+
+FRAMES = 50
+FRAME_TIME = 1_000_000_000
+"The nanoseconds between frames, longer than any frame of the animations"
+
+
+def run(renderer: str) -> List[float]:
+    """Renders FRAMES frames and returns the duration of each frame"""
+    display = DisplayGrid(threading.Lock(), StreamDeckXLMock(None), 1, None, renderer=renderer)
+    for button in range(display.streamdeck.key_count()):
+        display.replace(0, button, animated_filters(button))
+    # The render thread is not started, build the pipelines it would build
+    display._build_pending(0)
+    page = display.pages[0]
+    buttons = set(page.keys())
+
+    durations = []
+    for frame in range(FRAMES):
+        clear_caches(display)
+        start = perf_counter()
+        display._render_frame(0, page, buttons, frame * FRAME_TIME, frame == 0)
+        durations.append(perf_counter() - start)
+    display.close()
+    return durations
+
+
+def main() -> None:
+    print(f"{StreamDeckXLMock.KEY_COUNT} animated keys, {RENDER_THREADS} render threads, {RENDER_PROCESSES} render processes")
+    for renderer in RENDERERS:
+        durations = run(renderer)
+        print(f"{renderer:<8} mean {statistics.mean(durations) * 1000:6.1f} ms  median {statistics.median(durations) * 1000:6.1f} ms per frame")
+
+
+if __name__ == "__main__":
+    main()
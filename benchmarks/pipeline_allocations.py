@@ -0,0 +1,111 @@
+"""Measures the memory a single pipeline allocates per frame, and the images it copies.
+
+Three cases, for a button with an icon, a label and the keypress filter:
+
+- idle: nothing changes between frames
+- animation: an animated icon that is not compiled, after one loop so every frame is cached
+- key press: the key is pressed and released on alternating frames
+- redraw: every filter draws again, without help from the output cache
+
+Allocations are measured with tracemalloc, which sees Python objects but not the pixel
+buffers Pillow allocates, so copied images are counted separately.
+
+Run from the repository root with: python -m benchmarks.pipeline_allocations
+"""
+import os
+import tracemalloc
+from time import perf_counter
+from typing import Callable, List, Tuple
+
+from PIL import Image
+
+from benchmarks.common import ANIMATIONS, ASSETS_PATH
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display.empty_filter import EmptyFilter
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.keypress_filter import KeypressFilter
+from streamdeck_ui.display.pipeline import Pipeline
+from streamdeck_ui.display.text_filter import TextFilter
+
+FRAMES = 200
+SIZE = (96, 96)
+
+
+def create_pipeline(icon: str) -> Tuple[Pipeline, KeypressFilter]:
+    pipeline = Pipeline()
+    keypress = KeypressFilter()
+    for filter in [EmptyFilter(), ImageFilter(icon), TextFilter("Label", DEFAULT_FONT, "bottom"), keypress]:
+        filter.initialize(SIZE)
+        pipeline.add(filter)
+    return (pipeline, keypress)
+
+
+def measure(step: Callable[[int], None]) -> Tuple[float, float, float]:
+    """Runs a step per frame and returns the peak bytes allocated, images copied and microseconds per frame"""
+    copies = 0
+    copy = Image.Image.copy
+
+    def counting_copy(image):
+        nonlocal copies
+        copies += 1
+        return copy(image)
+
+    Image.Image.copy = counting_copy  # type: ignore [assignment]
+    peaks: List[int] = []
+    tracemalloc.start()
+    try:
+        for frame in range(FRAMES):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            step(frame)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+        Image.Image.copy = copy  # type: ignore [assignment]
+
+    start = perf_counter()
+    for frame in range(FRAMES):
+        step(frame)
+    elapsed = perf_counter() - start
+    return (sum(peaks) / FRAMES, copies / FRAMES, elapsed / FRAMES * 1_000_000)
+
+
+def main() -> None:
+    pipeline, keypress = create_pipeline(os.path.join(ASSETS_PATH, "smile.png"))
+    # Create the times up front, so only the pipeline allocates
+    zero = 0
+    times = [(2 * FRAMES + frame) * 100_000_000 for frame in range(FRAMES)]
+
+    pipeline.execute(zero)
+    idle = measure(lambda frame: pipeline.execute(zero))
+
+    animated, _ = create_pipeline(ANIMATIONS[0])
+    for frame in range(2 * FRAMES):
+        # Play the animation once, so all its frames are cached
+        animated.execute(frame * 100_000_000)
+    animation = measure(lambda frame: animated.execute(times[frame]))
+
+    def press(frame: int) -> None:
+        keypress.active = frame % 2 == 0
+        pipeline.execute(zero)
+
+    key_press = measure(press)
+
+    def redraw(frame: int) -> None:
+        pipeline.output_cache.clear()
+        pipeline.first_run = True
+        pipeline.execute(zero)
+
+    keypress.active = False
+    redraws = measure(redraw)
+
+    # What measuring itself allocates
+    overhead, _, _ = measure(lambda frame: None)
+
+    for name, (allocated, copies, microseconds) in [("idle", idle), ("animation", animation), ("key press", key_press), ("redraw", redraws)]:
+        print(f"{name:<10} {max(allocated - overhead, 0):8.0f} bytes allocated  {copies:4.1f} images copied  {microseconds:7.1f} us per frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measures how long changing one button takes the UI thread, including saving the state,
+for configs of different sizes, with the json and the journal state backends. The changes
+go through the server setter, so it includes the snapshot the setter takes of the state.
+The writes that follow run in the background and are counted, not timed.
+
+Every deck is a Stream Deck XL with 10 pages, and every button has a label, an icon and
+a command.
+
+Run from the repository root with: python -m benchmarks.state_save
+"""
+import os
+import statistics
+import tempfile
+from time import perf_counter
+from typing import List
+
+from streamdeck_ui.api import StreamDeckServer
+from streamdeck_ui.state_journal import StateJournal
+
+SAVES = 200
+PAGES = 10
+BUTTONS = 32
+
+
+def create_server(decks: int, state_file: str, journal: bool) -> StreamDeckServer:
+    server = StreamDeckServer()
+    server.state_file = state_file
+    server.journal = StateJournal(state_file) if journal else None
+    for deck in range(decks):
+        for page in range(PAGES):
+            for button in range(BUTTONS):
+                button_state = server._button_state(f"deck{deck}", page, button)
+                button_state.text = f"Button {page}:{button}"
+                button_state.icon = f"/home/user/icons/{page}/{button}.png"
+                button_state.command = f"xdotool key ctrl+{button}"
+    server._save_state()
+    server.persister.flush()
+    return server
+
+
+def run(decks: int, journal: bool) -> List[float]:
+    """Changes the command of a button SAVES times and returns how long each change took"""
+    with tempfile.TemporaryDirectory() as directory:
+        state_file = os.path.join(directory, "state.json")
+        server = create_server(decks, state_file, journal)
+        latencies = []
+        for save in range(SAVES):
+            start = perf_counter()
+            server.set_button_command("deck0", 0, save % BUTTONS, f"echo {save}")
+            latencies.append(perf_counter() - start)
+        server.persister.stop()
+        size = os.path.getsize(state_file)
+        writes = server.get_save_stats()["performed"]
+    print(f"{decks:>3} decks ({size // 1024:>5} KB)  {'journal' if journal else 'json':<8}  {writes:>3} writes", end="")
+    return latencies
+
+
+def main() -> None:
+    for decks in (1, 5, 20):
+        for journal in (False, True):
+            latencies = run(decks, journal)
+            print(f"  mean {statistics.mean(latencies) * 1000:7.2f} ms  median {statistics.median(latencies) * 1000:7.2f} ms  max {max(latencies) * 1000:7.2f} ms per change")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,10 @@
 import json
 import os
 import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 from functools import partial
-from typing import Dict, List, Optional, Tuple, Union, cast
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union, cast
 
 from PIL.ImageQt import ImageQt
 from PySide6.QtCore import QObject, Signal
@@ -11,13 +13,20 @@ from PySide6.QtGui import QImage, QPixmap
 from StreamDeck.Devices import StreamDeck
 from StreamDeck.Transport.Transport import TransportError
 
-from streamdeck_ui.config import CONFIG_FILE_VERSION, DEFAULT_FONT, STATE_FILE
+from streamdeck_ui.button_state import DEFAULT_BUTTON, ButtonState
+from streamdeck_ui.config import CONFIG_FILE_VERSION, PAGES, RENDERER, STATE_BACKEND, STATE_FILE
+from streamdeck_ui.device_lock import DeviceLock, EnumerationBarrier
 from streamdeck_ui.dimmer import Dimmer
+from streamdeck_ui.display.clock import NANOSECONDS_PER_MILLISECOND
 from streamdeck_ui.display.display_grid import DisplayGrid
 from streamdeck_ui.display.filter import Filter
 from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.image_source import image_sources
+from streamdeck_ui.display.key_writer import resolve
 from streamdeck_ui.display.pulse_filter import PulseFilter
 from streamdeck_ui.display.text_filter import TextFilter
+from streamdeck_ui.state_journal import StateJournal
+from streamdeck_ui.state_persister import StatePersister
 from streamdeck_ui.stream_deck_monitor import StreamDeckMonitor
 
 
@@ -31,6 +40,22 @@ class StreamDeckSignalEmitter(QObject):
     detached = Signal(str)
     "A signal that is raised whenever a StreamDeck is detached. "
     cpu_changed = Signal(str, int)
+    shown = Signal(str)
+    "A signal that is raised when changes to the buttons or page of a Stream Deck were sent to it."
+
+
+class ButtonChanges:
+    """The buttons changed during a batch, see StreamDeckServer.batch"""
+
+    def __init__(self) -> None:
+        self.saved: Dict[Tuple[str, int], Set[int]] = {}
+        "The buttons changed on each page, by (deck, page)"
+        self.rendered: Dict[Tuple[str, int], Set[int]] = {}
+        "The buttons whose filters must be rebuilt, by (deck, page)"
+        self.switch_pages: Set[str] = set()
+        "The Stream Decks where the page a button switches to changed"
+        self.shown: Future = Future()
+        "Done once the changes were sent to the Stream Decks, see StreamDeckServer.batch"
 
 
 class StreamDeckServer:
@@ -45,8 +70,8 @@ class StreamDeckServer:
         self.deck_ids: Dict[str, str] = {}
         "Lookup with device.id -> serial number"
 
-        self.state: Dict[str, Dict[str, Union[int, str, Dict[int, Dict[int, Dict[str, str]]]]]] = {}
-        "The data structure holding configuration for all Stream Decks"
+        self.state: Dict[str, Dict[str, Union[int, str, Dict[int, Dict[int, ButtonState]]]]] = {}
+        "The data structure holding configuration for all Stream Decks, with only the buttons that were configured"
 
         # REVIEW: Should we use the same lock as the display? What exactly
         # are we protecting? The UI is signaled via message passing.
@@ -56,8 +81,11 @@ class StreamDeckServer:
         self.display_handlers: Dict[str, DisplayGrid] = {}
         "Lookup with a display handler for each Stream Deck"
 
-        self.lock: threading.Lock = threading.Lock()
-        "Lock to coordinate polling, updates etc to Stream Decks"
+        self.lock = EnumerationBarrier()
+        "Barrier that keeps enumeration of Stream Decks away from device I/O"
+
+        self.device_locks: Dict[str, DeviceLock] = {}
+        "Lookup with the lock for each Stream Deck, so decks don't block each other"
 
         self.dimmers: Dict[str, Dimmer] = {}
         "Lookup with the dimmer for each Stream Deck"
@@ -73,6 +101,18 @@ class StreamDeckServer:
         self.monitor: Optional[StreamDeckMonitor] = None
         "Monitors for Stream Deck(s) attached to the computer"
 
+        self.state_file = STATE_FILE
+        "The file the state is saved to"
+
+        self.journal: Optional[StateJournal] = StateJournal(self.state_file) if STATE_BACKEND == "journal" else None
+        "Records the changes to the state, when the journal backend is used"
+
+        self.persister = StatePersister(self._snapshot_state, self._write_state)
+        "Writes the state file in the background, a short while after it changed"
+
+        self.changes: Optional[ButtonChanges] = None
+        "The buttons changed during the current batch, or None outside a batch"
+
     def stop_dimmer(self, serial_number: str) -> None:
         """Stops the dimmer for the given Stream Deck
 
@@ -141,12 +181,65 @@ class StreamDeckServer:
         """Sets the amount of time in seconds before the display gets dimmed."""
         self.state.setdefault(deck_id, {})["display_timeout"] = timeout
         self.dimmers[deck_id].timeout = timeout
-        self._save_state()
+        self._save_state(deck_id)
+
+    def _save_state(self, deck_id: Optional[str] = None, page: Optional[int] = None, *buttons: int):
+        """Saves the state soon, in the background.
+
+        :param deck_id: The Stream Deck whose settings or buttons changed, defaults to None
+        when the whole state changed
+        :type deck_id: Optional[str], optional
+        :param page: The page of the buttons that changed, defaults to None when the settings
+        of the Stream Deck changed
+        :type page: Optional[int], optional
+        :param buttons: The buttons that changed
+        :type buttons: int
+        """
+        if self.journal is not None:
+            self.journal.mark(self.state, deck_id, page, buttons)
+        self.persister.request()
+
+    def _snapshot_state(self) -> Optional[Dict[str, Dict[str, object]]]:
+        """Returns a snapshot of the state to write (see _export_state). The journal takes its
+        own, only when it rewrites the state file."""
+        if self.journal is None:
+            return self._export_state()
+        self.journal.snapshot(self._export_state)
+        return None
 
-    def _save_state(self):
-        self.export_config(STATE_FILE)
+    def _write_state(self, state: Optional[Dict[str, Dict[str, object]]]) -> None:
+        """Writes a snapshot of the state (see _snapshot_state) to the state file, or the journal"""
+        if self.journal is not None:
+            self.journal.write(lambda exported, sequence: self._write_config(self.state_file, exported, sequence))
+        elif state is not None:
+            self._write_config(self.state_file, state)
+
+    def load_state(self) -> None:
+        """Loads the state file, and the changes recorded in the journal since it was written"""
+        sequence = self.open_config(self.state_file) if os.path.isfile(self.state_file) else 0
+        journal = self.journal or StateJournal(self.state_file)
+        if journal.replay(self.state, sequence) and self.journal is None:
+            # Left behind by the journal backend, fold it into the state file
+            self._write_config(self.state_file, self._export_state(), journal.sequence)
+            journal.clear()
+
+    def get_save_stats(self) -> Dict[str, int]:
+        """Returns the number of times the state was changed, and the number of times the state
+        file was actually written (or failed to be).
+
+        :return: A dictionary with requested, performed and failed
+        :rtype: Dict[str, int]
+        """
+        return self.persister.stats()
 
-    def open_config(self, config_file: str):
+    def open_config(self, config_file: str) -> int:
+        """Loads the state from a config file
+
+        :param config_file: The config file
+        :type config_file: str
+        :return: The sequence number of the last journal entry the file holds (see StateJournal)
+        :rtype: int
+        """
         with open(config_file) as state_file:
             config = json.loads(state_file.read())
             file_version = config.get("streamdeck_ui_version", 0)
@@ -155,8 +248,11 @@ class StreamDeckServer:
 
             self.state = {}
             for deck_id, deck in config["state"].items():
-                deck["buttons"] = {int(page_id): {int(button_id): button for button_id, button in buttons.items()} for page_id, buttons in deck.get("buttons", {}).items()}
+                # Older versions stored every button, even if it was never configured
+                pages = {int(page_id): {int(button_id): ButtonState.from_dict(button) for button_id, button in buttons.items() if button} for page_id, buttons in deck.get("buttons", {}).items()}
+                deck["buttons"] = {page: buttons for page, buttons in pages.items() if buttons}
                 self.state[deck_id] = deck
+            return config.get("journal_sequence", 0)
 
     def import_config(self, config_file: str) -> None:
         self.stop()
@@ -165,14 +261,43 @@ class StreamDeckServer:
         self.start()
 
     def export_config(self, output_file: str) -> None:
+        self._write_config(output_file, self._export_state())
+
+    def _write_config(self, output_file: str, state: Dict[str, Dict[str, object]], journal_sequence: Optional[int] = None) -> None:
+        """Writes a snapshot of the state (see _export_state) to a config file
+
+        :param output_file: The config file
+        :type output_file: str
+        :param state: The snapshot of the state
+        :type state: Dict[str, Dict[str, object]]
+        :param journal_sequence: The sequence number of the last journal entry the snapshot holds, for the state file
+        :type journal_sequence: Optional[int], optional
+        """
+        config: Dict[str, object] = {"streamdeck_ui_version": CONFIG_FILE_VERSION, "state": state}
+        if journal_sequence is not None:
+            config["journal_sequence"] = journal_sequence
+        temporary_file = output_file + ".tmp"
         try:
-            with open(output_file + ".tmp", "w") as state_file:
-                state_file.write(json.dumps({"streamdeck_ui_version": CONFIG_FILE_VERSION, "state": self.state}, indent=4, separators=(",", ": ")))
+            with open(temporary_file, "w") as state_file:
+                state_file.write(json.dumps(config, indent=4, separators=(",", ": ")))
+            os.replace(temporary_file, os.path.realpath(output_file))
         except Exception as error:
             print(f"The configuration file '{output_file}' was not updated. Error: {error}")
+            try:
+                os.remove(temporary_file)
+            except OSError:
+                pass
             raise
-        else:
-            os.replace(output_file + ".tmp", os.path.realpath(output_file))
+
+    def _export_state(self) -> Dict[str, Dict[str, object]]:
+        """Returns the state the way it is stored in the state file. Later changes to the state don't affect it."""
+        exported: Dict[str, Dict[str, object]] = {}
+        for deck_id, deck in self.state.items():
+            exported[deck_id] = dict(deck)
+            if "buttons" in deck:
+                buttons = cast(Dict[int, Dict[int, ButtonState]], deck["buttons"])
+                exported[deck_id]["buttons"] = {page: {button: button_state.to_dict() for button, button_state in page_buttons.items()} for page, page_buttons in buttons.items()}
+        return exported
 
     def attached(self, streamdeck_id: str, streamdeck: StreamDeck):
         streamdeck.open()
@@ -183,6 +308,7 @@ class StreamDeckServer:
         # The detached event only knows about the id that got detached
         self.deck_ids[streamdeck_id] = serial_number
         self.decks[serial_number] = streamdeck
+        self.device_locks[serial_number] = DeviceLock(self.lock)
         self.initialize_state(serial_number, streamdeck.key_count())
         streamdeck.set_key_callback(partial(self._key_change_callback, serial_number))
         self.update_streamdeck_filters(serial_number)
@@ -198,17 +324,15 @@ class StreamDeckServer:
         self.plugevents.attached.emit({"id": streamdeck_id, "serial_number": serial_number, "type": streamdeck.deck_type(), "layout": streamdeck.key_layout()})
 
     def initialize_state(self, serial_number: str, buttons: int):
-        """Initializes the state for the given serial number. This allocates
-        buttons and pages based on the layout.
+        """Initializes the state for the given serial number. Buttons only get their
+        settings when they are configured.
 
         :param serial_number: The Stream Deck serial number
         :type serial_number: str
-        :param layout: The button layout for this Stream Deck
-        :type layout: Tuple[int, int]
+        :param buttons: The number of buttons on this Stream Deck
+        :type buttons: int
         """
-        for page in range(10):
-            for button in range(buttons):
-                self._button_state(serial_number, page, button)
+        self.state.setdefault(serial_number, {}).setdefault("buttons", {})
 
     def detached(self, id: str):
         serial_number = self.deck_ids.get(id, None)
@@ -219,6 +343,7 @@ class StreamDeckServer:
     def cleanup(self, id: str, serial_number: str):
         display_grid = self.display_handlers[serial_number]
         display_grid.stop()
+        display_grid.close()
         del self.display_handlers[serial_number]
 
         dimmer = self.dimmers[serial_number]
@@ -235,6 +360,7 @@ class StreamDeckServer:
             pass
 
         del self.decks[serial_number]
+        del self.device_locks[serial_number]
         del self.deck_ids[id]
 
     def start(self):
@@ -243,6 +369,8 @@ class StreamDeckServer:
         self.monitor.start()
 
     def stop(self):
+        # Don't lose the changes of the last moments
+        self.persister.flush()
         self.monitor.stop()
 
     def get_deck(self, deck_id: str) -> Dict[str, Dict[str, Union[str, Tuple[int, int]]]]:
@@ -255,46 +383,158 @@ class StreamDeckServer:
         """
         return {"type": self.decks[deck_id].deck_type(), "layout": self.decks[deck_id].key_layout()}
 
-    def _button_state(self, deck_id: str, page: int, button: int) -> dict:
-        buttons = self.state.setdefault(deck_id, {}).setdefault("buttons", {})
-        buttons_state = buttons.setdefault(page, {})  # type: ignore
-        return buttons_state.setdefault(button, {})  # type: ignore
+    @contextmanager
+    def batch(self) -> Iterator[ButtonChanges]:
+        """Groups changes to buttons, for example the icon, text and alignment of several
+        buttons. The button setters called in the batch only change the settings. When the
+        batch ends, the state is saved once, the filters of each changed button are rebuilt
+        once and each Stream Deck is told to update once. A batch in a batch joins the outer one.
+        Changes to the settings of a Stream Deck (brightness, page) are not batched.
 
-    def swap_buttons(self, deck_id: str, page: int, source_button: int, target_button: int) -> None:
-        """Swaps the properties of the source and target buttons"""
-        temp = cast(dict, self.state[deck_id]["buttons"])[page][source_button]
-        cast(dict, self.state[deck_id]["buttons"])[page][source_button] = cast(dict, self.state[deck_id]["buttons"])[page][target_button]
-        cast(dict, self.state[deck_id]["buttons"])[page][target_button] = temp
-        self._save_state()
+        Use as ``with api.batch() as changes: ...``. The changes.shown future is done (with
+        the result True) once the new images were sent to the Stream Decks, or with False when
+        a Stream Deck stopped first. The shown signal is raised for each Stream Deck as well.
 
-        # Update rendering for these two images
-        self.update_button_filters(deck_id, page, source_button)
-        self.update_button_filters(deck_id, page, target_button)
-        display_handler = self.display_handlers[deck_id]
-        display_handler.synchronize()
+        When the batch raises an error, the settings changed until then stay changed. They
+        are still saved and shown, as far as that succeeds, before the error is passed on.
+        """
+        if self.changes is not None:
+            yield self.changes
+            return
+
+        self.changes = ButtonChanges()
+        try:
+            yield self.changes
+        except BaseException:
+            changes = self.changes
+            self.changes = None
+            try:
+                self._apply_changes(changes)
+            except Exception as error:
+                # Don't hide the error of the batch
+                print(f"Unable to apply the changes of a failed batch: {error}")
+                if not changes.shown.done():
+                    resolve([changes.shown], False)
+            raise
+        changes = self.changes
+        self.changes = None
+        self._apply_changes(changes)
+
+    def _button_changed(self, deck_id: str, page: int, button: int, render: bool = False, switch_page: bool = False) -> Future:
+        """Records that the settings of a button changed. Outside a batch the change is applied right away.
+
+        :param render: True if the filters of the button must be rebuilt, defaults to False
+        :type render: bool, optional
+        :param switch_page: True if the page the button switches to changed, defaults to False
+        :type switch_page: bool, optional
+        :return: The future of the batch, done once the change was sent to the Stream Deck
+        :rtype: Future
+        """
+        if self.changes is None:
+            with self.batch() as changes:
+                self._button_changed(deck_id, page, button, render, switch_page)
+            return changes.shown
+
+        self.changes.saved.setdefault((deck_id, page), set()).add(button)
+        if render:
+            self.changes.rendered.setdefault((deck_id, page), set()).add(button)
+        if switch_page and page == self.get_page(deck_id):
+            self.changes.switch_pages.add(deck_id)
+        return self.changes.shown
+
+    def _apply_changes(self, changes: ButtonChanges) -> None:
+        """Saves the state, rebuilds the filters of the buttons and updates the Stream Decks changed in a batch"""
+        if not changes.saved:
+            resolve([changes.shown], True)
+            return
+
+        if self.journal is not None:
+            for (deck_id, page), buttons in changes.saved.items():
+                self.journal.mark(self.state, deck_id, page, buttons)
+        self.persister.request()
+
+        updated = set()
+        for (deck_id, page), buttons in changes.rendered.items():
+            if deck_id in self.display_handlers:
+                for button in buttons:
+                    self.update_button_filters(deck_id, page, button)
+                updated.add(deck_id)
+
+        for deck_id in changes.switch_pages:
+            self._prerender_reachable_pages(deck_id)
+
+        _resolve_when_done(changes.shown, [self._update_display(deck_id) for deck_id in updated])
 
-    def set_button_text(self, deck_id: str, page: int, button: int, text: str) -> None:
-        """Set the text associated with a button"""
+    def _update_display(self, deck_id: str) -> Future:
+        """Lets the display of a Stream Deck show the changes made so far, without waiting for it.
+        Raises the shown signal once they were sent to the Stream Deck.
+
+        :param deck_id: The Stream Deck serial number
+        :type deck_id: str
+        :return: A future that is done once the changes were sent to the Stream Deck
+        :rtype: Future
+        """
+        future = self.display_handlers[deck_id].update()
+        future.add_done_callback(lambda _: self.plugevents.shown.emit(deck_id))
+        return future
+
+    def get_button(self, deck_id: str, page: int, button: int) -> ButtonState:
+        """Returns all the settings of a button at once, for example to handle a key press.
+        The settings must not be changed, use the setters instead.
+
+        :param deck_id: The Stream Deck serial number
+        :type deck_id: str
+        :param page: The page index
+        :type page: int
+        :param button: The button index
+        :type button: int
+        :return: The settings of the button, DEFAULT_BUTTON if it was never configured
+        :rtype: ButtonState
+        """
+        return self.state.get(deck_id, {}).get("buttons", {}).get(page, {}).get(button, DEFAULT_BUTTON)  # type: ignore
+
+    def _button_state(self, deck_id: str, page: int, button: int) -> ButtonState:
+        """Returns the settings of a button to change them, creating them if the button was never configured"""
+        buttons = self.state.setdefault(deck_id, {}).setdefault("buttons", {}).setdefault(page, {})  # type: ignore
+        button_state = buttons.get(button, None)
+        if button_state is None:
+            button_state = buttons[button] = ButtonState()
+        return button_state
+
+    def swap_buttons(self, deck_id: str, page: int, source_button: int, target_button: int) -> Future:
+        """Swaps the properties of the source and target buttons. Returns a future that is done
+        once both buttons show their new images."""
+        buttons = self.state.setdefault(deck_id, {}).setdefault("buttons", {}).setdefault(page, {})  # type: ignore
+        source = buttons.pop(source_button, None)
+        target = buttons.pop(target_button, None)
+        if target is not None:
+            buttons[source_button] = target
+        if source is not None:
+            buttons[target_button] = source
+
+        with self.batch() as changes:
+            self._button_changed(deck_id, page, source_button, render=True)
+            self._button_changed(deck_id, page, target_button, render=True)
+        return changes.shown
+
+    def set_button_text(self, deck_id: str, page: int, button: int, text: str) -> Future:
+        """Set the text associated with a button. Returns a future that is done once the button shows it."""
         if self.get_button_text(deck_id, page, button) != text:
-            self._button_state(deck_id, page, button)["text"] = text
-            self._save_state()
-            self.update_button_filters(deck_id, page, button)
-            display_handler = self.display_handlers[deck_id]
-            display_handler.synchronize()
+            self._button_state(deck_id, page, button).text = text
+            return self._button_changed(deck_id, page, button, render=True)
+        return _completed()
 
     def get_button_text(self, deck_id: str, page: int, button: int) -> str:
         """Returns the text set for the specified button"""
-        return self._button_state(deck_id, page, button).get("text", "")
+        return self.get_button(deck_id, page, button).text
 
-    def set_button_icon(self, deck_id: str, page: int, button: int, icon: str) -> None:
-        """Sets the icon associated with a button"""
+    def set_button_icon(self, deck_id: str, page: int, button: int, icon: str) -> Future:
+        """Sets the icon associated with a button. Returns a future that is done once the button shows it."""
 
         if self.get_button_icon(deck_id, page, button) != icon:
-            self._button_state(deck_id, page, button)["icon"] = icon
-            self._save_state()
-            self.update_button_filters(deck_id, page, button)
-            display_handler = self.display_handlers[deck_id]
-            display_handler.synchronize()
+            self._button_state(deck_id, page, button).icon = icon
+            return self._button_changed(deck_id, page, button, render=True)
+        return _completed()
 
     def get_text_vertical_align(self, serial_number: str, page: int, button: int) -> str:
         """Gets the vertical text alignment. Values are bottom, middle-bottom, middle, middle-top, top
@@ -308,9 +548,9 @@ class StreamDeckServer:
         :return: The vertical alignment setting
         :rtype: str
         """
-        return self._button_state(serial_number, page, button).get("text_vertical_align", "")
+        return self.get_button(serial_number, page, button).text_vertical_align
 
-    def set_text_vertical_align(self, serial_number: str, page: int, button: int, alignment: str) -> None:
+    def set_text_vertical_align(self, serial_number: str, page: int, button: int, alignment: str) -> Future:
         """Gets the vertical text alignment. Values are top, middle, bottom
 
         :param serial_number: The Stream Deck serial number.
@@ -319,15 +559,50 @@ class StreamDeckServer:
         :type page: int
         :param button: The button index
         :type button: int
-        :return: The vertical alignment setting
-        :rtype: str
+        :param alignment: The vertical alignment setting
+        :type alignment: str
+        :return: A future that is done once the button shows the change
+        :rtype: Future
         """
         if self.get_text_vertical_align(serial_number, page, button) != alignment:
-            self._button_state(serial_number, page, button)["text_vertical_align"] = alignment
-            self._save_state()
-            self.update_button_filters(serial_number, page, button)
-            display_handler = self.display_handlers[serial_number]
-            display_handler.synchronize()
+            self._button_state(serial_number, page, button).text_vertical_align = alignment
+            return self._button_changed(serial_number, page, button, render=True)
+        return _completed()
+
+    def get_text_mode(self, serial_number: str, page: int, button: int) -> str:
+        """Gets how the text of a button is drawn. Values are "" (the whole label at once) and "atlas"
+        (from cached characters, for text that changes often like counters)
+
+        :param serial_number: The Stream Deck serial number.
+        :type serial_number: str
+        :param page: The page the button is on
+        :type page: int
+        :param button: The button index
+        :type button: int
+        :return: The text mode
+        :rtype: str
+        """
+        return self.get_button(serial_number, page, button).text_mode
+
+    def set_text_mode(self, serial_number: str, page: int, button: int, mode: str) -> Future:
+        """Sets how the text of a button is drawn. Values are "" (the whole label at once) and "atlas"
+        (from cached characters, for text that changes often like counters)
+
+        :param serial_number: The Stream Deck serial number.
+        :type serial_number: str
+        :param page: The page the button is on
+        :type page: int
+        :param button: The button index
+        :type button: int
+        :param mode: The text mode
+        :type mode: str
+        :return: A future that is done once the button shows the change
+        :rtype: Future
+        """
+        if self.get_text_mode(serial_number, page, button) != mode:
+            self._button_state(serial_number, page, button).text_mode = mode
+            return self._button_changed(serial_number, page, button, render=True)
+        return _completed()
 
     def get_button_icon_pixmap(self, deck_id: str, page: int, button: int) -> Optional[QPixmap]:
         """Returns the QPixmap value for the given button (streamdeck, page, button)
@@ -349,66 +624,107 @@ class StreamDeckServer:
             return QPixmap(qt_image)
         return None
 
+    def get_frame_cache_stats(self, deck_id: str) -> Dict[str, int]:
+        """Returns the counters of the native frame cache for the given Stream Deck
+
+        :param deck_id: The Stream Deck serial number
+        :type deck_id: str
+        :return: A dictionary with entries, bytes, max_bytes, hits, misses and evictions
+        :rtype: Dict[str, int]
+        """
+        return self.display_handlers[deck_id].frame_cache.stats()
+
+    def get_pipeline_cache_stats(self, deck_id: str) -> Dict[str, int]:
+        """Returns the counters of the pipeline output caches for the given Stream Deck
+
+        :param deck_id: The Stream Deck serial number
+        :type deck_id: str
+        :return: A dictionary with entries, bytes, max_bytes, hits, misses and evictions
+        :rtype: Dict[str, int]
+        """
+        return self.display_handlers[deck_id].pipeline_cache_stats()
+
+    def get_write_stats(self, deck_id: str) -> Dict[str, int]:
+        """Returns the number of key images sent to the given Stream Deck, writes skipped
+        because the key already showed that image, images dropped because a newer one
+        replaced them before they were sent, and images waiting to be sent.
+
+        :param deck_id: The Stream Deck serial number
+        :type deck_id: str
+        :return: A dictionary with sent, skipped, dropped and queued
+        :rtype: Dict[str, int]
+        """
+        return self.display_handlers[deck_id].write_stats()
+
+    def get_image_source_stats(self) -> Dict[str, int]:
+        """Returns the number of decoded images shared by the buttons of all Stream Decks,
+        the number of buttons using them, and the bytes they hold and save by being shared.
+
+        :return: A dictionary with sources, users, bytes and bytes_saved
+        :rtype: Dict[str, int]
+        """
+        return image_sources.stats()
+
     def get_button_icon(self, deck_id: str, page: int, button: int) -> str:
         """Returns the icon path for the specified button"""
-        return self._button_state(deck_id, page, button).get("icon", "")
+        return self.get_button(deck_id, page, button).icon
 
     def set_button_change_brightness(self, deck_id: str, page: int, button: int, amount: int) -> None:
         """Sets the brightness changing associated with a button"""
         if self.get_button_change_brightness(deck_id, page, button) != amount:
-            self._button_state(deck_id, page, button)["brightness_change"] = amount
-            self._save_state()
+            self._button_state(deck_id, page, button).brightness_change = amount
+            self._button_changed(deck_id, page, button)
 
     def get_button_change_brightness(self, deck_id: str, page: int, button: int) -> int:
         """Returns the brightness change set for a particular button"""
-        return self._button_state(deck_id, page, button).get("brightness_change", 0)
+        return self.get_button(deck_id, page, button).brightness_change
 
     def set_button_command(self, deck_id: str, page: int, button: int, command: str) -> None:
         """Sets the command associated with the button"""
         if self.get_button_command(deck_id, page, button) != command:
-            self._button_state(deck_id, page, button)["command"] = command
-            self._save_state()
+            self._button_state(deck_id, page, button).command = command
+            self._button_changed(deck_id, page, button)
 
     def get_button_command(self, deck_id: str, page: int, button: int) -> str:
         """Returns the command set for the specified button"""
-        return self._button_state(deck_id, page, button).get("command", "")
+        return self.get_button(deck_id, page, button).command
 
     def set_button_switch_page(self, deck_id: str, page: int, button: int, switch_page: int) -> None:
         """Sets the page switch associated with the button"""
         if self.get_button_switch_page(deck_id, page, button) != switch_page:
-            self._button_state(deck_id, page, button)["switch_page"] = switch_page
-            self._save_state()
+            self._button_state(deck_id, page, button).switch_page = switch_page
+            self._button_changed(deck_id, page, button, switch_page=True)
 
     def get_button_switch_page(self, deck_id: str, page: int, button: int) -> int:
         """Returns the page switch set for the specified button. 0 implies no page switch."""
-        return self._button_state(deck_id, page, button).get("switch_page", 0)
+        return self.get_button(deck_id, page, button).switch_page
 
     def set_button_keys(self, deck_id: str, page: int, button: int, keys: str) -> None:
         """Sets the keys associated with the button"""
         if self.get_button_keys(deck_id, page, button) != keys:
-            self._button_state(deck_id, page, button)["keys"] = keys
-            self._save_state()
+            self._button_state(deck_id, page, button).keys = keys
+            self._button_changed(deck_id, page, button)
 
     def get_button_keys(self, deck_id: str, page: int, button: int) -> str:
         """Returns the keys set for the specified button"""
-        return self._button_state(deck_id, page, button).get("keys", "")
+        return self.get_button(deck_id, page, button).keys
 
     def set_button_write(self, deck_id: str, page: int, button: int, write: str) -> None:
         """Sets the text meant to be written when button is pressed"""
         if self.get_button_write(deck_id, page, button) != write:
-            self._button_state(deck_id, page, button)["write"] = write
-            self._save_state()
+            self._button_state(deck_id, page, button).write = write
+            self._button_changed(deck_id, page, button)
 
     def get_button_write(self, deck_id: str, page: int, button: int) -> str:
         """Returns the text to be produced when the specified button is pressed"""
-        return self._button_state(deck_id, page, button).get("write", "")
+        return self.get_button(deck_id, page, button).write
 
     def set_brightness(self, deck_id: str, brightness: int) -> None:
         """Sets the brightness for every button on the deck"""
         if self.get_brightness(deck_id) != brightness:
             self.decks[deck_id].set_brightness(brightness)
             self.state.setdefault(deck_id, {})["brightness"] = brightness
-            self._save_state()
+            self._save_state(deck_id)
 
     def get_brightness(self, deck_id: str) -> int:
         """Gets the brightness that is set for the specified stream deck"""
@@ -422,7 +738,7 @@ class StreamDeckServer:
     def set_brightness_dimmed(self, deck_id: str, brightness_dimmed: int) -> None:
         """Sets the percentage value that will be used for dimming the full brightness"""
         self.state.setdefault(deck_id, {})["brightness_dimmed"] = brightness_dimmed
-        self._save_state()
+        self._save_state(deck_id)
 
     def change_brightness(self, deck_id: str, amount: int = 1) -> None:
         """Change the brightness of the deck by the specified amount"""
@@ -435,18 +751,36 @@ class StreamDeckServer:
         """Gets the current page shown on the stream deck"""
         return self.state.get(deck_id, {}).get("page", 0)  # type: ignore
 
-    def set_page(self, deck_id: str, page: int) -> None:
-        """Sets the current page shown on the stream deck"""
+    def set_page(self, deck_id: str, page: int) -> Future:
+        """Sets the current page shown on the stream deck. Returns a future that is done once
+        the page was sent to the Stream Deck."""
         if self.get_page(deck_id) != page:
             self.state.setdefault(deck_id, {})["page"] = page
-            self._save_state()
+            self._save_state(deck_id)
 
         display_handler = self.display_handlers[deck_id]
 
         # Let the display know to process new set of pipelines
         display_handler.set_page(page)
-        # Wait for at least one cycle
-        display_handler.synchronize()
+        shown = self._update_display(deck_id)
+        self._prerender_reachable_pages(deck_id)
+        return shown
+
+    def _prerender_reachable_pages(self, deck_id: str) -> None:
+        """Lets the display prerender the pages that the buttons on the current page switch to,
+        so switching to them is fast.
+
+        :param deck_id: The Stream Deck serial number
+        :type deck_id: str
+        """
+        display_handler = self.display_handlers.get(deck_id, None)
+        if display_handler is None:
+            return
+
+        page = self.get_page(deck_id)
+        buttons = cast(dict, self.state[deck_id].get("buttons", {})).get(page, {})
+        pages = {button_state.switch_page - 1 for button_state in buttons.values()}
+        display_handler.prerender(pages - {-1, page})
 
     def update_streamdeck_filters(self, serial_number: str):
         """Updates the filters for all the StreamDeck buttons.
@@ -455,7 +789,7 @@ class StreamDeckServer:
         :type serial_number: str
         """
 
-        for deck_id, deck_state in self.state.items():
+        for deck_id in self.state:
             deck = self.decks.get(deck_id, None)
 
             # Deck is not attached right now
@@ -466,19 +800,19 @@ class StreamDeckServer:
             if deck_id != serial_number:
                 continue
 
-            # FIXME: Debug this - linter says there should not be a length. Issue is the way
-            # the type hinting is defined causes it to believe there *may* not be a list
-            pages = len(deck_state["buttons"])  # type: ignore
-
-            display_handler = self.display_handlers.get(serial_number, DisplayGrid(self.lock, deck, pages, self.cpu_usage_callback))
+            if serial_number not in self.display_handlers:
+                # Only create a display when needed, it may start render processes
+                self.display_handlers[serial_number] = DisplayGrid(self.device_locks[serial_number], deck, PAGES, self.cpu_usage_callback, renderer=RENDERER)
+            display_handler = self.display_handlers[serial_number]
             display_handler.set_page(self.get_page(deck_id))
-            self.display_handlers[serial_number] = display_handler
 
-            for page, buttons in deck_state.get("buttons", {}).items():  # type: ignore
-                for button in buttons:
+            # Buttons that were never configured still show as pressed
+            for page in range(PAGES):
+                for button in range(deck.key_count()):
                     self.update_button_filters(serial_number, page, button)
 
             display_handler.start()
+            self._prerender_reachable_pages(deck_id)
 
     def update_button_filters(self, serial_number: str, page: int, button: int):
         """Sets the filters for a given button. Any previous filters are replaced.
@@ -493,22 +827,45 @@ class StreamDeckServer:
         :type size: tuple, optional
         """
         display_handler = self.display_handlers[serial_number]
-        button_settings = self._button_state(serial_number, page, button)
+        button_settings = self.get_button(serial_number, page, button)
         filters: List[Filter] = []
 
-        icon = button_settings.get("icon")
-        if icon:
+        if button_settings.icon:
             # Now we have deck, page and buttons
-            filters.append(ImageFilter(icon))
-
-        if button_settings.get("pulse"):
-            filters.append(PulseFilter())
+            filters.append(ImageFilter(button_settings.icon))
 
-        text = button_settings.get("text")
-        font = button_settings.get("font", DEFAULT_FONT)
-        vertical_align = button_settings.get("text_vertical_align", "")
+        if button_settings.pulse:
+            # The period is in milliseconds in the state file
+            filters.append(PulseFilter(button_settings.pulse_period * NANOSECONDS_PER_MILLISECOND, button_settings.pulse_curve))
 
-        if text:
-            filters.append(TextFilter(text, font, vertical_align))
+        if button_settings.text:
+            filters.append(TextFilter(button_settings.text, button_settings.font, button_settings.text_vertical_align, button_settings.text_mode))
 
         display_handler.replace(page, button, filters)
+
+
+def _completed() -> Future:
+    """Returns a future that is already done, for changes that don't have to be sent to a Stream Deck"""
+    future: Future = Future()
+    resolve([future], True)
+    return future
+
+
+def _resolve_when_done(target: Future, futures: List[Future]) -> None:
+    """Completes the target future once all the futures are done. The result is True if all their results are."""
+    if not futures:
+        resolve([target], True)
+        return
+
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        resolve([target], all(future.result() for future in futures))
+
+    for future in futures:
+        future.add_done_callback(done)
@@ -0,0 +1,103 @@
+from typing import Any, Dict, Optional
+
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display.clock import NANOSECONDS_PER_MILLISECOND
+from streamdeck_ui.display.pulse_filter import PULSE_PERIOD
+from streamdeck_ui.display.text_filter import TEXT_MODE_LABEL
+
+
+class ButtonState:
+    """
+    The settings of one button. Only buttons that were configured have one, the others use
+    DEFAULT_BUTTON. Settings that still have their default value are left out of the state
+    file, so it only holds what was actually configured.
+    """
+
+    __slots__ = (
+        "text",
+        "icon",
+        "font",
+        "text_vertical_align",
+        "text_mode",
+        "command",
+        "keys",
+        "write",
+        "switch_page",
+        "brightness_change",
+        "pulse",
+        "pulse_period",
+        "pulse_curve",
+        "extra",
+    )
+
+    def __init__(self) -> None:
+        """Creates the settings of a button that was not configured yet"""
+        self.text = ""
+        self.icon = ""
+        "The path of the image shown on the button"
+        self.font = DEFAULT_FONT
+        self.text_vertical_align = ""
+        self.text_mode = TEXT_MODE_LABEL
+        self.command = ""
+        "The command run when the button is pressed"
+        self.keys = ""
+        "The keys pressed when the button is pressed"
+        self.write = ""
+        "The text typed when the button is pressed"
+        self.switch_page = 0
+        "The page (counting from 1) switched to when the button is pressed, 0 for none"
+        self.brightness_change = 0
+        self.pulse = False
+        self.pulse_period = PULSE_PERIOD // NANOSECONDS_PER_MILLISECOND
+        "The time a pulse takes in milliseconds"
+        self.pulse_curve = "blink"
+        self.extra: Optional[Dict[str, Any]] = None
+        "Settings this version does not know, kept so they are written back unchanged"
+
+    @classmethod
+    def from_dict(cls, settings: Dict[str, Any]) -> "ButtonState":
+        """Creates the settings of a button from the way they are stored in the state file
+
+        :param settings: The settings of the button
+        :type settings: Dict[str, Any]
+        :return: The button settings
+        :rtype: ButtonState
+        """
+        button_state = cls()
+        for name, value in settings.items():
+            if name in _FIELDS:
+                setattr(button_state, name, value)
+            else:
+                if button_state.extra is None:
+                    button_state.extra = {}
+                button_state.extra[name] = value
+        return button_state
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the settings that differ from the defaults, the way they are stored in the state file
+
+        :return: The settings of the button
+        :rtype: Dict[str, Any]
+        """
+        settings = {}
+        for name, default in _DEFAULTS:
+            value = getattr(self, name)
+            if value != default:
+                settings[name] = value
+        if self.extra:
+            settings.update(self.extra)
+        return settings
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ButtonState) and all(getattr(self, name) == getattr(other, name) for name in ButtonState.__slots__)
+
+    # The settings change, so a button state can't be a dictionary key or in a set
+    __hash__ = None  # type: ignore [assignment]
+
+
+_FIELDS = tuple(name for name in ButtonState.__slots__ if name != "extra")
+
+DEFAULT_BUTTON = ButtonState()
+"The settings of every button that was not configured. Must not be changed."
+
+_DEFAULTS = tuple((name, getattr(DEFAULT_BUTTON, name)) for name in _FIELDS)
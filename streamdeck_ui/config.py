@@ -6,4 +6,10 @@ LOGO = os.path.join(PROJECT_PATH, "logo.png")
 FONTS_PATH = os.path.join(PROJECT_PATH, "fonts")
 DEFAULT_FONT = os.path.join("roboto", "Roboto-Regular.ttf")
 STATE_FILE = os.environ.get("STREAMDECK_UI_CONFIG", os.path.expanduser("~/.streamdeck_ui.json"))
+ICON_CACHE_PATH = os.environ.get("STREAMDECK_UI_CACHE", os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "streamdeck_ui"))
+ICON_CACHE_SIZE = 64 * 1024 * 1024  # Maximum bytes of decoded icons kept on disk, 0 disables the cache
+ICON_MEMORY_LIMIT = int(os.environ.get("STREAMDECK_UI_ICON_MEMORY_LIMIT", 8 * 1024 * 1024))  # Animations that decode to more bytes are streamed from the file
+RENDERER = os.environ.get("STREAMDECK_UI_RENDERER", "serial")  # How button pipelines are processed, see DisplayGrid
+STATE_BACKEND = os.environ.get("STREAMDECK_UI_STATE_BACKEND", "json")  # "json" rewrites the state file on every save, "journal" appends the changes to a journal, see StateJournal
+PAGES = 10  # The number of pages of buttons on every Stream Deck
 CONFIG_FILE_VERSION = 1  # Update only if backward incompatible changes are made to the config file
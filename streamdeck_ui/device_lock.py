@@ -0,0 +1,87 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class EnumerationBarrier:
+    """A reader/writer lock that keeps device enumeration away from device I/O.
+
+    Any number of Stream Decks can do I/O at the same time by holding the shared side,
+    while enumeration takes the exclusive side. Using the barrier itself in a `with`
+    statement takes the exclusive side, so it can be used anywhere a plain lock was used
+    to guard enumeration. Waiting enumerations take priority over new device I/O, so a
+    busy deck can't starve the monitor.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        "The number of threads holding the shared side"
+        self.writer = False
+        "True while a thread holds the exclusive side"
+        self.writers_waiting = 0
+
+    def acquire_shared(self) -> None:
+        with self.condition:
+            while self.writer or self.writers_waiting:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_shared(self) -> None:
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire(self) -> None:
+        with self.condition:
+            self.writers_waiting += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writer = True
+
+    def release(self) -> None:
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        """Holds the shared side for the duration of a `with` statement."""
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class DeviceLock:
+    """The lock for a single Stream Deck. Holding it gives exclusive access to that
+    device, and keeps enumeration from running, without blocking other devices.
+    """
+
+    def __init__(self, barrier: EnumerationBarrier):
+        """Creates a new device lock
+
+        :param barrier: The barrier shared with device enumeration
+        :type barrier: EnumerationBarrier
+        """
+        self.barrier = barrier
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        # Always take the barrier before the device lock, so enumeration and devices
+        # can't deadlock on each other.
+        self.barrier.acquire_shared()
+        self.lock.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.lock.release()
+        self.barrier.release_shared()
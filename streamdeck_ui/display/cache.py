@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    A thread safe, least recently used cache that is bounded by the number of bytes
+    held rather than the number of entries. When adding an entry pushes the cache over
+    its budget, the least recently used entries are evicted until it fits again. A value
+    stored under several keys (the same object, for example an image a filter passed
+    through) is counted once.
+    """
+
+    def __init__(self, max_bytes: int, size_of: Callable[[V], int] = len):  # type: ignore [assignment]
+        """Creates a new cache
+
+        :param max_bytes: The maximum number of bytes the cache may hold
+        :type max_bytes: int
+        :param size_of: A function that returns the size in bytes of a value, defaults to len
+        :type size_of: Callable[[V], int], optional
+        """
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.entries: "OrderedDict[Hashable, V]" = OrderedDict()
+        self.sizes: Dict[Hashable, int] = {}
+        self.references: Dict[int, int] = {}
+        "The number of keys each value is stored under, by the id of the value"
+        self.size = 0
+        "The number of bytes currently held by the cache"
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Returns the value for the given key, or None if it is not cached. A hit marks
+        the entry as most recently used.
+        """
+        with self.lock:
+            value = self.entries.get(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        """Adds (or replaces) the value for the given key. Values larger than the
+        whole budget are not cached.
+        """
+        size = self.size_of(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = value
+            self.sizes[key] = size
+            references = self.references.get(id(value), 0)
+            self.references[id(value)] = references + 1
+            if not references:
+                self.size += size
+            self._evict(self.max_bytes)
+
+    def trim(self, max_bytes: int) -> int:
+        """Evicts least recently used entries until at most max_bytes are held.
+
+        :param max_bytes: The number of bytes to shrink the cache to
+        :type max_bytes: int
+        :return: The number of bytes released
+        :rtype: int
+        """
+        with self.lock:
+            size = self.size
+            self._evict(max_bytes)
+            return size - self.size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.references.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the cache counters
+
+        :return: A dictionary with entries, bytes, max_bytes, hits, misses and evictions
+        :rtype: Dict[str, int]
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        value = self.entries.pop(key)
+        size = self.sizes.pop(key)
+        references = self.references.pop(id(value)) - 1
+        if references:
+            self.references[id(value)] = references
+        else:
+            self.size -= size
+
+    def _evict(self, max_bytes: int) -> None:
+        while self.size > max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.evictions += 1
@@ -0,0 +1,37 @@
+import time
+from typing import Callable
+
+NANOSECONDS_PER_SECOND = 1_000_000_000
+NANOSECONDS_PER_MILLISECOND = 1_000_000
+
+Clock = Callable[[], int]
+"""A clock returns the current time in integer nanoseconds. Only the difference between two
+readings is meaningful, so the clock must never go back, and must not jump when the system
+time is changed."""
+
+monotonic_clock: Clock = time.monotonic_ns
+"The clock displays use unless told otherwise"
+
+
+class SimulatedClock:
+    """A clock that only moves when it is told to, so tests and benchmarks can drive
+    displays and pipelines through time without waiting for it."""
+
+    def __init__(self, now: int = 0):
+        """Creates a new simulated clock
+
+        :param now: The time the clock starts at in nanoseconds, defaults to 0
+        :type now: int, optional
+        """
+        self.now = now
+
+    def __call__(self) -> int:
+        return self.now
+
+    def advance(self, nanoseconds: int) -> None:
+        """Moves the clock forward
+
+        :param nanoseconds: The number of nanoseconds to move forward
+        :type nanoseconds: int
+        """
+        self.now += nanoseconds
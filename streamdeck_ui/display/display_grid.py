@@ -1,17 +1,29 @@
+import heapq
+import os
 import threading
-from time import sleep, time
-from typing import Callable, Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Set, Tuple
 
 from PIL import Image
 from StreamDeck.Devices.StreamDeck import StreamDeck
 from StreamDeck.Devices.StreamDeckOriginal import StreamDeckOriginal
 from StreamDeck.ImageHelpers import PILHelper
-from StreamDeck.Transport.Transport import TransportError
 
+from streamdeck_ui.display.cache import LRUCache
+from streamdeck_ui.display.clock import NANOSECONDS_PER_MILLISECOND, NANOSECONDS_PER_SECOND, Clock, monotonic_clock
 from streamdeck_ui.display.empty_filter import EmptyFilter
 from streamdeck_ui.display.filter import Filter
+from streamdeck_ui.display.key_writer import KeyWriter, resolve
 from streamdeck_ui.display.keypress_filter import KeypressFilter
 from streamdeck_ui.display.pipeline import Pipeline
+from streamdeck_ui.display.process_renderer import ProcessRenderer, RenderProcessError
+
+RENDERERS = ("serial", "thread", "process")
+"The supported ways of processing the pipelines of a frame"
+
+RENDER_THREADS = os.cpu_count() or 2
+"The number of threads in the shared render pool"
 
 
 class DisplayGrid:
@@ -23,13 +35,29 @@ class DisplayGrid:
     _empty_filter: EmptyFilter = EmptyFilter()
     "Static instance of EmptyFilter shared by all pipelines"
 
-    def __init__(self, lock: threading.Lock, streamdeck: StreamDeck, pages: int, cpu_callback: Callable[[str, int], None], fps: int = 25):
+    _render_pool: Optional[ThreadPoolExecutor] = None
+    "Thread pool shared by all displays that render with the thread renderer"
+
+    _render_pool_lock = threading.Lock()
+
+    def __init__(
+        self,
+        lock: ContextManager,
+        streamdeck: StreamDeck,
+        pages: int,
+        cpu_callback: Callable[[str, int], None],
+        fps: int = 25,
+        frame_cache_size: int = 16 * 1024 * 1024,
+        pipeline_cache_size: int = 64 * 1024 * 1024,
+        renderer: str = "serial",
+        clock: Clock = monotonic_clock,
+    ):
         """Creates a new display instance
 
-        :param lock: A lock object that will be used to get exclusive access while enumerating
-        Stream Decks. This lock must be shared by any object that will read or write to the
-        Stream Deck.
-        :type lock: threading.Lock
+        :param lock: The lock that gives exclusive access to this Stream Deck. It must keep
+        enumeration of Stream Decks from running while held (see DeviceLock), and must be
+        used by any object that will read or write to the Stream Deck.
+        :type lock: ContextManager
         :param streamdeck: The StreamDeck instance associated with this display
         :type streamdeck: StreamDeck
         :param pages: The number of logical pages (screen sets)
@@ -38,6 +66,19 @@ class DisplayGrid:
         :type cpu_callback: Callable[[str, int], None]
         :param fps: The desired FPS, defaults to 25
         :type fps: int, optional
+        :param frame_cache_size: The maximum number of bytes of native (device format) frames
+        to keep cached, defaults to 16 MB
+        :type frame_cache_size: int, optional
+        :param pipeline_cache_size: The maximum number of bytes of intermediate images the
+        pipelines of all pages may keep cached combined, defaults to 64 MB
+        :type pipeline_cache_size: int, optional
+        :param renderer: How the pipelines of a frame are processed. Either "serial", one after
+        the other on the display thread, "thread", in parallel on a thread pool shared by all
+        displays, or "process", in worker processes owned by this display. Defaults to "serial"
+        :type renderer: str, optional
+        :param clock: The clock that drives the animations, and decides when frames are due. Defaults
+        to the monotonic clock of the system, tests can pass a SimulatedClock.
+        :type clock: Clock, optional
         """
         self.streamdeck = streamdeck
         # Reference to the actual device, used to update icons
@@ -53,9 +94,13 @@ class DisplayGrid:
         # A dictionary of lists of pipelines. Each page has
         # a list, corresponding to each button.
 
+        self.keypresses: Dict[int, Dict[int, KeypressFilter]] = {}
+        # The keypress filter of each pipeline, so a key press doesn't have to look for it
+
         # Initialize with a pipeline per key for all pages
         for page in range(pages):
             self.pages[page] = {}
+            self.keypresses[page] = {}
             for button in range(self.streamdeck.key_count()):
                 self.pages[page][button] = Pipeline()
 
@@ -63,16 +108,86 @@ class DisplayGrid:
         self.pipeline_thread: Optional[threading.Thread] = None
         self.quit = threading.Event()
         self.fps = fps
+        self.clock = clock
         # Configure the maximum frame rate we want to achieve
         self.time_per_frame = 1 / fps
-        self.lock = lock
+        self.device_lock = lock
+        self.lock = threading.Lock()
+        # Protects the pages and pipelines. Separate from the device lock, so the UI
+        # can read images while the device is busy.
         self.sync = threading.Event()
         self.cpu_callback = cpu_callback
         # The sync event allows a caller to wait until all the buttons have been processed
+        self.frame_cache: LRUCache[bytes] = LRUCache(frame_cache_size)
+        # Native frames keyed by pipeline hash. Lives as long as the display, so frames
+        # survive page switches and restarts of the render thread.
+        self.pipeline_cache_size = pipeline_cache_size
+        # The budget (in bytes) for the output caches of all pipelines combined
+        self.wake = threading.Event()
+        # The wake event interrupts the render thread while it waits for the next deadline
+        self.dirty: Set[int] = set()
+        # Buttons on the current page that must be processed in the next cycle
+        self.presses: Dict[int, int] = {}
+        # Buttons on the current page that were pressed or released, and when. The next cycle
+        # renders them before the other buttons.
+        self.waiters: List[Future] = []
+        # Futures waiting for the next cycle to reach the device, see update
+        self.prerender_pages: Set[int] = set()
+        # Pages that are likely to be shown next, and are kept rendered ahead of time
+        self.prerender_queue: Set[int] = set()
+        # Pages that still have to be prerendered
+        self.pending: Dict[Tuple[int, int], List[Filter]] = {}
+        # The filters of (page, button) whose pipelines have not been built yet
+        self.build_lock = threading.Lock()
+        # Held while building a pipeline, so the pipelines of a button are put in place in order
+        self.writer = KeyWriter(lock, streamdeck, self._writer_failed, clock)
+        # Sends the rendered images to the device on its own thread
+        if renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer '{renderer}', expected one of {', '.join(RENDERERS)}")
+        self.renderer = renderer
+        self.process_renderer: Optional[ProcessRenderer] = None
+        if renderer == "process":
+            self.process_renderer = ProcessRenderer(self.size, streamdeck.key_image_format(), streamdeck.key_count())
+        self.process_filters: Dict[Tuple[int, int], List[Filter]] = {}
+        # The filters of (page, button) the worker processes built pipelines from, so they
+        # can be built here instead when a worker fails
         DisplayGrid._empty_filter.initialize(self.size)
 
     def replace(self, page: int, button: int, filters: List[Filter]):
+        """Replaces the filters of a button. The pipeline is only built right away when the
+        page is displayed. Other pages are built when they are switched to, prerendered or
+        when the display is idle, so the number of pages does not slow down showing the first one.
+        """
         with self.lock:
+            if page != self.current_page:
+                self.pending[(page, button)] = filters
+                if page in self.prerender_pages:
+                    self.prerender_queue.add(page)
+                self.wake.set()
+                return
+
+        with self.build_lock:
+            with self.lock:
+                self.pending.pop((page, button), None)
+            self._build(page, button, filters)
+        self.wake.set()
+
+    def _build(self, page: int, button: int, filters: List[Filter]):
+        """Builds the pipeline for a button and puts it in place. Must hold the build lock."""
+        keypress: Optional[KeypressFilter] = None
+        renderer = self.process_renderer
+        if renderer is not None:
+            # The workers build and own the pipelines. Keep an empty one here as a placeholder.
+            with self.lock:
+                self.process_filters[(page, button)] = filters
+            try:
+                renderer.replace(page, button, filters)
+            except RenderProcessError as error:
+                # Built here later on, along with the pipelines the workers owned
+                self._stop_process_renderer(error)
+                return
+            pipeline = Pipeline()
+        else:
             pipeline = Pipeline()
             pipeline.add(DisplayGrid._empty_filter)
             for filter in filters:
@@ -81,9 +196,77 @@ class DisplayGrid:
             keypress = KeypressFilter()
             keypress.initialize(self.size)
             pipeline.add(keypress)
+            if self.streamdeck.is_visual():
+                # Encode the frames of an animation once, rather than every time they are shown
+                # Decks of the same model share the frames
+                pipeline.compile(lambda image: PILHelper.to_native_format(self.streamdeck, image), encoding=tuple(sorted(self.streamdeck.key_image_format().items())))
+
+        with self.lock:
             self.pages[page][button] = pipeline
+            if keypress is None:
+                self.keypresses[page].pop(button, None)
+            else:
+                self.keypresses[page][button] = keypress
+            if page == self.current_page:
+                self.dirty.add(button)
+            elif page in self.prerender_pages:
+                self.prerender_queue.add(page)
+
+    def _build_pending(self, page: Optional[int] = None, stop: Optional[threading.Event] = None) -> bool:
+        """Builds the pipelines that were replaced while their page was not displayed.
+
+        :param page: Only build the buttons of this page, defaults to all pages
+        :type page: Optional[int], optional
+        :param stop: Stop building as soon as this event is set, defaults to None
+        :type stop: Optional[threading.Event], optional
+        :return: True if there are pipelines left to build
+        :rtype: bool
+        """
+        with self.lock:
+            work = [(key, filters) for key, filters in self.pending.items() if page is None or key[0] == page]
+
+        for (pending_page, button), filters in work:
+            if stop is not None and stop.is_set():
+                return True
+            with self.build_lock:
+                with self.lock:
+                    if self.pending.get((pending_page, button), None) is not filters:
+                        # Replaced or built in the meantime
+                        continue
+                    del self.pending[(pending_page, button)]
+                self._build(pending_page, button, filters)
+        return False
+
+    def _stop_process_renderer(self, error: RenderProcessError) -> None:
+        """Renders in this process from now on, after a worker process of the process renderer
+        failed. The pipelines the workers owned are built again from their filters. Must hold
+        the build lock.
+        """
+        renderer = self.process_renderer
+        if renderer is None:
+            # Another thread got here first
+            return
+        print(f"{error}, rendering in this process instead")
+        with self.lock:
+            self.process_renderer = None
+            self.renderer = "serial"
+            for key, filters in self.process_filters.items():
+                # Filters that were replaced in the meantime are newer
+                self.pending.setdefault(key, filters)
+            self.process_filters = {}
+        renderer.close()
+        self.wake.set()
 
     def get_image(self, page: int, button: int) -> Image.Image:
+        renderer = self.process_renderer
+        if renderer is not None:
+            try:
+                return renderer.get_image(page, button)
+            except RenderProcessError as error:
+                with self.build_lock:
+                    self._stop_process_renderer(error)
+                self._build_pending(page)
+
         with self.lock:
             # REVIEW: Consider returning not the last result, but a thumbnail
             # or something that represents the current "static" look of
@@ -91,11 +274,168 @@ class DisplayGrid:
             # of a filter.
             return self.pages[page][button].last_result()
 
+    def write_stats(self) -> Dict[str, int]:
+        """Returns the number of key images written to the device, the number of writes
+        that were skipped because the key already showed the same image, the number of
+        images dropped because a newer one replaced them before they were sent, and the
+        number of images waiting to be sent.
+
+        :return: A dictionary with sent, skipped, dropped and queued
+        :rtype: Dict[str, int]
+        """
+        return self.writer.stats()
+
+    def _writer_failed(self):
+        """Called on the writer thread when the Stream Deck can no longer be written to."""
+        self.quit.set()
+        self.wake.set()
+
+    def pipeline_cache_stats(self) -> Dict[str, int]:
+        """Returns the output cache counters summed over all the pipelines
+
+        :return: A dictionary with entries, bytes, max_bytes, hits, misses and evictions
+        :rtype: Dict[str, int]
+        """
+        totals = {"entries": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0}
+        with self.lock:
+            pipelines = [pipeline for page in self.pages.values() for pipeline in page.values()]
+        for pipeline in pipelines:
+            for key, value in pipeline.output_cache.stats().items():
+                if key in totals:
+                    totals[key] += value
+        totals["max_bytes"] = self.pipeline_cache_size
+        return totals
+
+    def _enforce_pipeline_cache_budget(self):
+        """Trims the pipeline output caches until they fit in the deck wide budget. Pipelines
+        of pages that are not displayed are released first, the pipelines of the current page
+        are then trimmed to an equal share of the budget.
+        """
+        with self.lock:
+            current_page = self.current_page
+            pages = {page_id: list(page.values()) for page_id, page in self.pages.items()}
+
+        total = sum(pipeline.output_cache.size for pipelines in pages.values() for pipeline in pipelines)
+        if total <= self.pipeline_cache_size:
+            return
+
+        for page_id, pipelines in pages.items():
+            if page_id == current_page:
+                continue
+            for pipeline in pipelines:
+                total -= pipeline.output_cache.trim(0)
+                if total <= self.pipeline_cache_size:
+                    return
+
+        current_pipelines = pages.get(current_page, [])
+        if current_pipelines:
+            share = self.pipeline_cache_size // len(current_pipelines)
+            for pipeline in current_pipelines:
+                pipeline.output_cache.trim(share)
+
     def set_keypress(self, button: int, active: bool):
+        """Shows a key as pressed or released. When the image for that was rendered ahead of
+        time (see _prepare_keypresses), it is sent right away. Otherwise the render thread
+        renders the key before any other. Either way, the image is written before any other.
+        """
+        pressed_at = self.clock()
+        renderer = self.process_renderer
+        if renderer is not None:
+            try:
+                renderer.set_keypress(self.current_page, button, active)
+            except RenderProcessError as error:
+                with self.build_lock:
+                    self._stop_process_renderer(error)
+
+        native_image = None
         with self.lock:
-            for filter in self.pages[self.current_page][button].filters:
-                if isinstance(filter[0], KeypressFilter):
-                    filter[0].active = active
+            keypress = self.keypresses[self.current_page].get(button, None)
+            if keypress is not None:
+                keypress.active = active
+                hashcode = self._keypress_hash(self.pages[self.current_page][button], keypress, active)
+                if hashcode is not None:
+                    native_image = self.frame_cache.get(hashcode)
+            if native_image is None:
+                self.presses[button] = pressed_at
+            # The pipeline has to catch up either way
+            self.dirty.add(button)
+        if native_image is not None:
+            self.writer.submit(button, native_image, pressed_at)
+        self.wake.set()
+
+    def _keypress_hash(self, pipeline: Pipeline, keypress: KeypressFilter, active: bool) -> Optional[int]:
+        """Returns the pipeline hash the output of a pipeline has, when its key is pressed or released
+        while the rest of the filters stay the same, or None if that isn't known. Must hold the lock.
+        """
+        if pipeline.replaying or not pipeline.filters or not self.streamdeck.is_visual():
+            # The hashes are only kept up to date while the filters run
+            return None
+        # The keypress filter is the last one
+        return hash((keypress.active_hash if active else keypress.inactive_hash, pipeline.input_hashes[-1]))
+
+    def _prepare_keypresses(self, page_number: int, buttons: Iterable[int], stop: threading.Event):
+        """Renders how the given keys of the current page look while pressed, so a key press only has
+        to send the image. Only worth it for keys that don't change on their own.
+        """
+        for button in buttons:
+            if stop.is_set():
+                return
+            with self.lock:
+                pipeline = self.pages[page_number][button]
+                keypress = self.keypresses[page_number].get(button, None)
+                if keypress is None or keypress.last_state:
+                    continue
+                hashcode = self._keypress_hash(pipeline, keypress, True)
+                if hashcode is None or hashcode in self.frame_cache:
+                    continue
+                # While the key is released, the output is the input of the keypress filter
+                image = pipeline.last_result()
+                if image is None:
+                    continue
+            image = keypress.pressed_image(image)
+            # The pipeline finds it in its cache when the key is pressed
+            pipeline.output_cache.put(hashcode, image)
+            self.frame_cache.put(hashcode, PILHelper.to_native_format(self.streamdeck, image))
+
+    def press_latency_stats(self) -> Dict[str, float]:
+        """Returns how long it took from key presses until their images were written
+
+        :return: A dictionary with the number of presses, and the mean and maximum latency in milliseconds
+        :rtype: Dict[str, float]
+        """
+        return self.writer.press_latency_stats()
+
+    def prerender(self, pages: Iterable[int]):
+        """Renders the given pages in the background, when the display is otherwise idle, so
+        switching to one of them only has to write cached frames to the device. Replaces the
+        pages given in a previous call.
+
+        :param pages: The page numbers that are likely to be shown next
+        :type pages: Iterable[int]
+        """
+        with self.lock:
+            pages = {page for page in pages if page in self.pages}
+            self.prerender_queue = (self.prerender_queue & pages) | (pages - self.prerender_pages)
+            self.prerender_pages = pages
+        self.wake.set()
+
+    def _prerender_next(self, current_page: int, current_time: int):
+        """Prerenders one of the queued pages"""
+        with self.lock:
+            self.prerender_queue.discard(current_page)
+            if not self.prerender_queue:
+                return
+            page_number = self.prerender_queue.pop()
+            more = bool(self.prerender_queue)
+
+        self._build_pending(page_number)
+        with self.lock:
+            page = self.pages[page_number]
+
+        # The results are dropped, what matters is that the frames are now cached
+        self._render_frame(page_number, page, set(page.keys()), current_time, True)
+        if more:
+            self.wake.set()
 
     def synchronize(self):
         # Wait until the next cycle is complete.
@@ -103,22 +443,158 @@ class DisplayGrid:
         # The first gets you to the end of one cycle (you could have called it
         # mid cycle). The second gets you one pass through. Worst case, you
         # do two full cycles. Best case, you do 1 full and one partial.
-        self.sync.wait()
-        self.sync.wait()
+        # The render thread may be waiting for a deadline, so wake it up for each pass
+        # (and again if the end of a cycle was missed while getting ready to wait).
+        for _ in range(2):
+            self.wake.set()
+            while not self.sync.wait(self.time_per_frame):
+                self.wake.set()
+        # Then wait for the images of those cycles to be sent to the device
+        self.writer.flush()
+
+    def update(self) -> Future:
+        """Lets the render thread process the changes made so far, without waiting for it.
+        Unlike synchronize, this doesn't block the caller.
+
+        :return: A future that is done once the resulting images were sent to the device. Its
+        result is True, or False if the display was stopped (or the device failed) first.
+        :rtype: Future
+        """
+        future: Future = Future()
+        with self.lock:
+            if self.quit.is_set():
+                resolve([future], False)
+                return future
+            self.waiters.append(future)
+        self.wake.set()
+        return future
+
+    def _render_frame(self, page_number: int, page: Dict[int, Pipeline], due: Set[int], current_time: int, force_update: bool) -> List[Tuple[int, Pipeline, Optional[bytes], Optional[int]]]:
+        """Processes the pipelines of the given buttons, on the render pool or the worker
+        processes when the thread or process renderer is used.
+
+        :return: A list of (button, pipeline, native image, next change). The native image
+        is None when the button did not change.
+        :rtype: List[Tuple[int, Pipeline, Optional[bytes], Optional[int]]]
+        """
+        work = [(button, pipeline) for button, pipeline in page.items() if button in due]
+
+        renderer = self.process_renderer
+        if renderer is not None:
+            try:
+                rendered = renderer.render(page_number, [button for button, _ in work], current_time, force_update)
+                return [(button, pipeline, *rendered[button]) for button, pipeline in work]
+            except RenderProcessError as error:
+                with self.build_lock:
+                    self._stop_process_renderer(error)
+                # Build the pipelines of the page here, and render them below instead
+                self._build_pending(page_number)
+                work = [(button, pipeline) for button, pipeline in page.items() if button in due]
+
+        if self.renderer == "thread" and len(work) > 1:
+            # The pipelines run outside the lock, otherwise they would take turns. replace() swaps
+            # in a new pipeline rather than changing the one running. set_keypress does change a
+            # running pipeline: it flips the keypress filter, which reads it once per run so the
+            # image and hash agree, and it reads the replaying flag and input hashes, which may be
+            # a frame old. Then it sends a stale pressed image or none, and as it marks the key
+            # dirty, the next frame shows the right one.
+            results = DisplayGrid._get_render_pool().map(lambda item: self._render(item[1], current_time, force_update, nullcontext()), work)
+        else:
+            results = (self._render(pipeline, current_time, force_update, self.lock) for _, pipeline in work)
+
+        return [(button, pipeline, native_image, next_change) for (button, pipeline), (native_image, next_change) in zip(work, results)]
+
+    def _render(self, pipeline: Pipeline, current_time: int, force_update: bool, lock: ContextManager) -> Tuple[Optional[bytes], Optional[int]]:
+        """Processes all the steps in the pipeline and converts the result to the native
+        image format of the Stream Deck.
+
+        :return: The native image (or None if the button did not change) and the time the
+        pipeline will next change by itself.
+        :rtype: Tuple[Optional[bytes], Optional[int]]
+        """
+        with lock:
+            replayed = pipeline.replay(current_time)
+            if replayed is None:
+                image = pipeline.execute(current_time)
+                hashcode = pipeline.hashcode
+            next_change = pipeline.next_change(current_time)
+
+        if replayed is not None:
+            # A compiled animation, the frames are already in the native format
+            changed, native_image = replayed
+            return (native_image if changed or force_update else None, next_change)
+
+        # If none of the filters in the pipeline yielded a change, use
+        # the last known result
+        if force_update and image is None:
+            image = pipeline.last_result()
+
+        if not image or not self.streamdeck.is_visual():
+            return (None, next_change)
+
+        # We cannot afford to do this conversion on every final frame.
+        # Since we want the flexibilty of a pipeline engine that can mutate the
+        # images along a chain of filters, the outcome can be somewhat unpredicatable
+        # For example - a clock that changes time or an animation that changes
+        # the frame and font that overlays. In many instances there is a finite
+        # number of frames per pipeline (a looping GIF with image, a pulsing icon etc)
+        # Some may also be virtually have infinite mutations. A cache per pipeline
+        # with an eviction policy of the oldest would likely suffice.
+        # The main problem is since the pipeline can mutate it's too expensive to
+        # calculate the actual hash of the final frame.
+        # Create a hash function that the filter itself defines. It has to
+        # update the hashcode with the unique attributes of the input it requires
+        # to make the frame. This could be time, text, frame number etc.
+        # The hash can then be passed to the next step and XOR'd or combined
+        # with the next hash. This yields a final hash code that can then be
+        # used to cache the output. At the end of the pipeline the hash can
+        # be checked and final bytes will be ready to pipe to the device.
+        cached_image = self.frame_cache.get(hashcode)
+        if cached_image is None:
+            cached_image = PILHelper.to_native_format(self.streamdeck, image)
+            self.frame_cache.put(hashcode, cached_image)
+        return (cached_image, next_change)
+
+    @staticmethod
+    def _get_render_pool() -> ThreadPoolExecutor:
+        """Returns the thread pool shared by all displays that use the thread renderer."""
+        with DisplayGrid._render_pool_lock:
+            if DisplayGrid._render_pool is None:
+                DisplayGrid._render_pool = ThreadPoolExecutor(max_workers=RENDER_THREADS, thread_name_prefix="render")
+            return DisplayGrid._render_pool
 
     def _run(self):
         """Method that runs on background thread and updates the pipelines."""
         frames = 0
-        start = time()
+        start = self.clock()
         last_page = -1
         execution_time = 0
-        frame_cache = {}
+        deadlines: List[Tuple[int, int]] = []
+        # A heap of (time, button) for the buttons that will change on their own
+        scheduled: Dict[int, int] = {}
+        # The deadline currently scheduled per button. Heap entries that don't
+        # match are stale and are skipped.
 
         while not self.quit.isSet():
-            current_time = time()
+            # Clear before collecting the work, so a wake up that arrives while
+            # rendering triggers another cycle instead of being lost.
+            self.wake.clear()
+            current_time = self.clock()
 
             with self.lock:
-                page = self.pages[self.current_page]
+                page_number = self.current_page
+                # Taken together with the page, so the changes they wait for are in this cycle
+                waiters = self.waiters
+                self.waiters = []
+            # A page that was switched to before its pipelines were built
+            self._build_pending(page_number)
+
+            with self.lock:
+                page = self.pages[page_number]
+                dirty = self.dirty
+                self.dirty = set()
+                presses = self.presses
+                self.presses = {}
 
             force_update = False
 
@@ -126,82 +602,77 @@ class DisplayGrid:
                 # When a page switch happen, force the pipelines to redraw so icons update
                 force_update = True
                 last_page = page
-
-            pipeline_cache_count = 0
-
-            for button, pipeline in page.items():
-                # Process all the steps in the pipeline and return the resulting image
-                with self.lock:
-                    image, hashcode = pipeline.execute(current_time)
-
-                pipeline_cache_count += len(pipeline.output_cache)
-
-                # If none of the filters in the pipeline yielded a change, use
-                # the last known result
-                if force_update and image is None:
-                    image = pipeline.last_result()
-
-                if image:
-                    # We cannot afford to do this conversion on every final frame.
-                    # Since we want the flexibilty of a pipeline engine that can mutate the
-                    # images along a chain of filters, the outcome can be somewhat unpredicatable
-                    # For example - a clock that changes time or an animation that changes
-                    # the frame and font that overlays. In many instances there is a finite
-                    # number of frames per pipeline (a looping GIF with image, a pulsing icon etc)
-                    # Some may also be virtually have infinite mutations. A cache per pipeline
-                    # with an eviction policy of the oldest would likely suffice.
-                    # The main problem is since the pipeline can mutate it's too expensive to
-                    # calculate the actual hash of the final frame.
-                    # Create a hash function that the filter itself defines. It has to
-                    # update the hashcode with the unique attributes of the input it requires
-                    # to make the frame. This could be time, text, frame number etc.
-                    # The hash can then be passed to the next step and XOR'd or combined
-                    # with the next hash. This yields a final hash code that can then be
-                    # used to cache the output. At the end of the pipeline the hash can
-                    # be checked and final bytes will be ready to pipe to the device.
-
-                    if self.streamdeck.is_visual():
-                        # FIXME: This will be unbounded, old frames will need to be evicted
-                        if hashcode not in frame_cache:
-                            image = PILHelper.to_native_format(self.streamdeck, image)
-                            frame_cache[hashcode] = image
-                        else:
-                            image = frame_cache[hashcode]
-
-                        try:
-                            with self.lock:
-                                self.streamdeck.set_key_image(button, image)
-                        except TransportError:
-                            # Review - deadlock if you wait on yourself?
-                            self.stop()
-                            pass
-                            return
+                deadlines = []
+                scheduled = {}
+                due = set(page.keys())
+            else:
+                due = dirty
+                while deadlines and deadlines[0][0] <= current_time:
+                    deadline, button = heapq.heappop(deadlines)
+                    if scheduled.get(button) == deadline:
+                        del scheduled[button]
+                        due.add(button)
+                if presses:
+                    # Pressed keys first and on their own, so they don't wait for the others
+                    self._submit(self._render_frame(page_number, page, set(presses), current_time, False), scheduled, deadlines, presses)
+                    due.difference_update(presses)
+
+            self._submit(self._render_frame(page_number, page, due, current_time, force_update), scheduled, deadlines, presses)
+            if waiters:
+                self.writer.when_sent(waiters)
 
             self.sync.set()
             self.sync.clear()
+
+            # Use the idle time to get the keys that don't change on their own ready to be pressed
+            if not self.wake.is_set() and self.streamdeck.is_visual():
+                self._prepare_keypresses(page_number, [button for button in page if button not in scheduled], self.wake)
+            # Then prerender the pages the user is likely to switch to next.
+            # One page per cycle, and only when nothing else is waiting.
+            if not self.wake.is_set():
+                self._prerender_next(page_number, current_time)
+            # Then build the pipelines of the other pages, until there is something else to do
+            if not self.wake.is_set():
+                self._build_pending(stop=self.wake)
+
             # Calculate how long we took to process the pipeline
-            elapsed_time = time() - current_time
+            elapsed_time = self.clock() - current_time
             execution_time += elapsed_time
 
-            # Calculate how much we have to sleep between processing cycles to maintain the desired FPS
+            # Sleep until the next button is due to change, but never run cycles more often than
+            # the desired FPS. Wake up at least once a second to report the CPU usage. Changes
+            # to the configuration, page or key presses wake the thread up early.
+            next_deadline = deadlines[0][0] if deadlines else current_time + NANOSECONDS_PER_SECOND
+            next_cycle = max(next_deadline, current_time + NANOSECONDS_PER_SECOND // self.fps)
+            time_left = min(next_cycle, start + NANOSECONDS_PER_SECOND) - self.clock()
             # If we have less than 5ms left, don't bother sleeping, as the context switch and
             # overhead of sleeping/waking up is consumed
-            time_left = self.time_per_frame - elapsed_time
-            if time_left > 0.005:
-                sleep(time_left)
+            if time_left > 5 * NANOSECONDS_PER_MILLISECOND:
+                self.wake.wait(time_left / NANOSECONDS_PER_SECOND)
 
             frames += 1
-            if time() - start > 1.0:
-                execution_time_ms = int(execution_time * 1000)
+            if self.clock() - start > NANOSECONDS_PER_SECOND:
+                # Checking the budget once a second is frequent enough, the per pipeline
+                # caps keep the overshoot between checks small.
+                self._enforce_pipeline_cache_budget()
+                execution_time_ms = execution_time // NANOSECONDS_PER_MILLISECOND
                 if self.cpu_callback:
                     self.cpu_callback(self.serial_number, int(execution_time_ms / 1000 * 100))
-                # execution_time_ms = int(execution_time * 1000)
-                # print(f"FPS: {frames} Execution time: {execution_time_ms} ms Execution %: {int(execution_time_ms/1000 * 100)}")
-                # print(f"Output cache size: {len(frame_cache)}")
-                # print(f"Pipeline cache size: {pipeline_cache_count}")
                 execution_time = 0
                 frames = 0
-                start = time()
+                start = self.clock()
+
+    def _submit(self, rendered: List[Tuple[int, Pipeline, Optional[bytes], Optional[int]]], scheduled: Dict[int, int], deadlines: List[Tuple[int, int]], presses: Dict[int, int]) -> None:
+        """Sends the rendered images to the device, and schedules the next change of each button"""
+        for button, _pipeline, native_image, next_change in rendered:
+            if next_change is None:
+                scheduled.pop(button, None)
+            else:
+                scheduled[button] = next_change
+                heapq.heappush(deadlines, (next_change, button))
+
+            if native_image is not None:
+                self.writer.submit(button, native_image, presses.get(button, None))
 
     def set_page(self, page: int):
         """Switches to the given page. Pipelines for that page starts running,
@@ -210,27 +681,36 @@ class DisplayGrid:
         Args:
             page (int): The page number to switch to.
         """
+        renderer = self.process_renderer
+        if renderer is not None and self.current_page >= 0:
+            try:
+                renderer.release_keys(self.current_page)
+            except RenderProcessError as error:
+                with self.build_lock:
+                    self._stop_process_renderer(error)
+
         with self.lock:
             if self.current_page >= 0:
                 # Ensure none of the button filters are active anymore
-                old_page = self.pages[self.current_page]
-                for _, pipeline in old_page.items():
-                    for filter in pipeline.filters:
-                        if isinstance(filter[0], KeypressFilter):
-                            filter[0].active = False
+                for keypress in self.keypresses[self.current_page].values():
+                    keypress.active = False
+                self.presses = {}
             # REVIEW: We could detect the active key on the last page, and make it active
             # on the target page
             self.current_page = page
+        self.wake.set()
 
     def start(self):
         if self.pipeline_thread is not None:
             self.quit.set()
+            self.wake.set()
             try:
                 self.pipeline_thread.join()
             except RuntimeError:
                 pass
 
         self.quit.clear()
+        self.writer.start()
         self.pipeline_thread = threading.Thread(target=self._run)
         self.pipeline_thread.daemon = True
         self.pipeline_thread.start()
@@ -240,8 +720,20 @@ class DisplayGrid:
     def stop(self):
         if self.pipeline_thread is not None:
             self.quit.set()
+            self.wake.set()
             try:
                 self.pipeline_thread.join()
             except RuntimeError:
                 pass
             self.pipeline_thread = None
+        with self.lock:
+            waiters = self.waiters
+            self.waiters = []
+        resolve(waiters, False)
+        self.writer.stop()
+
+    def close(self):
+        """Releases the resources of the display, such as render processes. The display
+        can't be started again."""
+        if self.process_renderer is not None:
+            self.process_renderer.close()
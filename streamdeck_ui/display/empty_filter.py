@@ -1,5 +1,4 @@
-from fractions import Fraction
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 
 from PIL import Image
 
@@ -25,13 +24,15 @@ class EmptyFilter(filter.Filter):
     def initialize(self, size: Tuple[int, int]):
         self.image = Image.new("RGB", size)
 
-    def transform(self, get_input: Callable[[], Image.Image], get_output: Callable[[int], Image.Image], input_changed: bool, time: Fraction) -> Tuple[Image.Image, int]:
+    def is_pure(self) -> bool:
+        return True
+
+    def transform(self, input: Optional[Image.Image], get_output: Callable[[int], Optional[Image.Image]], input_changed: bool, time: int) -> Optional[Image.Image]:
         """
         Returns an empty Image object.
 
-        :param Fraction time: The current time in seconds, expressed as a fractional number since
-        the start of the pipeline.
+        :param int time: The current time in nanoseconds.
         """
         if not input_changed:
-            return (None, self.hashcode)
-        return ((self.image), self.hashcode)
+            return None
+        return self.image
@@ -1,6 +1,5 @@
 from abc import ABC, abstractmethod
-from fractions import Fraction
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 
 from PIL import Image
 
@@ -19,6 +18,10 @@ class Filter(ABC):
     is_complete: bool
     "Indicates if the filter is complete and should no longer be processed."
 
+    hashcode: int
+    """Identifies the current output of the filter, given its input. Must be updated by transform()
+    whenever the output changes, and should be computed once rather than on every frame."""
+
     def __init__(self):
         self.is_complete = False
 
@@ -34,13 +37,14 @@ class Filter(ABC):
         pass
 
     @abstractmethod
-    def transform(self, get_input: Callable[[], Image.Image], get_output: Callable[[int], Image.Image], input_changed: bool, time: Fraction) -> Tuple[Image.Image, int]:
+    def transform(self, input: Optional[Image.Image], get_output: Callable[[int], Optional[Image.Image]], input_changed: bool, time: int) -> Optional[Image.Image]:
         """
-        Transforms the given input image to the desired output image.
-        The default behaviour is to return the orignal image.
+        Transforms the given input image to the desired output image. This runs for every button
+        on every frame, so when nothing changed it should return without allocating anything.
 
-        :param Callable[[], PIL.Image] get_input: A function that returns the input image to transform. Note that calling
-        this will create a copy of the input image, and it is safe to manipulate directly.
+        :param PIL.Image input: The output of the previous filter. It is shared with the pipeline
+        caches and must not be modified. Filters that draw on it have to work on a copy, filters that
+        pass it through can return it as is.
 
         :param Callable[[int], PIL.Image] get_output: Provide the hashcode of the new frame and it will
         return the output frame if it already exists. This avoids having to redraw an output frame that is already
@@ -49,11 +53,36 @@ class Filter(ABC):
         :param bool input_changed: True if the input is different from previous run, False otherwise.
         When true, you have to return an Image.
 
-        :param Fraction time: The current time in seconds, expressed as a fractional number since
-        the start of the pipeline.
+        :param int time: The current time in nanoseconds, read from the clock of the display (see clock.py).
 
         :rtype: PIL.Image
         :return: The transformed output image. If this filter did not modify the input, return None. This signals to the
-        pipeline manager that there was no change and a cached version will be moved to the next stage.
+        pipeline manager that there was no change and a cached version will be moved to the next stage. The hashcode
+        attribute must identify the output either way.
         """
         pass
+
+    def next_change(self, time: int) -> Optional[int]:
+        """
+        Returns the time at which the output of this filter will change on its own, for example
+        the next frame of an animation. The display uses this to sleep until there is something to
+        do. Filters are otherwise only processed when their input changes, so any filter whose output
+        depends on time must implement this.
+
+        :param int time: The current time in nanoseconds.
+
+        :rtype: Optional[int]
+        :return: The time of the next change, or None if the output only changes with the input.
+        """
+        return None
+
+    def is_pure(self) -> bool:
+        """
+        Indicates if the output of this filter only depends on its input, so it always gives the
+        same output for the same input. Pipelines where this holds for every filter but a single
+        animated image are compiled into a loop of finished frames (see Pipeline.compile).
+
+        :rtype: bool
+        :return: True if the output only depends on the input, defaults to False.
+        """
+        return False
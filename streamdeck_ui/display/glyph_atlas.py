@@ -0,0 +1,101 @@
+import math
+import threading
+from typing import Dict, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont
+
+
+class Glyph:
+    """The rasterized coverage and shadow of one character"""
+
+    __slots__ = ("advance", "mask", "shadow")
+
+    def __init__(self, advance: float, mask: Image.Image, shadow: Image.Image):
+        self.advance = advance
+        "How far the next character starts to the right, in pixels"
+        self.mask = mask
+        "The coverage of the character, padded on every side for the shadow"
+        self.shadow = shadow
+        "The blurred coverage, the same size as the mask"
+
+
+class GlyphAtlas:
+    """
+    Keeps every character of a font that was drawn so far, together with its shadow, so labels
+    that change often (counters, timers) are put together from a few small pastes instead of
+    laying out, drawing and blurring the whole label again. Characters are laid out one after
+    the other without kerning, so the result can differ from a fully rendered label by a pixel.
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont, blur: ImageFilter.Kernel):
+        """Creates a new, empty atlas
+
+        :param font: The font to draw the characters with
+        :type font: ImageFont.FreeTypeFont
+        :param blur: The filter that turns the coverage of a character into its shadow
+        :type blur: ImageFilter.Kernel
+        """
+        self.font = font
+        self.blur = blur
+        # The shadow reaches half a kernel around the character, and the filter leaves another
+        # half a kernel along the edges of an image alone
+        self.padding = blur.filterargs[0][0] - 1
+        _, self.line_height = ImageDraw.Draw(Image.new("L", (1, 1))).textsize("lLpgyL|", font=font)
+        "The height of the tallest text the font draws, used to align labels"
+        self.glyphs: Dict[str, Glyph] = {}
+        self.lock = threading.Lock()
+
+    def glyph(self, character: str) -> Glyph:
+        """Returns the glyph for a character, drawing it the first time it is used"""
+        glyph = self.glyphs.get(character, None)
+        if glyph is None:
+            with self.lock:
+                glyph = self.glyphs.get(character, None)
+                if glyph is None:
+                    glyph = self._draw(character)
+                    self.glyphs[character] = glyph
+        return glyph
+
+    def _draw(self, character: str) -> Glyph:
+        advance = self.font.getlength(character)
+        width = max(math.ceil(advance), self.font.getbbox(character)[2])
+        mask = Image.new("L", (width + 2 * self.padding, self.line_height + 2 * self.padding))
+        ImageDraw.Draw(mask).text((self.padding, self.padding), character, font=self.font, fill=255)
+        return Glyph(advance, mask, mask.filter(self.blur))
+
+    def text_width(self, text: str) -> int:
+        """Returns the width of a label in pixels"""
+        return round(sum(self.glyph(character).advance for character in text))
+
+    def render(self, text: str, size: Tuple[int, int], position: Tuple[int, int]) -> Image.Image:
+        """Puts a label together from the glyphs of its characters
+
+        :param text: The text of the label
+        :type text: str
+        :param size: The size of the label image
+        :type size: Tuple[int, int]
+        :param position: Where the top left corner of the text goes
+        :type position: Tuple[int, int]
+        :return: White text with a black shadow on a transparent image
+        :rtype: Image.Image
+        """
+        glyphs = [self.glyph(character) for character in text]
+        boxes = []
+        x: float = position[0]
+        y = position[1]
+        # The advances are fractional, the glyphs are placed on the nearest pixel
+        for glyph in glyphs:
+            left, top = round(x) - self.padding, y - self.padding
+            boxes.append((left, top, left + glyph.mask.width, top + glyph.mask.height))
+            x += glyph.advance
+
+        # Shadows of neighbouring characters overlap, add them up like blurring the whole label would
+        shadow = Image.new("L", size)
+        for glyph, box in zip(glyphs, boxes):
+            shadow.paste(ImageChops.add(shadow.crop(box), glyph.shadow), box)
+
+        image = Image.new("RGBA", size)
+        image.putalpha(shadow)
+        for glyph, box in zip(glyphs, boxes):
+            image.paste((255, 255, 255, 255), box, glyph.mask)
+        return image
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from streamdeck_ui.config import ICON_CACHE_PATH, ICON_CACHE_SIZE
+
+CACHE_FORMAT_VERSION = 1
+"Update whenever the layout of the cache files changes, old entries are then ignored"
+
+
+class IconCache:
+    """
+    A content addressed disk cache for icons that are decoded, rasterized and scaled to the
+    size of a key. Entries store the raw pixels and duration of every frame, so loading one
+    skips decoding entirely. Entries are keyed by file path, modification time, file size and
+    key size, so changing an icon file invalidates them. When the cache grows beyond its size
+    limit, the least recently used entries are removed.
+    """
+
+    def __init__(self, path: str = ICON_CACHE_PATH, max_bytes: int = ICON_CACHE_SIZE):
+        """Creates a new icon cache
+
+        :param path: The directory the cache files are stored in
+        :type path: str
+        :param max_bytes: The maximum size of the cache on disk. Set to 0 to disable the cache.
+        :type max_bytes: int
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.total: Optional[int] = None
+        "The bytes the entries take on disk, as of the last cleanup plus the entries stored since. None before the first cleanup."
+        self.lock = threading.Lock()
+
+    def key(self, file: str, size: Tuple[int, int]) -> Optional[str]:
+        """Returns the cache key for an icon file scaled to the given size, or None if the
+        file can't be cached.
+        """
+        if not self.max_bytes:
+            return None
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        identity = f"{CACHE_FORMAT_VERSION}|{os.path.realpath(file)}|{stat.st_mtime_ns}|{stat.st_size}|{size[0]}x{size[1]}"
+        return hashlib.sha1(identity.encode()).hexdigest()  # nosec - not used for security
+
+    def load(self, key: str, max_bytes: Optional[int] = None) -> Optional[List[Tuple[Image.Image, int]]]:
+        """Returns the frames (image and duration in milliseconds) stored for a key, or None
+        if there are none, or they would take more than max_bytes of memory.
+        """
+        file_name = os.path.join(self.path, key)
+        try:
+            with open(file_name, "rb") as cache_file:
+                header = json.loads(cache_file.readline())
+                if max_bytes is not None and sum(frame["length"] for frame in header["frames"]) > max_bytes:
+                    return None
+                frames = []
+                for frame in header["frames"]:
+                    image = Image.frombytes(frame["mode"], tuple(frame["size"]), cache_file.read(frame["length"]))
+                    if frame["palette"]:
+                        image.putpalette(frame["palette"])
+                    frames.append((image, frame["duration"]))
+            # Mark as recently used
+            os.utime(file_name)
+            return frames
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Ignoring damaged icon cache entry {file_name}: {error}")
+            self._remove(file_name)
+            return None
+
+    def store(self, key: str, frames: List[Tuple[Image.Image, int]]) -> None:
+        """Stores the frames (image and duration in milliseconds) for a key"""
+        header = {"frames": []}  # type: ignore [var-annotated]
+        data = []
+        for image, duration in frames:
+            pixels = image.tobytes()
+            header["frames"].append({"mode": image.mode, "size": image.size, "length": len(pixels), "duration": duration, "palette": image.getpalette() if image.mode == "P" else None})
+            data.append(pixels)
+
+        file_name = os.path.join(self.path, key)
+        temporary_name = None
+        entry_size = len(json.dumps(header).encode()) + 1 + sum(len(pixels) for pixels in data)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Other threads and processes may store the same icon at the same time
+            with tempfile.NamedTemporaryFile("wb", dir=self.path, suffix=".tmp", delete=False) as cache_file:
+                temporary_name = cache_file.name
+                cache_file.write(json.dumps(header).encode() + b"\n")
+                for pixels in data:
+                    cache_file.write(pixels)
+            os.replace(temporary_name, file_name)
+        except OSError as error:
+            print(f"Unable to store icon cache entry {file_name}: {error}")
+            if temporary_name is not None:
+                self._remove(temporary_name)
+            return
+
+        with self.lock:
+            if self.total is not None and self.total + entry_size <= self.max_bytes:
+                # Entries other processes stored are counted by the next cleanup
+                self.total += entry_size
+                return
+        self.cleanup()
+
+    def cleanup(self) -> None:
+        """Removes the least recently used entries until the cache fits in its size limit"""
+        stats = {}
+        try:
+            for entry in os.scandir(self.path):
+                # Other threads and processes may be writing a temporary file, or removing entries
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    if entry.is_file():
+                        stats[entry.path] = entry.stat()
+                except OSError:
+                    pass
+        except OSError:
+            return
+
+        total = sum(stat.st_size for stat in stats.values())
+        for file_name, stat in sorted(stats.items(), key=lambda item: item[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            self._remove(file_name)
+            total -= stat.st_size
+        with self.lock:
+            self.total = total
+
+    def _remove(self, file_name: str) -> None:
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
+
+
+icon_cache = IconCache()
+"The icon cache shared by all image filters"
@@ -1,14 +1,12 @@
-import itertools
 import os
-from fractions import Fraction
-from io import BytesIO
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 
-import cairosvg
-import filetype
-from PIL import Image, ImageSequence
+from PIL import Image
 
+from streamdeck_ui.config import ICON_MEMORY_LIMIT
+from streamdeck_ui.display.clock import NANOSECONDS_PER_MILLISECOND
 from streamdeck_ui.display.filter import Filter
+from streamdeck_ui.display.image_source import StreamedFrames, image_sources
 
 
 class ImageFilter(Filter):
@@ -16,105 +14,91 @@ class ImageFilter(Filter):
     Represents a static image. It transforms the input image by replacing it with a static image.
     """
 
-    def __init__(self, file: str):
+    def __init__(self, file: str, memory_limit: int = ICON_MEMORY_LIMIT):
+        """Creates a new image filter
+
+        :param file: The image file
+        :type file: str
+        :param memory_limit: The maximum number of bytes the decoded frames of an animation may
+        use. Larger animations are streamed from the file. Defaults to ICON_MEMORY_LIMIT
+        :type memory_limit: int, optional
+        """
         super(ImageFilter, self).__init__()
         self.file = os.path.expanduser(file)
+        self.memory_limit = memory_limit
 
     def initialize(self, size: Tuple[int, int]):
-        # Each frame needs to have a unique hashcode. Start with file name as baseline.
-        image_hash = hash((self.__class__, self.file))
-        frame_duration = []
-        frame_hash = []
-
-        try:
-            kind = filetype.guess(self.file)
-            if kind is None:
-                svg_code = open(self.file).read()
-                png = cairosvg.svg2png(svg_code, output_height=size[1], output_width=size[0])
-                image_file = BytesIO(png)
-                image = Image.open(image_file)
-                frame_duration.append(-1)
-                frame_hash.append(image_hash)
-            else:
-                image = Image.open(self.file)
-                image.seek(0)
-                # Frame number is used to create unique hash
-                frame_number = 1
-                while True:
-                    try:
-                        frame_duration.append(image.info["duration"])
-                        # Create tuple and hash it, to combine the image and frame hashcodes
-                        frame_hash.append(hash((image_hash, frame_number)))
-                        image.seek(image.tell() + 1)
-                        frame_number += 1
-                    except EOFError:
-                        # Reached the final frame
-                        break
-                    except KeyError:
-                        # If the key 'duration' can't be found, it's not an animation
-                        frame_duration.append(-1)
-                        frame_hash.append(image_hash)
-                        break
-
-        except OSError as icon_error:
-            # FIXME: caller should handle this?
-            print(f"Unable to load icon {self.file} with error {icon_error}")
-            image = Image.new("RGB", size)
-            frame_duration.append(-1)
-            frame_hash.append(image_hash)
-
-        frames = ImageSequence.Iterator(image)
-
-        # Scale all the frames to the target size
-        self.frames = []
-        for frame, milliseconds, hashcode in zip(frames, frame_duration, frame_hash):
-            frame = frame.copy()
-            frame.thumbnail(size, Image.LANCZOS)
-            self.frames.append((frame, milliseconds, hashcode))
-
-        self.frame_cycle = itertools.cycle(self.frames)
-        self.current_frame = next(self.frame_cycle)
-        self.frame_time = Fraction()
-
-    def transform(self, get_input: Callable[[], Image.Image], get_output: Callable[[int], Image.Image], input_changed: bool, time: Fraction) -> Tuple[Image.Image, int]:
+        # The frames are shared with every other filter that shows this file at this size. Animations
+        # too large to keep decoded are read by each filter on its own, at its own point of the animation.
+        self.source = image_sources.acquire(self, self.file, size, self.memory_limit)
+        self.frames = self.source.frames.reader() if isinstance(self.source.frames, StreamedFrames) else self.source.frames
+        self.frame_index = 0
+        self.current_frame = self.frames[0]
+        self.hashcode = self.current_frame[2]
+        self.next_frame_time: Optional[int] = None
+        "When the next frame of the animation is due, or None if it has not started yet"
+
+    def next_change(self, time: int) -> Optional[int]:
+        _, duration, _ = self.current_frame
+        if duration < 0:
+            # Static image
+            return None
+        return self.next_frame_time
+
+    def is_pure(self) -> bool:
+        # Only a static image gives the same output for the same input every time
+        return len(self.frames) == 1
+
+    def advance(self, time: int) -> bool:
+        """Moves to the next frame of the animation when the current one has been shown long enough.
+
+        :param int time: The current time in nanoseconds.
+
+        :rtype: bool
+        :return: True if the current frame changed.
+        """
+        _, duration, _ = self.current_frame
+        if duration < 0:
+            return False
+        if self.next_frame_time is None:
+            # The animation starts when it is first shown
+            self.next_frame_time = time + duration * NANOSECONDS_PER_MILLISECOND
+            return False
+        if time < self.next_frame_time:
+            return False
+
+        self.frame_index = (self.frame_index + 1) % len(self.frames)
+        self.current_frame = self.frames[self.frame_index]
+        self.hashcode = self.current_frame[2]
+        _, duration, _ = self.current_frame
+        # Count from when the frame was due rather than from now, so the animation doesn't drift
+        self.next_frame_time += duration * NANOSECONDS_PER_MILLISECOND
+        if self.next_frame_time <= time:
+            # Fell behind by more than a frame (for example after a suspend), continue from now
+            self.next_frame_time = time + duration * NANOSECONDS_PER_MILLISECOND
+        return True
+
+    def paste_frame(self, input: Image.Image, frame_index: int) -> Image.Image:
+        """Pastes the given frame onto the input image and returns it."""
+        frame, _, _ = self.frames[frame_index]
+        if frame.mode == "RGBA":
+            # Use the transparency mask of the image to paste
+            input.paste(frame, frame)
+        else:
+            input.paste(frame)
+        return input
+
+    def transform(self, input: Optional[Image.Image], get_output: Callable[[int], Optional[Image.Image]], input_changed: bool, time: int) -> Optional[Image.Image]:
         """
         The transformation returns the loaded image, ando overwrites whatever came before.
         """
 
-        # Unpack tuple to make code a bit easier to understand
-        frame, duration, hashcode = self.current_frame
-
-        if duration >= 0 and time - self.frame_time > duration / 1000:
-            self.frame_time = time
-            self.current_frame = next(self.frame_cycle)
-
-            # Unpack updated value
-            frame, duration, hashcode = self.current_frame
-
-            image = get_output(hashcode)
-            if image:
-                return (image, hashcode)
-
-            input = get_input()
-            if frame.mode == "RGBA":
-                # Use the transparency mask of the image to paste
-                input.paste(frame, frame)
-            else:
-                input.paste(frame)
-            return (input, hashcode)
-
-        if input_changed:
-            image = get_output(hashcode)
+        if self.advance(time) or input_changed:
+            image = get_output(self.hashcode)
             if image:
-                return (image, hashcode)
+                return image
 
-            input = get_input()
-
-            if frame.mode == "RGBA":
-                # Use the transparency mask of the image to paste
-                input.paste(frame, frame)
-            else:
-                input.paste(frame)
-            return (input, hashcode)
-        else:
-            return (None, hashcode)
+            # The first filter of a pipeline has no input to paste onto
+            background = input.copy() if input is not None else Image.new("RGB", self.source.size)
+            return self.paste_frame(background, self.frame_index)
+        return None
@@ -0,0 +1,316 @@
+import os
+import threading
+import weakref
+from io import BytesIO
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union, overload
+
+import cairosvg
+import filetype
+from PIL import Image, ImageSequence
+
+from streamdeck_ui.display.icon_cache import icon_cache
+
+STREAM_WINDOW = 8
+"The number of frames a streamed animation decodes ahead"
+
+
+def frame_hashcodes(image_hash: int, durations: List[int]) -> List[int]:
+    """Returns a unique hashcode for each frame of an image"""
+    hashcodes = []
+    for frame_number, milliseconds in enumerate(durations, 1):
+        if milliseconds < 0:
+            hashcodes.append(image_hash)
+        else:
+            # Create tuple and hash it, to combine the image and frame hashcodes
+            hashcodes.append(hash((image_hash, frame_number)))
+    return hashcodes
+
+
+def frame_bytes(frame: Image.Image) -> int:
+    return frame.width * frame.height * len(frame.getbands())
+
+
+class StreamedFrames:
+    """
+    The frames of an animation that takes too much memory to keep decoded. Behaves like the
+    list of (frame, duration, hashcode) tuples of an ImageSource, but only keeps a small window
+    of frames. When a frame outside the window is needed, it and the frames after it are
+    decoded from the file, which is fast because animations are played in order.
+
+    Filters showing the same animation are usually at different frames. Each one reads the
+    file with its own reader (see reader), so they don't keep moving a shared window back and
+    forth, which would decode the animation from the start on every move back.
+    """
+
+    def __init__(self, file: str, size: Tuple[int, int], durations: List[int], hashcodes: List[int], frame_bytes: int, window: int = STREAM_WINDOW):
+        """Creates a new frame stream
+
+        :param file: The animated image file
+        :type file: str
+        :param size: The size to scale the frames to
+        :type size: Tuple[int, int]
+        :param durations: The duration of each frame in milliseconds
+        :type durations: List[int]
+        :param hashcodes: The hashcode of each frame
+        :type hashcodes: List[int]
+        :param frame_bytes: The number of bytes a decoded frame holds
+        :type frame_bytes: int
+        :param window: The number of frames to decode at a time, defaults to STREAM_WINDOW
+        :type window: int, optional
+        """
+        self.file = file
+        self.size = size
+        self.durations = durations
+        self.hashcodes = hashcodes
+        self.frame_bytes = frame_bytes
+        self.window_size = window
+        self.image: Optional[Image.Image] = None
+        # Opened when the first frame is decoded
+        self.window: Dict[int, Image.Image] = {}
+        # A render pool thread and the UI may read the frames at the same time
+        self.lock = threading.Lock()
+
+    def reader(self) -> "StreamedFrames":
+        """Returns the same frames, decoded with a file and window of their own"""
+        return StreamedFrames(self.file, self.size, self.durations, self.hashcodes, self.frame_bytes, self.window_size)
+
+    def __len__(self) -> int:
+        return len(self.durations)
+
+    def __getitem__(self, index: int) -> Tuple[Image.Image, int, int]:
+        with self.lock:
+            frame = self.window.get(index, None)
+            if frame is None:
+                if self.image is None:
+                    self.image = Image.open(self.file)
+                    # Each reader holds a file handle of its own, until it is garbage collected
+                    weakref.finalize(self, self.image.close)
+                self.window = {}
+                for frame_index in range(index, min(index + self.window_size, len(self.durations))):
+                    self.image.seek(frame_index)
+                    frame = self.image.copy()
+                    frame.thumbnail(self.size, Image.LANCZOS)
+                    self.window[frame_index] = frame
+                frame = self.window[index]
+        return (frame, self.durations[index], self.hashcodes[index])
+
+
+class CompiledFrames(List[Tuple[Image.Image, bytes]]):
+    """The finished and encoded frames of a compiled pipeline (see Pipeline.compile), which
+    pipelines with the same filters and device format share through their ImageSource."""
+
+    def __init__(self, *args: Any):
+        super(CompiledFrames, self).__init__(*args)
+        self.bytes: int = 0
+        self.users: int = 0
+
+
+class ImageSource:
+    """
+    The decoded frames of an image file, scaled to one size. Loads from the disk icon cache when
+    possible. Sources are shared by all the filters that show the same file at the same size,
+    see ImageSourceRegistry.
+    """
+
+    def __init__(self, file: str, size: Tuple[int, int], memory_limit: int, image_hash: int):
+        """Loads an image source
+
+        :param file: The image file
+        :type file: str
+        :param size: The size to scale the frames to
+        :type size: Tuple[int, int]
+        :param memory_limit: The maximum number of bytes the decoded frames of an animation may
+        use. Larger animations are streamed from the file.
+        :type memory_limit: int
+        :param image_hash: The hashcode frame hashcodes are derived from
+        :type image_hash: int
+        """
+        self.file = file
+        self.size = size
+        self.memory_limit = memory_limit
+        self.users = 0
+        "The number of filters using this source"
+        self.compiled: "weakref.WeakValueDictionary[Hashable, CompiledFrames]" = weakref.WeakValueDictionary()
+        "Compiled frames of pipelines that show this source, by pipeline and device format"
+
+        cache_key = icon_cache.key(file, size)
+        frames: Optional[Union[List[Tuple[Image.Image, int]], StreamedFrames]] = icon_cache.load(cache_key, memory_limit) if cache_key else None
+        if frames is None:
+            try:
+                frames = self._load_frames(image_hash)
+                if cache_key and not isinstance(frames, StreamedFrames):
+                    icon_cache.store(cache_key, frames)
+            except OSError as icon_error:
+                # FIXME: caller should handle this?
+                print(f"Unable to load icon {file} with error {icon_error}")
+                frames = [(Image.new("RGB", size), -1)]
+
+        self.frames: Union[List[Tuple[Image.Image, int, int]], StreamedFrames]
+        "The frames, their duration in milliseconds (-1 for a static image) and their hashcode"
+        self.bytes: int
+        "The bytes the decoded frames hold"
+        if isinstance(frames, StreamedFrames):
+            self.frames = frames
+            # Per filter, see StreamedFrames.reader
+            self.bytes = frames.frame_bytes * min(frames.window_size, len(frames))
+        else:
+            hashcodes = frame_hashcodes(image_hash, [milliseconds for _, milliseconds in frames])
+            self.frames = [(frame, milliseconds, hashcode) for (frame, milliseconds), hashcode in zip(frames, hashcodes)]
+            self.bytes = sum(frame_bytes(frame) for frame, _ in frames)
+
+    def _load_frames(self, image_hash: int) -> Union[List[Tuple[Image.Image, int]], StreamedFrames]:
+        """Decodes the image file and scales all the frames to the target size. Animations that
+        would take more than the memory limit are streamed instead.
+
+        :return: The frames and their duration in milliseconds, -1 for a static image
+        :rtype: Union[List[Tuple[Image.Image, int]], StreamedFrames]
+        """
+        frame_duration = []
+        kind = filetype.guess(self.file)
+        if kind is None:
+            svg_code = open(self.file).read()
+            png = cairosvg.svg2png(svg_code, output_height=self.size[1], output_width=self.size[0])
+            image_file = BytesIO(png)
+            image = Image.open(image_file)
+            frame_duration.append(-1)
+        else:
+            image = Image.open(self.file)
+            image.seek(0)
+            while True:
+                try:
+                    frame_duration.append(image.info["duration"])
+                    image.seek(image.tell() + 1)
+                except EOFError:
+                    # Reached the final frame
+                    break
+                except KeyError:
+                    # If the key 'duration' can't be found, it's not an animation
+                    frame_duration.append(-1)
+                    break
+
+        if len(frame_duration) > 1:
+            image.seek(0)
+            first_frame = image.copy()
+            first_frame.thumbnail(self.size, Image.LANCZOS)
+            if frame_bytes(first_frame) * len(frame_duration) > self.memory_limit:
+                return StreamedFrames(self.file, self.size, frame_duration, frame_hashcodes(image_hash, frame_duration), frame_bytes(first_frame))
+
+        # Scale all the frames to the target size
+        frames = []
+        for frame, milliseconds in zip(ImageSequence.Iterator(image), frame_duration):
+            frame = frame.copy()
+            frame.thumbnail(self.size, Image.LANCZOS)
+            frames.append((frame, milliseconds))
+        return frames
+
+
+class ImageSourceRegistry:
+    """
+    Keeps one ImageSource per image file (and modification time), size and memory limit, so an
+    icon used on many buttons, pages or decks is only decoded and held in memory once. Sources
+    are reference counted, and released when the last filter using them is garbage collected.
+    The same goes for the compiled frames of identical pipelines.
+    """
+
+    def __init__(self):
+        self.sources: Dict[Hashable, ImageSource] = {}
+        self.lock = threading.RLock()
+        # Reentrant, because the garbage collector may release a source while the lock is held
+
+    def acquire(self, owner: object, file: str, size: Tuple[int, int], memory_limit: int) -> ImageSource:
+        """Returns the source for an image file, loading it if no other filter uses it yet.
+
+        :param owner: The object that uses the source. The source is released when it is garbage collected.
+        :type owner: object
+        :param file: The image file
+        :type file: str
+        :param size: The size to scale the frames to
+        :type size: Tuple[int, int]
+        :param memory_limit: The maximum number of bytes the decoded frames of an animation may use
+        :type memory_limit: int
+        :return: The shared image source
+        :rtype: ImageSource
+        """
+        try:
+            stat = os.stat(file)
+            # An edited file must not share the frames of the old one
+            version: Optional[Tuple[int, int]] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            version = None
+        image = (os.path.realpath(file), version, tuple(size))
+        key = (image, memory_limit)
+
+        with self.lock:
+            source = self.sources.get(key, None)
+            if source is None:
+                source = ImageSource(file, size, memory_limit, hash((ImageSource, image)))
+                self.sources[key] = source
+            self._use(source, owner, key)
+            return source
+
+    @overload
+    def share_compiled(self, source: ImageSource, owner: object, key: Hashable) -> Optional[CompiledFrames]:
+        """Returns the compiled frames other pipelines stored under the key, if any"""
+
+    @overload
+    def share_compiled(self, source: ImageSource, owner: object, key: Hashable, compiled: CompiledFrames) -> CompiledFrames:
+        """Stores the compiled frames, unless other pipelines stored some first, and returns the shared ones"""
+
+    def share_compiled(self, source: ImageSource, owner: object, key: Hashable, compiled: Optional[CompiledFrames] = None) -> Optional[CompiledFrames]:
+        """Returns the compiled frames other pipelines stored under the key, or stores the given ones.
+
+        :param source: The image source the frames were compiled from
+        :type source: ImageSource
+        :param owner: The pipeline that uses the frames
+        :type owner: object
+        :param key: Identifies the pipeline filters and the device format
+        :type key: Hashable
+        :param compiled: The frames to store when there are none yet, defaults to None
+        :type compiled: Optional[CompiledFrames], optional
+        :return: The shared frames, or None if there are none and none were given
+        :rtype: Optional[CompiledFrames]
+        """
+        with self.lock:
+            shared = source.compiled.get(key, None)
+            if shared is None:
+                if compiled is None:
+                    return None
+                source.compiled[key] = shared = compiled
+            self._use(shared, owner, None)
+            return shared
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of sources, the number of filters using them, the bytes of decoded
+        frames held, and the bytes saved by sharing frames instead of keeping a copy per filter
+        (or per pipeline, for compiled frames).
+
+        :return: A dictionary with sources, users, bytes and bytes_saved
+        :rtype: Dict[str, int]
+        """
+        with self.lock:
+            sources = list(self.sources.values())
+            # Every filter decodes a streamed animation into a window of its own
+            streamed_bytes = sum(source.bytes * source.users for source in sources if isinstance(source.frames, StreamedFrames))
+            shared: List[Union[ImageSource, CompiledFrames]] = [source for source in sources if not isinstance(source.frames, StreamedFrames)]
+            for source in sources:
+                shared.extend(source.compiled.values())
+            return {
+                "sources": len(sources),
+                "users": sum(source.users for source in sources),
+                "bytes": sum(item.bytes for item in shared) + streamed_bytes,
+                "bytes_saved": sum(item.bytes * (item.users - 1) for item in shared if item.users > 1),
+            }
+
+    def _use(self, shared: Union[ImageSource, CompiledFrames], owner: object, key: Optional[Hashable]) -> None:
+        shared.users += 1
+        weakref.finalize(owner, self._release, shared, key)
+
+    def _release(self, shared: Union[ImageSource, CompiledFrames], key: Optional[Hashable]) -> None:
+        with self.lock:
+            shared.users -= 1
+            if not shared.users and key is not None and self.sources.get(key, None) is shared:
+                del self.sources[key]
+
+
+image_sources = ImageSourceRegistry()
+"The image sources shared by all image filters"
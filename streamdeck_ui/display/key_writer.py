@@ -0,0 +1,241 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Tuple
+
+from StreamDeck.Devices.StreamDeck import StreamDeck
+from StreamDeck.Transport.Transport import TransportError
+
+from streamdeck_ui.display.clock import NANOSECONDS_PER_MILLISECOND, Clock, monotonic_clock
+
+
+def resolve(futures: Iterable[Future], result: bool) -> None:
+    """Completes the futures that were not cancelled with the given result"""
+    for future in futures:
+        if future.set_running_or_notify_cancel():
+            future.set_result(result)
+
+
+class KeyWriter:
+    """
+    A KeyWriter sends key images to a Stream Deck on a dedicated thread, so slow USB
+    transfers don't hold up rendering. Each key has a mailbox that only holds the latest
+    image. An image that is replaced before it was sent is dropped. Images that show a key
+    press are sent ahead of all others.
+    """
+
+    def __init__(self, lock: ContextManager, streamdeck: StreamDeck, error_callback: Callable[[], None], clock: Clock = monotonic_clock):
+        """Creates a new key writer
+
+        :param lock: The lock that must be held while writing to the Stream Deck
+        :type lock: ContextManager
+        :param streamdeck: The StreamDeck instance to write to
+        :type streamdeck: StreamDeck
+        :param error_callback: A function to call when the Stream Deck can no longer be
+        written to. Note this runs on the writer thread.
+        :type error_callback: Callable[[], None]
+        :param clock: The clock key press times are read from, defaults to the monotonic clock
+        :type clock: Clock, optional
+        """
+        self.lock = lock
+        self.streamdeck = streamdeck
+        self.error_callback = error_callback
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.pending: Dict[int, bytes] = {}
+        "The latest image for each key that still has to be sent"
+        self.presses: Dict[int, int] = {}
+        "The time of the key press each pending key press image shows, these are sent first"
+        self.key_images: Dict[int, bytes] = {}
+        "The image last sent to each key. Used to skip writing identical images."
+        self.ticket = 0
+        "Counts the images queued"
+        self.tickets: Dict[int, int] = {}
+        "The ticket of each pending image, or of the oldest image it replaced"
+        self.waiters: List[Tuple[int, Future]] = []
+        "Futures waiting for the images queued up to a ticket to be sent, see when_sent"
+        self.writing = False
+        self.writing_ticket = 0
+        self.quit = True
+        "True while the writer thread is not running"
+        self.writer_thread: Optional[threading.Thread] = None
+        self.sent = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.press_count = 0
+        self.press_latency = 0
+        self.press_latency_max = 0
+        # The time from key presses to their images being written, in nanoseconds
+
+    def submit(self, button: int, image: bytes, pressed_at: Optional[int] = None) -> None:
+        """Queues an image to be sent to a key. Replaces any image for that key that was
+        not sent yet.
+
+        :param button: The key index
+        :type button: int
+        :param image: The image in the native format of the Stream Deck
+        :type image: bytes
+        :param pressed_at: When the image shows a key that was just pressed or released, the
+        time of the press. The image is then sent ahead of the others, and the time it took is
+        measured. Defaults to None.
+        :type pressed_at: Optional[int], optional
+        """
+        with self.condition:
+            pending_image = self.pending.get(button, None)
+            if pending_image is not None and (pending_image is image or pending_image == image):
+                # Already on its way
+                self.skipped += 1
+                if pressed_at is not None:
+                    self.presses.setdefault(button, pressed_at)
+                return
+            ticket = None
+            if pending_image is not None:
+                del self.pending[button]
+                # Whoever waits for the dropped image waits for this one instead
+                ticket = self.tickets.pop(button)
+                self.dropped += 1
+            # The image of an earlier press (or release) is no longer pending. Only a press
+            # that is queued below gets to go first.
+            self.presses.pop(button, None)
+
+            last_image = self.key_images.get(button, None)
+            if last_image is image or last_image == image:
+                # The key already shows this image (for example after a page
+                # switch, or a filter that emits the same frame again)
+                self.skipped += 1
+                # The dropped image may have been the last one somebody waited for
+                sent = self._sent_waiters()
+            else:
+                self.ticket += 1
+                self.pending[button] = image
+                self.tickets[button] = self.ticket if ticket is None else ticket
+                if pressed_at is not None:
+                    self.presses[button] = pressed_at
+                self.condition.notify_all()
+                sent = []
+        resolve(sent, True)
+
+    def when_sent(self, futures: List[Future]) -> None:
+        """Completes the futures once the images queued so far have been sent, or replaced by
+        newer images that have been sent. The result is True, or False if the writer stopped first.
+
+        :param futures: The futures to complete
+        :type futures: List[Future]
+        """
+        with self.condition:
+            if not self.quit:
+                self.waiters.extend((self.ticket, future) for future in futures)
+                futures = self._sent_waiters()
+                result = True
+            else:
+                result = False
+        resolve(futures, result)
+
+    def _sent_waiters(self) -> List[Future]:
+        """Removes and returns the futures whose images have all been sent. Must hold the condition."""
+        if not self.waiters:
+            return []
+        outstanding = list(self.tickets.values())
+        if self.writing:
+            outstanding.append(self.writing_ticket)
+        oldest = min(outstanding, default=self.ticket + 1)
+        sent = [future for ticket, future in self.waiters if ticket < oldest]
+        if sent:
+            self.waiters = [(ticket, future) for ticket, future in self.waiters if ticket >= oldest]
+        return sent
+
+    def flush(self) -> None:
+        """Waits until all the queued images have been sent, or the writer stopped."""
+        with self.condition:
+            while (self.pending or self.writing) and not self.quit:
+                self.condition.wait()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the writer counters
+
+        :return: A dictionary with sent, skipped, dropped and queued
+        :rtype: Dict[str, int]
+        """
+        with self.condition:
+            return {"sent": self.sent, "skipped": self.skipped, "dropped": self.dropped, "queued": len(self.pending)}
+
+    def press_latency_stats(self) -> Dict[str, float]:
+        """Returns how long it took from key presses until their images were written
+
+        :return: A dictionary with the number of presses, and the mean and maximum latency in milliseconds
+        :rtype: Dict[str, float]
+        """
+        with self.condition:
+            mean = self.press_latency / self.press_count if self.press_count else 0
+            return {"presses": self.press_count, "mean_ms": mean / NANOSECONDS_PER_MILLISECOND, "max_ms": self.press_latency_max / NANOSECONDS_PER_MILLISECOND}
+
+    def start(self) -> None:
+        if self.writer_thread is not None:
+            self.stop()
+        with self.condition:
+            self.quit = False
+            self.key_images = {}
+            # What the device shows is unknown, write every key again
+        self.writer_thread = threading.Thread(target=self._run)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.quit = True
+            self.pending = {}
+            self.presses = {}
+            self.tickets = {}
+            waiters, self.waiters = self.waiters, []
+            self.condition.notify_all()
+        resolve((future for _, future in waiters), False)
+
+        if self.writer_thread is not None:
+            try:
+                self.writer_thread.join()
+            except RuntimeError:
+                pass
+            self.writer_thread = None
+
+    def _run(self) -> None:
+        """Method that runs on background thread and sends the queued images."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.quit:
+                    self.condition.wait()
+                if self.quit:
+                    return
+                # Key presses first, then the other keys in the order they were queued
+                button = next((key for key in self.presses if key in self.pending), None)
+                if button is None:
+                    self.presses.clear()
+                    button = next(iter(self.pending))
+                image = self.pending.pop(button)
+                pressed_at = self.presses.pop(button, None)
+                self.writing = True
+                self.writing_ticket = self.tickets.pop(button)
+
+            try:
+                with self.lock:
+                    self.streamdeck.set_key_image(button, image)
+            except TransportError:
+                with self.condition:
+                    self.quit = True
+                    self.writing = False
+                    waiters, self.waiters = self.waiters, []
+                    self.condition.notify_all()
+                resolve((future for _, future in waiters), False)
+                self.error_callback()
+                return
+
+            with self.condition:
+                self.key_images[button] = image
+                self.sent += 1
+                if pressed_at is not None:
+                    latency = self.clock() - pressed_at
+                    self.press_count += 1
+                    self.press_latency += latency
+                    self.press_latency_max = max(self.press_latency_max, latency)
+                self.writing = False
+                sent = self._sent_waiters()
+                self.condition.notify_all()
+            resolve(sent, True)
@@ -1,5 +1,4 @@
-from fractions import Fraction
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 
 from PIL import Image, ImageEnhance
 
@@ -11,10 +10,12 @@ class KeypressFilter(Filter):
 
     def __init__(self):
         super(KeypressFilter, self).__init__()
-        self.last_time: Fraction = Fraction()
         self.brightness = 1
         self.dim_brightness = 0.5
         self.filter_hash = hash(self.__class__)
+        self.active_hash = hash((self.filter_hash, True))
+        self.inactive_hash = hash((self.filter_hash, False))
+        self.hashcode = self.inactive_hash
         self.active = False
         self.last_state = False
 
@@ -23,29 +24,39 @@ class KeypressFilter(Filter):
         self.size = size
         pass
 
-    def transform(self, get_input: Callable[[], Image.Image], get_output: Callable[[int], Image.Image], input_changed: bool, time: Fraction) -> Tuple[Image.Image, int]:
-        frame_hash = hash((self.filter_hash, self.active))
-        if input_changed or self.active != self.last_state:
-            self.last_state = self.active
-            image = get_output(frame_hash)
+    def is_pure(self) -> bool:
+        # Passes the input through while the key is not pressed
+        return not self.active
+
+    def transform(self, input: Optional[Image.Image], get_output: Callable[[int], Optional[Image.Image]], input_changed: bool, time: int) -> Optional[Image.Image]:
+        # Read once, a key press may change it on another thread while this runs
+        active = self.active
+        if input_changed or active != self.last_state:
+            self.last_state = active
+            self.hashcode = self.active_hash if active else self.inactive_hash
+            image = get_output(self.hashcode)
             if image:
-                return (image, frame_hash)
+                return image
 
-            input = get_input()
-            if self.active:
-                input = get_input()
-                background = self.blank_image.copy()
-                input.thumbnail((self.size[0] - 10, self.size[1] - 10), Image.ANTIALIAS)
-                # Reduce the image by 10px
+            if active:
+                return self.pressed_image(input)
+            else:
+                # Nothing to do, pass the input through
+                return input
+        return None
 
-                enhancer = ImageEnhance.Brightness(input)
-                input = enhancer.enhance(2)
-                # Light it up a bit
+    def pressed_image(self, input: Image.Image) -> Image.Image:
+        """Returns the input as it looks while the key is pressed. The input is left alone."""
+        background = self.blank_image.copy()
+        image = input.copy()
+        image.thumbnail((self.size[0] - 10, self.size[1] - 10), Image.ANTIALIAS)
+        # Reduce the image by 10px
 
-                background.paste(input, (5, 5))
-                # Center the image
+        enhancer = ImageEnhance.Brightness(image)
+        image = enhancer.enhance(2)
+        # Light it up a bit
 
-                return (background, frame_hash)
-            else:
-                return (input, frame_hash)
-        return (None, frame_hash)
+        background.paste(image, (5, 5))
+        # Center the image
+
+        return background
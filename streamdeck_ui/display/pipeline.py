@@ -1,69 +1,231 @@
-from fractions import Fraction
-from typing import Dict, List, Tuple
+from typing import Callable, Hashable, List, Optional, Tuple
 
 from PIL.Image import Image
 
+from streamdeck_ui.display.cache import LRUCache
 from streamdeck_ui.display.filter import Filter
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.image_source import CompiledFrames, image_sources
+
+COMPILED_ANIMATION_SIZE = 4 * 1024 * 1024
+"The maximum number of bytes of finished frames a compiled pipeline may keep"
+
+
+def image_size(image: Image) -> int:
+    """Returns the (approximate) number of bytes used by the pixel data of an image."""
+    return image.width * image.height * len(image.getbands())
+
+
+class OutputLookup:
+    """
+    Looks up the output of a filter in the output cache of a pipeline. A pipeline passes the same
+    instance to every filter, rather than creating a closure per filter on every frame.
+    """
+
+    __slots__ = ("output_cache", "pipeline_hash")
+
+    def __init__(self, output_cache: LRUCache[Image]):
+        self.output_cache = output_cache
+        self.pipeline_hash = 0
+        "The pipeline hash of the input of the filter that is running"
+
+    def __call__(self, output_hash: int) -> Optional[Image]:
+        return self.output_cache.get(hash((output_hash, self.pipeline_hash)))
+
+
+def no_output(output_hash: int) -> Optional[Image]:
+    """An output lookup for filters that run outside a pipeline"""
+    return None
 
 
 class Pipeline:
-    def __init__(self) -> None:
+    def __init__(self, cache_size: int = 4 * 1024 * 1024) -> None:
+        """Creates a new pipeline
+
+        :param cache_size: The maximum number of bytes of intermediate images to keep
+        in the output cache, defaults to 4 MB
+        :type cache_size: int, optional
+        """
         self.filters: List[Tuple[Filter, Image]] = []
         self.first_run = True
-        self.output_cache: Dict[int, Image] = {}
+        self.output_cache: LRUCache[Image] = LRUCache(cache_size, image_size)
+        self.output_lookup = OutputLookup(self.output_cache)
+        self.hashcode = 0
+        "The pipeline hash of the last result"
+        self.filter_hashes: List[Optional[int]] = []
+        self.input_hashes: List[int] = []
+        self.stage_hashes: List[int] = []
+        # The pipeline hash after each filter, and the hashes it was combined from. Combining
+        # allocates, so it is only done when one of them changed.
+        self.animation: Optional[ImageFilter] = None
+        "The animated image of a compiled pipeline"
+        self.compiled: List[Tuple[Image, bytes]] = []
+        "The finished image and the encoded image for each frame of a compiled pipeline"
+        self.replaying = False
+        "True while the output comes from the compiled frames rather than the filters"
 
     def add(self, filter: Filter) -> None:
         self.filters.append((filter, None))
+        self.filter_hashes.append(None)
+        self.input_hashes.append(0)
+        self.stage_hashes.append(0)
         self.first_run = True
+        self.animation = None
+        self.compiled = []
 
-    def execute(self, time: Fraction) -> Tuple[Image, int]:
+    def clear_caches(self) -> None:
+        """Empties the output cache and drops the compiled frames, so the next frames are made by the filters again"""
+        self.output_cache.clear()
+        self.animation = None
+        self.compiled = []
+
+    def execute(self, time: int) -> Optional[Image]:
         """
         Executes all the filter in the pipeline and returns the final image, or None if the pipeline did not yield any changes.
+        The hashcode attribute identifies the final image either way.
+
+        Nothing is allocated while none of the filters change.
         """
 
         image: Image = None
-        is_modified = False
+        is_modified = self.first_run
         pipeline_hash = 0
+        output_lookup = self.output_lookup
 
-        # To avoid flake8 B023 (https://docs.python-guide.org/writing/gotchas/#late-binding-closures), we need to
-        # capture the variable going into the lambda. However, as a result of that, we have a lambda that
-        # technically takes an argument (with a default) that does not match the signature we declared
-        # for the transform() method. There are likely other solutions to avoid the warning this produces,
-        # like using functools.partial, but this needs to be investigated.
+        # A while loop, because a for loop allocates an iterator
+        i = 0
+        while i < len(self.filters):
+            current_filter, cached = self.filters[i]
+            output_lookup.pipeline_hash = pipeline_hash
+            output = current_filter.transform(image, output_lookup, is_modified, time)
 
-        for i, (current_filter, cached) in enumerate(self.filters):
-            (image, hashcode) = current_filter.transform(
-                lambda input_image=image: input_image.copy(),  # type: ignore [misc]
-                lambda output_hash, pipeline_hash=pipeline_hash: self.output_cache.get(hash((output_hash, pipeline_hash)), None),  # type: ignore [misc]
-                is_modified | self.first_run,
-                time,
-            )
+            hashcode = current_filter.hashcode
+            if hashcode != self.filter_hashes[i] or pipeline_hash != self.input_hashes[i]:
+                self.filter_hashes[i] = hashcode
+                self.input_hashes[i] = pipeline_hash
+                self.stage_hashes[i] = hash((hashcode, pipeline_hash))
+            pipeline_hash = self.stage_hashes[i]
 
-            pipeline_hash = hash((hashcode, pipeline_hash))
-
-            if not image:
+            if output is None:
                 # Filter indicated that it did NOT change anything, pull up the last
                 # cached value for the next step in the pipeline
                 image = cached
             else:
                 # The filter changed the image, cache it for future use
                 # Update tuple with cached image
-                self.filters[i] = (current_filter, image)
+                self.filters[i] = (current_filter, output)
+                image = output
                 is_modified = True
 
             # Store this image with pipeline hash if we haven't seen it.
-            if pipeline_hash not in self.output_cache:
-                self.output_cache[pipeline_hash] = image
+            if image is not None and pipeline_hash not in self.output_cache:
+                self.output_cache.put(pipeline_hash, image)
+            i += 1
 
-        if self.first_run:
-            # Force an update the first time the pipeline runs
-            is_modified = True
-            self.first_run = False
+        # The first run always counts as an update, so icons show up
+        self.first_run = False
+        self.hashcode = pipeline_hash
+        return image if is_modified else None
 
-        return (image if is_modified else None, pipeline_hash)
+    def compile(self, encode: Callable[[Image], bytes], max_bytes: int = COMPILED_ANIMATION_SIZE, encoding: Hashable = None) -> bool:
+        """
+        Runs the filters once for every frame of the animated image in the pipeline, and keeps the
+        finished frames, together with the result of the encode function (for example the native
+        format of the device). The animation can then be replayed without any image processing,
+        see replay(). This is only safe when all the other filters are pure.
+
+        :param Callable[[Image], bytes] encode: Converts a finished frame to the format the caller needs.
+        :param int max_bytes: The maximum number of bytes the finished frames may use, defaults to
+        COMPILED_ANIMATION_SIZE. Longer animations are not compiled.
+        :param Hashable encoding: Identifies what the encode function produces. When given, pipelines
+        with the same filters and encoding share their compiled frames. Defaults to None.
+
+        :rtype: bool
+        :return: True if the pipeline was compiled.
+        """
+        impure = [current_filter for current_filter, _ in self.filters if not current_filter.is_pure()]
+        if len(impure) != 1 or not isinstance(impure[0], ImageFilter) or self.filters[0][0] is impure[0]:
+            # The animation needs an input to paste on
+            return False
+        animation = impure[0]
+        if image_size(animation.frames[0][0]) * len(animation.frames) > max_bytes:
+            # Don't decode a long (possibly streamed) animation only to give up half way
+            return False
+
+        def render(frame_index: int) -> Tuple[Image, int]:
+            image: Image = None
+            pipeline_hash = 0
+            for current_filter, _ in self.filters:
+                if current_filter is animation:
+                    image = animation.paste_frame(image.copy(), frame_index)
+                    hashcode = animation.frames[frame_index][2]
+                else:
+                    output = current_filter.transform(image, no_output, True, 0)
+                    hashcode = current_filter.hashcode
+                    if output is not None:
+                        image = output
+                pipeline_hash = hash((hashcode, pipeline_hash))
+            return (image, pipeline_hash)
+
+        image, pipeline_hash = render(0)
+        # The pipeline hash of the first frame identifies the filters, like it does for the output cache
+        key = (pipeline_hash, encoding)
+        compiled = image_sources.share_compiled(animation.source, self, key) if encoding is not None else None
+        if compiled is None:
+            compiled = CompiledFrames()
+            for frame_index in range(len(animation.frames)):
+                if frame_index:
+                    image, _ = render(frame_index)
+                encoded = encode(image)
+                compiled.bytes += image_size(image) + len(encoded)
+                if compiled.bytes > max_bytes:
+                    return False
+                compiled.append((image, encoded))
+            if encoding is not None:
+                compiled = image_sources.share_compiled(animation.source, self, key, compiled)
+
+        self.animation = animation
+        self.compiled = compiled
+        return True
+
+    def replay(self, time: int) -> Optional[Tuple[bool, bytes]]:
+        """
+        Advances the animation of a compiled pipeline and returns the encoded frame, without running
+        the filters.
+
+        :param int time: The current time in nanoseconds.
+
+        :rtype: Optional[Tuple[bool, bytes]]
+        :return: True if the frame changed since the last call, and the encoded frame. None if the
+        pipeline is not compiled, or one of the other filters is no longer pure (for example while
+        a key is pressed), in which case the pipeline has to be executed instead.
+        """
+        if self.animation is None or not all(current_filter.is_pure() for current_filter, _ in self.filters if current_filter is not self.animation):
+            if self.replaying:
+                # The filters did not run while replaying, have them all catch up
+                self.replaying = False
+                self.first_run = True
+            return None
+
+        changed = self.animation.advance(time) or self.first_run or not self.replaying
+        self.first_run = False
+        self.replaying = True
+        return (changed, self.compiled[self.animation.frame_index][1])
+
+    def next_change(self, time: int) -> Optional[int]:
+        """
+        Returns the earliest time any of the filters will change on their own, or None if
+        the pipeline output only changes when it is replaced or a key is pressed.
+        """
+        deadlines = [deadline for deadline in (current_filter.next_change(time) for current_filter, _ in self.filters) if deadline is not None]
+        return min(deadlines) if deadlines else None
 
     def last_result(self) -> Image:
         """
-        Returns the last known output of the pipeline
+        Returns the last known output of the pipeline, or None if it has no filters yet
         """
+        if not self.filters:
+            return None
+        if self.replaying and self.animation is not None:
+            return self.compiled[self.animation.frame_index][0]
         return self.filters[-1][1]
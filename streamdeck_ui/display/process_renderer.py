@@ -0,0 +1,263 @@
+import multiprocessing
+import os
+import threading
+import weakref
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Iterable, List, Optional, Tuple, cast
+
+from PIL import Image
+from StreamDeck.ImageHelpers import PILHelper
+
+from streamdeck_ui.display.cache import LRUCache
+from streamdeck_ui.display.empty_filter import EmptyFilter
+from streamdeck_ui.display.filter import Filter
+from streamdeck_ui.display.keypress_filter import KeypressFilter
+from streamdeck_ui.display.pipeline import Pipeline
+
+RENDER_PROCESSES = min(4, os.cpu_count() or 1)
+"The number of worker processes used by a ProcessRenderer"
+
+SLOT_SIZE = 64 * 1024
+"The number of bytes of shared memory reserved for the native image of each key"
+
+
+class RenderProcessError(Exception):
+    """Raised when a worker process of a ProcessRenderer can no longer be reached, for
+    example because it crashed. The renderer can't be used anymore after that."""
+
+    pass
+
+
+class NativeFormat:
+    """Stands in for the StreamDeck when converting images to the native format in a
+    worker process, where the device itself is not available.
+    """
+
+    def __init__(self, image_format: Dict[str, Any]):
+        self.image_format = image_format
+
+    def key_image_format(self) -> Dict[str, Any]:
+        return self.image_format
+
+
+class ProcessRenderer:
+    """
+    A ProcessRenderer runs the pipelines of a display in worker processes, so expensive
+    filters are not limited by the GIL. Each button is owned by one worker, which keeps the
+    pipeline (and its state) for that button. Workers write the native images into shared
+    memory, one slot per key, so only small messages go through the pipes.
+    """
+
+    def __init__(self, size: Tuple[int, int], image_format: Dict[str, Any], key_count: int, processes: int = RENDER_PROCESSES):
+        """Creates a new renderer and starts its worker processes
+
+        :param size: The size of the key images
+        :type size: Tuple[int, int]
+        :param image_format: The native key image format of the Stream Deck
+        :type image_format: Dict[str, Any]
+        :param key_count: The number of keys on the Stream Deck
+        :type key_count: int
+        :param processes: The number of worker processes, defaults to RENDER_PROCESSES
+        :type processes: int, optional
+        """
+        context = multiprocessing.get_context("spawn")
+        # Forking a process that runs threads (and Qt) is not safe
+        self.shared_memory = SharedMemory(create=True, size=key_count * SLOT_SIZE)
+        self.buffer = cast(memoryview, self.shared_memory.buf)
+        self.connections: List[Connection] = []
+        self.locks: List[threading.Lock] = []
+        workers: List[BaseProcess] = []
+        for _ in range(min(processes, key_count)):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(target=_run_worker, args=(worker_connection, self.shared_memory.name, size, image_format), daemon=True)
+            worker.start()
+            workers.append(worker)
+            self.connections.append(connection)
+            self.locks.append(threading.Lock())
+        self.workers = workers
+        self._finalizer = weakref.finalize(self, _shutdown, self.connections, workers, self.shared_memory)
+
+    def replace(self, page: int, button: int, filters: List[Filter]) -> None:
+        """Replaces the pipeline for a button. The filters must not be initialized yet."""
+        self._request(button, ("replace", page, button, filters))
+
+    def set_keypress(self, page: int, button: int, active: bool) -> None:
+        self._request(button, ("keypress", page, button, active))
+
+    def release_keys(self, page: int) -> None:
+        """Makes sure none of the keys on the given page show as pressed"""
+        for worker in range(len(self.connections)):
+            self._request(worker, ("release", page))
+
+    def get_image(self, page: int, button: int) -> Image.Image:
+        """Returns the last image the pipeline of a button produced"""
+        return self._request(button, ("image", page, button))
+
+    def clear_caches(self) -> None:
+        """Empties the caches of all the workers"""
+        for worker in range(len(self.connections)):
+            self._request(worker, ("clear",))
+
+    def render(self, page: int, buttons: Iterable[int], time: int, force_update: bool) -> Dict[int, Tuple[Optional[bytes], Optional[int]]]:
+        """Processes the pipelines of the given buttons. All the workers render at the same time.
+
+        :return: A dictionary with the native image (or None if the button did not change)
+        and the time the pipeline will next change by itself, for each button.
+        :rtype: Dict[int, Tuple[Optional[bytes], Optional[int]]]
+        """
+        work: Dict[int, List[int]] = {}
+        for button in buttons:
+            work.setdefault(button % len(self.connections), []).append(button)
+
+        for worker in work:
+            self.locks[worker].acquire()
+        try:
+            for worker, worker_buttons in work.items():
+                self.connections[worker].send(("render", page, worker_buttons, time, force_update))
+
+            results: Dict[int, Tuple[Optional[bytes], Optional[int]]] = {}
+            for worker in work:
+                for button, length, overflow, next_change in self.connections[worker].recv():
+                    if overflow is not None:
+                        native_image: Optional[bytes] = overflow
+                    elif length >= 0:
+                        native_image = bytes(self.buffer[button * SLOT_SIZE : button * SLOT_SIZE + length])
+                    else:
+                        native_image = None
+                    results[button] = (native_image, next_change)
+            return results
+        except (EOFError, OSError) as error:
+            raise RenderProcessError(f"Render process failed: {error!r}") from error
+        finally:
+            for worker in work:
+                self.locks[worker].release()
+
+    def close(self) -> None:
+        """Stops the worker processes and releases the shared memory"""
+        self._finalizer()
+
+    def _request(self, button: int, message: Tuple) -> Any:
+        """Sends a message to the worker that owns the button and returns the reply
+
+        :raises RenderProcessError: If the worker process can't be reached
+        """
+        worker = button % len(self.connections)
+        with self.locks[worker]:
+            try:
+                self.connections[worker].send(message)
+                return self.connections[worker].recv()
+            except (EOFError, OSError) as error:
+                raise RenderProcessError(f"Render process failed: {error!r}") from error
+
+
+def _shutdown(connections: List[Connection], workers: List[BaseProcess], shared_memory: SharedMemory) -> None:
+    for connection in connections:
+        try:
+            connection.send(("stop",))
+        except OSError:
+            pass
+    for worker in workers:
+        worker.join(timeout=1)
+    shared_memory.close()
+    shared_memory.unlink()
+
+
+def _run_worker(connection: Connection, shared_memory_name: str, size: Tuple[int, int], image_format: Dict[str, Any]) -> None:
+    """Runs in the worker process and serves the requests of a ProcessRenderer"""
+    shared_memory = SharedMemory(name=shared_memory_name)
+    buffer = cast(memoryview, shared_memory.buf)
+    native_format = NativeFormat(image_format)
+    empty_filter = EmptyFilter()
+    empty_filter.initialize(size)
+    pipelines: Dict[Tuple[int, int], Pipeline] = {}
+    keypresses: Dict[Tuple[int, int], KeypressFilter] = {}
+    frame_cache: LRUCache[bytes] = LRUCache(16 * 1024 * 1024)
+    pipeline: Optional[Pipeline]
+
+    while True:
+        message = connection.recv()
+        command = message[0]
+
+        if command == "stop":
+            break
+
+        if command == "replace":
+            _, page, button, filters = message
+            pipeline = Pipeline()
+            pipeline.add(empty_filter)
+            for filter in filters:
+                filter.initialize(size)
+                pipeline.add(filter)
+            keypress = KeypressFilter()
+            keypress.initialize(size)
+            pipeline.add(keypress)
+            pipeline.compile(lambda image: bytes(PILHelper.to_native_format(native_format, image)), encoding=tuple(sorted(image_format.items())))
+            pipelines[(page, button)] = pipeline
+            keypresses[(page, button)] = keypress
+            connection.send(None)
+        elif command == "keypress":
+            _, page, button, active = message
+            if (page, button) in keypresses:
+                keypresses[(page, button)].active = active
+            connection.send(None)
+        elif command == "release":
+            _, page = message
+            for (keypress_page, _), keypress in keypresses.items():
+                if keypress_page == page:
+                    keypress.active = False
+            connection.send(None)
+        elif command == "image":
+            _, page, button = message
+            pipeline = pipelines.get((page, button), None)
+            connection.send(pipeline.last_result() if pipeline else None)
+        elif command == "clear":
+            frame_cache.clear()
+            for pipeline in pipelines.values():
+                pipeline.clear_caches()
+            connection.send(None)
+        elif command == "render":
+            _, page, buttons, time, force_update = message
+            results: List[Tuple[int, int, Optional[bytes], Optional[int]]] = []
+            for button in buttons:
+                pipeline = pipelines.get((page, button), None)
+                if pipeline is None:
+                    results.append((button, -1, None, None))
+                    continue
+
+                replayed = pipeline.replay(time)
+                if replayed is not None:
+                    # A compiled animation, the frames are already in the native format
+                    changed, native_image = replayed
+                    next_change = pipeline.next_change(time)
+                    if not changed and not force_update:
+                        results.append((button, -1, None, next_change))
+                        continue
+                else:
+                    image = pipeline.execute(time)
+                    hashcode = pipeline.hashcode
+                    next_change = pipeline.next_change(time)
+                    if force_update and image is None:
+                        image = pipeline.last_result()
+                    if not image:
+                        results.append((button, -1, None, next_change))
+                        continue
+
+                    cached_image = frame_cache.get(hashcode)
+                    if cached_image is None:
+                        cached_image = bytes(PILHelper.to_native_format(native_format, image))
+                        frame_cache.put(hashcode, cached_image)
+                    native_image = cached_image
+
+                length = len(native_image)
+                overflow = None
+                if length <= SLOT_SIZE:
+                    buffer[button * SLOT_SIZE : button * SLOT_SIZE + length] = native_image
+                else:
+                    # Doesn't fit the slot, send it through the pipe instead
+                    overflow = native_image
+                results.append((button, length, overflow, next_change))
+            connection.send(results)
+
+    shared_memory.close()
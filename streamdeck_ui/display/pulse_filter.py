@@ -1,42 +1,109 @@
-from fractions import Fraction
-from typing import Callable, Tuple
+import math
+from typing import Callable, List, Optional, Tuple
 
-from PIL import Image, ImageEnhance
+from PIL import Image
 
+from streamdeck_ui.display.clock import NANOSECONDS_PER_SECOND
 from streamdeck_ui.display.filter import Filter
 
+PULSE_PERIOD = NANOSECONDS_PER_SECOND
+"The time a pulse takes to go from bright to dim and back, in nanoseconds"
+
+PULSE_LEVELS = 16
+"The number of brightness levels a smooth pulse fades through"
+
+PULSE_CURVES = ("blink", "triangle", "sine")
+"""How the brightness changes over a pulse. A blink switches between bright and dim halfway, a
+triangle fades linearly, and a sine fades slowly near bright and dim and fast in between."""
+
+
+def brightness_table(brightness: float, bands: Tuple[str, ...]) -> List[int]:
+    """Returns the lookup table that scales the color bands of an image by the brightness, for Image.point"""
+    table: List[int] = []
+    for band in bands:
+        if band == "A":
+            table.extend(range(256))
+        else:
+            table.extend(min(255, int(value * brightness)) for value in range(256))
+    return table
+
 
 class PulseFilter(Filter):
-    def __init__(self):
+    def __init__(self, period: int = PULSE_PERIOD, curve: str = "blink", levels: int = PULSE_LEVELS):
+        """Creates a new pulse
+
+        :param period: The time from bright to dim and back in nanoseconds, defaults to PULSE_PERIOD
+        :type period: int, optional
+        :param curve: One of PULSE_CURVES, defaults to "blink"
+        :type curve: str, optional
+        :param levels: The number of brightness levels of a smooth pulse, defaults to PULSE_LEVELS
+        :type levels: int, optional
+        """
         super(PulseFilter, self).__init__()
-        self.last_time: Fraction = Fraction()
-        self.pulse_delay = 0.5
-        self.brightness = 1
+        self.period = period
+        self.curve = curve
         self.dim_brightness = 0.5
+        # The brightness of each level, and the level shown during each step of a pulse
+        if curve == "blink" or levels < 2:
+            self.brightness_levels = [self.dim_brightness, 1.0]
+            self.steps = [1, 0]
+        else:
+            self.brightness_levels = [self.dim_brightness + (1 - self.dim_brightness) * level / (levels - 1) for level in range(levels)]
+            step_count = 2 * (levels - 1)
+            self.steps = []
+            for step in range(step_count):
+                if curve == "sine":
+                    fade = (1 - math.cos(2 * math.pi * step / step_count)) / 2
+                else:
+                    fade = 1 - abs(1 - 2 * step / step_count)
+                self.steps.append(round((1 - fade) * (levels - 1)))
+
+        self.start: Optional[int] = None
+        "When the pulse started, or None if it has not been shown yet"
+        self.step = 0
+        "The number of steps since the pulse started"
+        self.level = self.steps[0]
         self.filter_hash = hash(self.__class__)
+        self.level_hashes = [hash((self.filter_hash, brightness)) for brightness in self.brightness_levels]
+        self.hashcode = self.level_hashes[self.level]
+        self.level_images: List[Optional[Image.Image]] = [None] * len(self.brightness_levels)
+        # The input at each brightness level, computed when the level is first shown after the input changed
 
     def initialize(self, size: Tuple[int, int]):
         pass
 
-    def transform(self, get_input: Callable[[], Image.Image], get_output: Callable[[int], Image.Image], input_changed: bool, time: Fraction) -> Tuple[Image.Image, int]:
-        brightness_changed = False
-        if time - self.last_time > self.pulse_delay:
-            brightness_changed = True
-            self.last_time = time
-
-            if self.brightness == self.dim_brightness:
-                self.brightness = 1
-            else:
-                self.brightness = self.dim_brightness
-
-        frame_hash = hash((self.filter_hash, self.brightness))
-        if input_changed or brightness_changed:
-            image = get_output(frame_hash)
-            if image:
-                return (image, frame_hash)
-
-            input = get_input()
-            enhancer = ImageEnhance.Brightness(input)
-            input = enhancer.enhance(self.brightness)
-            return (input, frame_hash)
-        return (None, frame_hash)
+    def next_change(self, time: int) -> Optional[int]:
+        if self.start is None:
+            return None
+        # Rounded up, so the step has changed by the time it returns
+        return self.start - (-(self.step + 1) * self.period // len(self.steps))
+
+    def transform(self, input: Optional[Image.Image], get_output: Callable[[int], Optional[Image.Image]], input_changed: bool, time: int) -> Optional[Image.Image]:
+        if self.start is None:
+            # The pulse starts when it is first shown
+            self.start = time
+        else:
+            # Steps are counted from the start rather than from the last step, so the pulse doesn't drift
+            self.step = (time - self.start) * len(self.steps) // self.period
+
+        level = self.steps[self.step % len(self.steps)]
+        level_changed = level != self.level
+        if level_changed:
+            self.level = level
+            self.hashcode = self.level_hashes[level]
+
+        if input_changed:
+            for index in range(len(self.level_images)):
+                self.level_images[index] = None
+        elif not level_changed:
+            return None
+
+        image = self.level_images[level]
+        if image is None:
+            image = get_output(self.hashcode)
+            if image is None:
+                brightness = self.brightness_levels[level]
+                # The input is left alone, point creates a new image. Without an input there is nothing to dim.
+                image = input if brightness == 1 or input is None else input.point(brightness_table(brightness, input.getbands()))
+            self.level_images[level] = image
+        return image
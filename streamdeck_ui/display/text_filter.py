@@ -1,54 +1,117 @@
 import os
-from fractions import Fraction
-from typing import Callable, Tuple
+import threading
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
 
 from PIL import Image, ImageDraw, ImageFilter, ImageFont
 
 from streamdeck_ui.config import FONTS_PATH
+from streamdeck_ui.display.cache import LRUCache
 from streamdeck_ui.display.filter import Filter
+from streamdeck_ui.display.glyph_atlas import GlyphAtlas
+
+FONT_CACHE_SIZE = 16
+"The number of loaded fonts to keep"
+
+LABEL_CACHE_SIZE = 8 * 1024 * 1024
+"The maximum number of bytes of finished label overlays to keep"
+
+FONT_SIZE = 14
+"The size labels are drawn in"
+
+TEXT_MODE_LABEL = ""
+"Lays out, draws and blurs the whole label. The best looking, for labels that rarely change."
+
+TEXT_MODE_ATLAS = "atlas"
+"Puts labels together from cached characters, see GlyphAtlas. For labels that change often, like counters."
+
+
+# fmt: off
+_kernel = [
+    0, 1, 2, 1, 0,
+    1, 2, 4, 2, 1,
+    2, 4, 8, 4, 1,
+    1, 2, 4, 2, 1,
+    0, 1, 2, 1, 0]
+# fmt: on
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font: str, size: int) -> ImageFont.FreeTypeFont:
+    """Returns the font file with the given name from the fonts directory, loading it only once"""
+    return ImageFont.truetype(os.path.join(FONTS_PATH, font), size)
+
+
+label_cache: LRUCache[Image.Image] = LRUCache(LABEL_CACHE_SIZE, lambda label: label.width * label.height * len(label.getbands()))
+"The finished label overlays by text, font, alignment and key size, shared by all text filters"
+
+_label_lock = threading.Lock()
+# Renders one label at a time, so filters with the same label never render it twice
 
 
 class TextFilter(Filter):
-    font_blur: ImageFilter.Kernel = None
-    # Static instance - no need to create one per Filter instance
+    font_blur: ImageFilter.Kernel = ImageFilter.Kernel((5, 5), _kernel, scale=0.1 * sum(_kernel))
+    # Static instance - no need to create one per Filter instance. Created once on import, so
+    # it is also available in render processes.
 
     image: Image
 
-    def __init__(self, text: str, font: str, vertical_align: str):
+    def __init__(self, text: str, font: str, vertical_align: str, mode: str = TEXT_MODE_LABEL):
         super(TextFilter, self).__init__()
         self.text = text
+        self.font = font
         self.vertical_align = vertical_align
-        self.true_font = ImageFont.truetype(os.path.join(FONTS_PATH, font), 14)
-        # fmt: off
-        kernel = [
-            0, 1, 2, 1, 0,
-            1, 2, 4, 2, 1,
-            2, 4, 8, 4, 1,
-            1, 2, 4, 2, 1,
-            0, 1, 2, 1, 0]
-        # fmt: on
-        TextFilter.font_blur = ImageFilter.Kernel((5, 5), kernel, scale=0.1 * sum(kernel))
+        self.mode = mode
         self.offset = 0.0
         self.offset_direction = 1
         self.image = None
 
         # Hashcode should be created for anything that makes this frame unique
-        self.hashcode = hash((self.__class__, text, font, vertical_align))
+        self.hashcode = hash((self.__class__, text, font, vertical_align, mode))
 
     def initialize(self, size: Tuple[int, int]):
-        self.image = Image.new("RGBA", size)
-        backdrop_draw = ImageDraw.Draw(self.image)
+        if self.mode == TEXT_MODE_ATLAS:
+            # The label is likely to change again soon, don't push others out of the label cache
+            atlas = glyph_atlas(self.font)
+            label_w = atlas.text_width(self.text)
+            self.image = atlas.render(self.text, size, ((size[0] - label_w) // 2, self._label_y(size, atlas.line_height)))
+            return
+
+        # Labels like "Back" repeat across buttons, pages and decks. The overlay is never
+        # modified once rendered, so they can all share it.
+        key = (self.text, self.font, self.vertical_align, tuple(size))
+        with _label_lock:
+            self.image = label_cache.get(key)
+            if self.image is None:
+                self.image = self._render(size)
+                label_cache.put(key, self.image)
+
+    def _render(self, size: Tuple[int, int]) -> Image.Image:
+        """Renders the label with a blurred shadow onto a transparent image of the given size"""
+        true_font = load_font(self.font, FONT_SIZE)
+        image = Image.new("RGBA", size)
+        backdrop_draw = ImageDraw.Draw(image)
 
         # Calculate the height and width of the text we're drawing, using the font itself
-        label_w, _ = backdrop_draw.textsize(self.text, font=self.true_font)
+        label_w, _ = backdrop_draw.textsize(self.text, font=true_font)
 
         # Calculate dimensions for text that include ascender (above the line)
         # and below the line  (descender) characters. This is used to adust the
         # font placement and should allow for button text to horizontally align
         # across buttons. Basically we want to figure out what is the tallest
         # text we will need to draw.
-        _, label_h = backdrop_draw.textsize("lLpgyL|", font=self.true_font)
+        _, label_h = backdrop_draw.textsize("lLpgyL|", font=true_font)
+        label_pos = ((size[0] - label_w) // 2, self._label_y(size, label_h))
+
+        backdrop_draw.text(label_pos, text=self.text, font=true_font, fill="black")
+        image = image.filter(TextFilter.font_blur)
+
+        foreground_draw = ImageDraw.Draw(image)
+        foreground_draw.text(label_pos, text=self.text, font=true_font, fill="white")
+        return image
 
+    def _label_y(self, size: Tuple[int, int], label_h: int) -> int:
+        """Returns the top of the label for the vertical alignment, given the height of the tallest text"""
         gap = (size[1] - 5 * label_h) // 4
 
         if self.vertical_align == "top":
@@ -62,16 +125,12 @@ class TextFilter(Filter):
         else:
             label_y = size[1] - label_h
             # Default or "bottom"
+        return label_y
 
-        label_pos = ((size[0] - label_w) // 2, label_y)
+    def is_pure(self) -> bool:
+        return True
 
-        backdrop_draw.text(label_pos, text=self.text, font=self.true_font, fill="black")
-        self.image = self.image.filter(TextFilter.font_blur)
-
-        foreground_draw = ImageDraw.Draw(self.image)
-        foreground_draw.text(label_pos, text=self.text, font=self.true_font, fill="white")
-
-    def transform(self, get_input: Callable[[], Image.Image], get_output: Callable[[int], Image.Image], input_changed: bool, time: Fraction) -> Tuple[Image.Image, int]:
+    def transform(self, input: Optional[Image.Image], get_output: Callable[[int], Optional[Image.Image]], input_changed: bool, time: int) -> Optional[Image.Image]:
         """
         The transformation returns the loaded image, ando overwrites whatever came before.
         """
@@ -79,9 +138,16 @@ class TextFilter(Filter):
         if input_changed:
             image = get_output(self.hashcode)
             if image:
-                return (image, self.hashcode)
+                return image
+
+            # The first filter of a pipeline has no input to draw on
+            image = input.copy() if input is not None else Image.new("RGB", self.image.size)
+            image.paste(self.image, self.image)
+            return image
+        return None
+
 
-            input = get_input()
-            input.paste(self.image, self.image)
-            return (input, self.hashcode)
-        return (None, self.hashcode)
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def glyph_atlas(font: str) -> GlyphAtlas:
+    """Returns the glyph atlas of the font file with the given name, shared by all text filters"""
+    return GlyphAtlas(load_font(font, FONT_SIZE), TextFilter.font_blur)
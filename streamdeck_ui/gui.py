@@ -15,7 +15,7 @@ from PySide6.QtGui import QAction, QDesktopServices, QDrag, QIcon
 from PySide6.QtWidgets import QApplication, QDialog, QFileDialog, QMainWindow, QMenu, QMessageBox, QSizePolicy, QSystemTrayIcon
 
 from streamdeck_ui.api import StreamDeckServer
-from streamdeck_ui.config import LOGO, STATE_FILE
+from streamdeck_ui.config import LOGO
 from streamdeck_ui.semaphore import Semaphore, SemaphoreAcquireError
 from streamdeck_ui.ui_main import Ui_MainWindow
 from streamdeck_ui.ui_settings import Ui_SettingsDialog
@@ -118,15 +118,7 @@ class DraggableButton(QtWidgets.QToolButton):
             if e.mimeData().hasUrls:
                 file_name = e.mimeData().urls()[0].toLocalFile()
                 self.api.set_button_icon(serial_number, page, self.index, file_name)
-
-        if e.source():
-            icon = self.api.get_button_icon_pixmap(serial_number, page, e.source().index)
-            if icon:
-                e.source().setIcon(icon)
-
-        icon = self.api.get_button_icon_pixmap(serial_number, page, self.index)
-        if icon:
-            self.setIcon(icon)
+        # The buttons are redrawn when the Stream Deck shows the change, see streamdeck_shown
 
     def dragEnterEvent(self, e):  # noqa: N802 - Part of QT signature.
         if type(self) is DraggableButton:
@@ -159,8 +151,9 @@ def handle_keypress(ui, deck_id: str, key: int, state: bool) -> None:
         if pnput_supported:
             kb = Controller()
         page = api.get_page(deck_id)
+        button = api.get_button(deck_id, page, key)
 
-        command = api.get_button_command(deck_id, page, key)
+        command = button.command
         if command:
             try:
                 Popen(shlex.split(command))
@@ -168,7 +161,7 @@ def handle_keypress(ui, deck_id: str, key: int, state: bool) -> None:
                 print(f"The command '{command}' failed: {error}")
 
         if pnput_supported:
-            keys = api.get_button_keys(deck_id, page, key)
+            keys = button.keys
             if keys:
                 keys = keys.strip().replace(" ", "")
                 for section in keys.split(","):
@@ -218,21 +211,21 @@ def handle_keypress(ui, deck_id: str, key: int, state: bool) -> None:
                                 print(f"Could not release key '{key_name}'")
 
         if pnput_supported:
-            write = api.get_button_write(deck_id, page, key)
+            write = button.write
             if write:
                 try:
                     kb.type(write)
                 except Exception as error:
                     print(f"Could not complete the write command: {error}")
 
-        brightness_change = api.get_button_change_brightness(deck_id, page, key)
+        brightness_change = button.brightness_change
         if brightness_change:
             try:
                 api.change_brightness(deck_id, brightness_change)
             except Exception as error:
                 print(f"Could not change brightness: {error}")
 
-        switch_page = api.get_button_switch_page(deck_id, page, key)
+        switch_page = button.switch_page
         if switch_page:
             api.set_page(deck_id, switch_page - 1)
             if _deck_id(ui) == deck_id:
@@ -260,9 +253,6 @@ def update_button_text(ui, text: str) -> None:
         if deck_id:
             # There may be no decks attached
             api.set_button_text(deck_id, _page(ui), selected_button.index, text)  # type: ignore # Index property added
-            icon = api.get_button_icon_pixmap(deck_id, _page(ui), selected_button.index)  # type: ignore # Index property added
-            if icon:
-                selected_button.setIcon(icon)
 
 
 def update_button_command(ui, command: str) -> None:
@@ -313,7 +303,6 @@ def change_page(ui, page: int) -> None:
     deck_id = _deck_id(ui)
     if deck_id:
         api.set_page(deck_id, page)
-        redraw_buttons(ui)
         api.reset_dimmer(deck_id)
 
     reset_button_configuration(ui)
@@ -333,7 +322,6 @@ def select_image(window) -> None:
         last_image_dir = os.path.dirname(file_name)
         deck_id = _deck_id(window.ui)
         api.set_button_icon(deck_id, _page(window.ui), selected_button.index, file_name)  # type: ignore # Index property added
-        redraw_buttons(window.ui)
 
 
 def align_text_vertical(window) -> None:
@@ -351,7 +339,6 @@ def align_text_vertical(window) -> None:
         position = ""
 
     api.set_text_vertical_align(serial_number, _page(window.ui), selected_button.index, position)  # type: ignore # Index property added
-    redraw_buttons(window.ui)
 
 
 def remove_image(window) -> None:
@@ -366,7 +353,6 @@ def remove_image(window) -> None:
         button = confirm.exec()
         if button == QMessageBox.StandardButton.Yes:
             api.set_button_icon(deck_id, _page(window.ui), selected_button.index, "")  # type: ignore # Index property added
-            redraw_buttons(window.ui)
 
 
 def redraw_buttons(ui) -> None:
@@ -792,6 +778,13 @@ def streamdeck_cpu_changed(ui, serial_number: str, cpu: int):
         ui.cpu_usage.update()
 
 
+def streamdeck_shown(ui, serial_number: str):
+    """Redraws the buttons once changes to them reached the Stream Deck, so the preview
+    shows the same images. The setters don't wait for that, to keep the UI responsive."""
+    if _deck_id(ui) == serial_number:
+        redraw_buttons(ui)
+
+
 def streamdeck_attached(ui, deck: Dict):
     serial_number = deck["serial_number"]
     blocker = QSignalBlocker(ui.device_list)
@@ -849,8 +842,7 @@ def start(_exit: bool = False) -> None:
             # The semaphore was created, so this is the first instance
 
             api = StreamDeckServer()
-            if os.path.isfile(STATE_FILE):
-                api.open_config(STATE_FILE)
+            api.load_state()
 
             # The QApplication object holds the Qt event loop and you need one of these
             # for your application
@@ -871,6 +863,7 @@ def start(_exit: bool = False) -> None:
             api.plugevents.attached.connect(partial(streamdeck_attached, ui))
             api.plugevents.detached.connect(partial(streamdeck_detached, ui))
             api.plugevents.cpu_changed.connect(partial(streamdeck_cpu_changed, ui))
+            api.plugevents.shown.connect(partial(streamdeck_shown, ui))
 
             api.start()
 
@@ -17,6 +17,7 @@ class StreamDeckMock(StreamDeck.StreamDeck):
     KEY_ROTATION = 0
 
     DECK_TYPE = "Stream Deck Original"
+    DECK_VISUAL = True
 
     IMAGE_REPORT_LENGTH = 8191
     IMAGE_REPORT_HEADER_LENGTH = 16
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from streamdeck_ui.button_state import DEFAULT_BUTTON, ButtonState
+
+JOURNAL_SIZE = 256 * 1024
+"The number of bytes the journal may grow to before it is folded into the state file"
+
+
+class StateJournal:
+    """
+    Saves changes to the state by appending the buttons and deck settings that changed to a
+    journal next to the state file, rather than rewriting the whole file. Once the journal grows
+    beyond its size limit, the state file is rewritten and the journal emptied. The state file
+    keeps the usual format, so it can still be exported, imported and read by older versions
+    (which only miss the changes still in the journal).
+
+    Every entry has a sequence number, and the state file records the sequence number of the
+    last change it holds. A journal that outlives the rewrite of the state file, because the
+    application stopped before it was emptied, only replays the changes that came after.
+    """
+
+    def __init__(self, state_file: str, max_bytes: int = JOURNAL_SIZE):
+        """Creates a new journal for a state file
+
+        :param state_file: The state file the journal records the changes to
+        :type state_file: str
+        :param max_bytes: The number of bytes the journal may grow to, defaults to JOURNAL_SIZE
+        :type max_bytes: int, optional
+        """
+        self.state_file = state_file
+        self.path = state_file + ".journal"
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.changes: Dict[Tuple[str, Optional[int], Optional[int]], Dict[str, Any]] = {}
+        "The journal entries of the buttons (deck, page, button) and deck settings (deck, None, None) changed since the last write"
+        self.everything = False
+        "True if the whole state changed, for example after importing a config"
+        self.exported: Optional[Tuple[int, Dict[str, Any]]] = None
+        "The sequence number of the last change in the snapshot of the whole state that is written to the state file next, and the snapshot"
+        self.sequence = 0
+        "The sequence number of the last change marked"
+        self.cut_short = False
+        "True if the last line of the journal was cut short, so the next append starts a new line"
+
+    def mark(self, state: Dict[str, Any], deck_id: Optional[str], page: Optional[int], buttons: Iterable[int]) -> None:
+        """Records which part of the state changed. The journal entries are made right away, so
+        they hold the settings as they are now, even when the state changes again before the write.
+
+        :param state: The state the changes were made to
+        :type state: Dict[str, Any]
+        :param deck_id: The Stream Deck serial number, or None if the whole state changed
+        :type deck_id: Optional[str]
+        :param page: The page of the buttons, or None if the settings of the deck changed
+        :type page: Optional[int]
+        :param buttons: The buttons on the page that changed
+        :type buttons: Iterable[int]
+        """
+        if deck_id is None:
+            with self.lock:
+                # The changes before are part of the whole state
+                self.everything = True
+                self.changes = {}
+            return
+
+        deck = state.get(deck_id, {})
+        entries: Dict[Tuple[str, Optional[int], Optional[int]], Dict[str, Any]] = {}
+        if page is None:
+            entries[(deck_id, None, None)] = {"deck": deck_id, "settings": {key: value for key, value in deck.items() if key != "buttons"}}
+        else:
+            page_buttons = deck.get("buttons", {}).get(page, {})
+            for button in buttons:
+                entries[(deck_id, page, button)] = {"deck": deck_id, "page": page, "button": button, "state": page_buttons.get(button, DEFAULT_BUTTON).to_dict()}
+        with self.lock:
+            for entry in entries.values():
+                self.sequence += 1
+                entry["sequence"] = self.sequence
+            self.changes.update(entries)
+
+    def snapshot(self, export_state: Callable[[], Dict[str, Any]]) -> None:
+        """Takes a snapshot of the whole state, when the state file is due to be rewritten
+        (see write). Otherwise the changes marked are all the journal needs, and the state is
+        not copied, which for a large config takes longer than the change itself.
+
+        :param export_state: Returns a copy of the whole state, the way the state file stores it
+        :type export_state: Callable[[], Dict[str, Any]]
+        """
+        with self.lock:
+            if not self.everything and (self.exported is not None or (os.path.isfile(self.state_file) and self._size() <= self.max_bytes)):
+                # Changes marked after a snapshot are appended once it is written
+                return
+            sequence = self.sequence
+        exported = export_state()
+        with self.lock:
+            # The snapshot holds the changes marked so far
+            self.exported = (sequence, exported)
+            self.everything = False
+            self.changes = {key: entry for key, entry in self.changes.items() if entry["sequence"] > sequence}
+
+    def write(self, save: Callable[[Dict[str, Any], int], None]) -> None:
+        """Writes the snapshot taken since the last write (see snapshot) to the state file and
+        empties the journal, if there is one. Then appends the changes marked since.
+
+        :param save: Writes a snapshot of the whole state to the state file, along with the
+        sequence number of the last change it holds
+        :type save: Callable[[Dict[str, Any], int], None]
+        """
+        with self.lock:
+            exported, changes = self.exported, self.changes
+            self.exported, self.changes = None, {}
+
+        try:
+            if exported is not None:
+                sequence, exported_state = exported
+                save(exported_state, sequence)
+                # Stopping here leaves the journal, but its entries are older than the state file
+                self.clear()
+            self._append(changes)
+        except BaseException:
+            # Not written, keep them for the next write. A snapshot taken since holds them all.
+            with self.lock:
+                if self.exported is None:
+                    self.exported = exported
+                    self.changes = {**changes, **self.changes}
+            raise
+
+    def replay(self, state: Dict[str, Any], sequence: int = 0) -> int:
+        """Applies the changes in the journal to a state loaded from the state file, and carries
+        on numbering the changes after them.
+
+        :param state: The state loaded from the state file
+        :type state: Dict[str, Any]
+        :param sequence: The sequence number of the last change the state file holds, defaults to 0
+        :type sequence: int, optional
+        :return: The number of changes applied
+        :rtype: int
+        """
+        self.sequence = max(self.sequence, sequence)
+        try:
+            journal_file = open(self.path)
+        except FileNotFoundError:
+            return 0
+
+        count = 0
+        with journal_file:
+            for line in journal_file:
+                self.cut_short = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # An append cut short, the appends after the restart follow it
+                    continue
+                if entry["sequence"] <= sequence:
+                    # Already in the state file
+                    continue
+                self.sequence = max(self.sequence, entry["sequence"])
+                deck = state.setdefault(entry["deck"], {})
+                if "settings" in entry:
+                    deck.update(entry["settings"])
+                elif entry["state"]:
+                    deck.setdefault("buttons", {}).setdefault(entry["page"], {})[entry["button"]] = ButtonState.from_dict(entry["state"])
+                else:
+                    # Swapped with a button that was never configured
+                    deck.get("buttons", {}).get(entry["page"], {}).pop(entry["button"], None)
+                count += 1
+        return count
+
+    def clear(self) -> None:
+        """Empties the journal"""
+        self.cut_short = False
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _append(self, changes: Dict[Tuple[str, Optional[int], Optional[int]], Dict[str, Any]]) -> None:
+        if not changes:
+            return
+        lines = [json.dumps(entry) + "\n" for entry in changes.values()]
+        if self.cut_short:
+            lines.insert(0, "\n")
+        with open(self.path, "a") as journal_file:
+            journal_file.write("".join(lines))
+        self.cut_short = False
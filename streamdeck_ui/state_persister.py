@@ -0,0 +1,127 @@
+import threading
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+SAVE_DELAY = 0.5
+"The time in seconds changes are collected before the state is written"
+
+
+class StatePersister:
+    """
+    Writes the state behind the back of the code that changes it. A change takes a snapshot
+    of the state on the thread that made it, so the state is never read while it is being
+    changed. The latest snapshot is written on a background thread, at most once per
+    SAVE_DELAY, so dragging a slider or typing a command writes the file a few times rather
+    than on every step. Call flush before exiting, so the last changes are not lost.
+    """
+
+    def __init__(self, snapshot: Callable[[], Any], save: Callable[[Any], None], delay: float = SAVE_DELAY):
+        """Creates a new persister
+
+        :param Callable[[], Any] snapshot: Returns a copy of the current state, that later changes
+                                           don't affect. Runs on the thread that calls request.
+        :param Callable[[Any], None] save: Writes a snapshot of the state. Runs on the background
+                                           thread, or the thread that calls flush.
+        :param float delay: The time in seconds changes are collected before the state is written.
+        """
+        self.snapshot = snapshot
+        self.save = save
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.dirty = False
+        "True if the state changed since it was last written"
+        self.pending: Any = None
+        "The snapshot of the state that is written next, if the state is dirty"
+        self.due = 0.0
+        "When the changes are written, if the state is dirty"
+        self.saving = False
+        "True while the state is being written"
+        self.quit = False
+        self.thread: Optional[threading.Thread] = None
+        self.requested = 0
+        self.performed = 0
+        self.failed = 0
+
+    def request(self) -> None:
+        """Takes a snapshot of the changed state. It is written within the delay."""
+        with self.condition:
+            # Under the condition, so the snapshots are written in the order they were taken
+            self.pending = self.snapshot()
+            self.requested += 1
+            if not self.dirty:
+                # Changes that follow ride along, rather than pushing the write back
+                self.dirty = True
+                self.due = monotonic() + self.delay
+            if self.thread is None:
+                self.quit = False
+                self.thread = threading.Thread(target=self._run, name="state persister", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def flush(self) -> None:
+        """Writes the changes that are still waiting, on the calling thread, and waits for a
+        write that is already running."""
+        with self.condition:
+            while self.saving:
+                self.condition.wait()
+            if not self.dirty:
+                return
+            state = self._take()
+        self._save(state)
+
+    def stop(self) -> None:
+        """Writes the changes that are still waiting and stops the background thread"""
+        self.flush()
+        with self.condition:
+            self.quit = True
+            thread = self.thread
+            self.thread = None
+            self.condition.notify_all()
+        if thread is not None:
+            thread.join()
+        # A change that came in while stopping
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of saves requested, and performed or failed
+
+        :return: A dictionary with requested, performed and failed
+        :rtype: Dict[str, int]
+        """
+        with self.condition:
+            return {"requested": self.requested, "performed": self.performed, "failed": self.failed}
+
+    def _run(self) -> None:
+        """Method that runs on background thread and writes the state when it is due."""
+        while True:
+            with self.condition:
+                while not self.quit and (not self.dirty or self.saving or monotonic() < self.due):
+                    self.condition.wait(max(0.0, self.due - monotonic()) if self.dirty else None)
+                if self.quit:
+                    return
+                state = self._take()
+            self._save(state)
+
+    def _take(self) -> Any:
+        """Returns the snapshot to write and marks it as being written. Must hold the condition."""
+        state = self.pending
+        self.pending = None
+        self.dirty = False
+        self.saving = True
+        return state
+
+    def _save(self, state: Any) -> None:
+        """Writes a snapshot of the state. Must only be called by the thread that took it."""
+        try:
+            self.save(state)
+            failed = False
+        except Exception:
+            failed = True
+
+        with self.condition:
+            if failed:
+                self.failed += 1
+            else:
+                self.performed += 1
+            self.saving = False
+            self.condition.notify_all()
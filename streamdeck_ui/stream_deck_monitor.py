@@ -1,6 +1,6 @@
-from threading import Event, Lock, Thread
+from threading import Event, Thread
 from time import sleep
-from typing import Callable, Dict, Optional
+from typing import Callable, ContextManager, Dict, Optional
 
 from StreamDeck import DeviceManager
 from StreamDeck.Devices.StreamDeck import StreamDeck
@@ -18,13 +18,13 @@ class StreamDeckMonitor:
     monitor_thread: Optional[Thread]
     "The thread the monitors Stream Decks"
 
-    def __init__(self, lock: Lock, attached: Callable[[str, StreamDeck], None], detached: Callable[[str], None]):
+    def __init__(self, lock: ContextManager, attached: Callable[[str, StreamDeck], None], detached: Callable[[str], None]):
         """Creates a new StreamDeckMonitor instance
 
         :param lock: A lock object that will be used to get exclusive access while enumerating
-        Stream Decks. This lock must be shared by any object that will read or write to the
-        Stream Deck.
-        :type lock: threading.Lock
+        Stream Decks. Any object that will read or write to a Stream Deck must hold a lock
+        that keeps enumeration out (see EnumerationBarrier and DeviceLock).
+        :type lock: ContextManager
         :param attached: A callback function that is called when a new StreamDeck is attached. Note
         this runs on a background thread.
         :type attached: Callable[[StreamDeck], None]
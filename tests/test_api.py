@@ -1,8 +1,13 @@
+import os
 import time
+from concurrent.futures import Future
+from unittest.mock import MagicMock
 
+import pytest
 from hypothesis_auto import auto_pytest_magic
 
 from streamdeck_ui import api
+from streamdeck_ui.display.key_writer import resolve
 
 server = api.StreamDeckServer()
 
@@ -18,3 +23,81 @@ auto_pytest_magic(server.set_brightness, auto_allow_exceptions_=(KeyError,))
 auto_pytest_magic(server.get_brightness)
 auto_pytest_magic(server.change_brightness, auto_allow_exceptions_=(KeyError,))
 auto_pytest_magic(server.get_page)
+
+
+def test_batch_applies_changes_once():
+    batch_server = api.StreamDeckServer()
+    batch_server.persister = MagicMock()
+    display_handler = batch_server.display_handlers["deck"] = MagicMock()
+
+    with batch_server.batch():
+        for button in range(3):
+            batch_server.set_button_text("deck", 0, button, f"Button {button}")
+            batch_server.set_button_icon("deck", 0, button, os.path.join(os.path.dirname(__file__), "assets", "smile.jpg"))
+            batch_server.set_text_vertical_align("deck", 0, button, "top")
+            batch_server.set_button_command("deck", 0, button, "ls")
+        with batch_server.batch():
+            batch_server.set_button_text("deck", 1, 0, "Nested")
+        assert display_handler.replace.call_count == 0
+
+    assert batch_server.persister.request.call_count == 1
+    assert sorted(call.args[:2] for call in display_handler.replace.call_args_list) == [(0, 0), (0, 1), (0, 2), (1, 0)]
+    assert display_handler.update.call_count == 1
+    assert display_handler.synchronize.call_count == 0
+    assert batch_server.get_text_vertical_align("deck", 0, 2) == "top"
+
+    # Outside a batch, every change is applied right away
+    batch_server.set_button_text("deck", 0, 0, "Changed")
+    assert batch_server.persister.request.call_count == 2
+    assert display_handler.update.call_count == 2
+
+
+def test_failed_batch_applies_the_changes_made_before_the_error():
+    batch_server = api.StreamDeckServer()
+    batch_server.persister = MagicMock()
+    display_handler = batch_server.display_handlers["deck"] = MagicMock()
+
+    with pytest.raises(ValueError):
+        with batch_server.batch() as changes:
+            batch_server.set_button_text("deck", 0, 0, "Changed")
+            raise ValueError("Failed")
+
+    assert batch_server.persister.request.call_count == 1
+    assert [call.args[:2] for call in display_handler.replace.call_args_list] == [(0, 0)]
+
+    # The error is passed on even when applying the changes fails as well
+    display_handler.replace.side_effect = RuntimeError("Stopped")
+    with pytest.raises(ValueError):
+        with batch_server.batch() as changes:
+            batch_server.set_button_text("deck", 0, 1, "Changed")
+            raise ValueError("Failed")
+    assert changes.shown.result(timeout=1) is False
+    assert batch_server.changes is None
+
+
+def test_setters_return_when_the_change_is_shown():
+    shown_server = api.StreamDeckServer()
+    shown_server.persister = MagicMock()
+    display_handler = shown_server.display_handlers["deck"] = MagicMock()
+    update = display_handler.update.return_value = Future()
+    shown = []
+    shown_server.plugevents.shown.connect(shown.append)
+
+    future = shown_server.set_button_text("deck", 0, 0, "Mute")
+    assert not future.done()
+
+    resolve([update], True)
+    assert future.result(timeout=1)
+    assert shown == ["deck"]
+    # Nothing changed, nothing to wait for
+    assert shown_server.set_button_text("deck", 0, 0, "Mute").result(timeout=1)
+
+
+def test_failed_export_leaves_no_temporary_file(tmp_path):
+    # A directory can't be replaced by the config file
+    config_file = tmp_path / "config.json"
+    config_file.mkdir()
+
+    with pytest.raises(OSError):
+        api.StreamDeckServer().export_config(str(config_file))
+    assert os.listdir(tmp_path) == ["config.json"]
@@ -0,0 +1,42 @@
+import json
+
+from streamdeck_ui.api import StreamDeckServer
+from streamdeck_ui.button_state import DEFAULT_BUTTON, ButtonState
+from streamdeck_ui.config import CONFIG_FILE_VERSION
+
+
+def test_only_changed_settings_are_stored():
+    button_state = ButtonState.from_dict({"text": "Mute", "switch_page": 2, "command": "", "color": "red"})
+
+    assert button_state.text == "Mute"
+    assert button_state.switch_page == 2
+    assert button_state.keys == ""
+    # Settings this version doesn't know are written back
+    assert button_state.to_dict() == {"text": "Mute", "switch_page": 2, "color": "red"}
+    assert ButtonState().to_dict() == {}
+
+
+def test_only_configured_buttons_are_kept(tmp_path):
+    config_file = str(tmp_path / "config.json")
+    old_buttons = {str(page): {str(button): {} for button in range(15)} for page in range(10)}
+    old_buttons["1"]["3"] = {"text": "Mute", "command": "amixer set Master toggle"}
+    with open(config_file, "w") as output:
+        json.dump({"streamdeck_ui_version": CONFIG_FILE_VERSION, "state": {"deck": {"brightness": 50, "buttons": old_buttons}}}, output)
+
+    server = StreamDeckServer()
+    server.open_config(config_file)
+    server.initialize_state("deck", 15)
+    server.set_button_keys("deck", 2, 0, "ctrl+c")
+
+    assert server.get_button_text("deck", 1, 3) == "Mute"
+    assert server.get_button("deck", 0, 0) is DEFAULT_BUTTON
+    assert sum(len(buttons) for buttons in server.state["deck"]["buttons"].values()) == 2
+
+    server.export_config(config_file)
+    with open(config_file) as config_input:
+        config = json.load(config_input)
+    assert config["state"]["deck"]["buttons"] == {"1": {"3": {"text": "Mute", "command": "amixer set Master toggle"}}, "2": {"0": {"keys": "ctrl+c"}}}
+
+    reloaded = StreamDeckServer()
+    reloaded.open_config(config_file)
+    assert reloaded.state == server.state
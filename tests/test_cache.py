@@ -0,0 +1,48 @@
+from streamdeck_ui.display.cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache: LRUCache[bytes] = LRUCache(10)
+    cache.put(1, b"aaaa")
+    cache.put(2, b"bbbb")
+    assert cache.get(1) == b"aaaa"
+    cache.put(3, b"cccc")
+    assert 2 not in cache
+    assert 1 in cache and 3 in cache
+    assert cache.size == 8
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_counts_misses_and_skips_oversized_values():
+    cache: LRUCache[bytes] = LRUCache(4)
+    assert cache.get(1) is None
+    cache.put(1, b"too large")
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 1
+
+
+def test_trim():
+    cache: LRUCache[bytes] = LRUCache(100)
+    for key in range(10):
+        cache.put(key, bytes([key]) * 10)
+    assert cache.trim(35) == 70
+    assert cache.size == 30
+    assert list(cache.entries) == [7, 8, 9]
+
+
+def test_value_stored_under_several_keys_is_counted_once():
+    cache: LRUCache[bytes] = LRUCache(100)
+    value = bytes(10)
+    cache.put(1, value)
+    cache.put(2, bytes(10))
+    cache.put(3, value)
+    assert cache.size == 20
+
+    # Evicting key 1 releases nothing, key 3 still holds the value
+    assert cache.trim(15) == 10
+    assert list(cache.entries) == [3]
+    assert cache.trim(0) == 10
+    assert cache.size == 0
@@ -0,0 +1,32 @@
+import threading
+
+from streamdeck_ui.device_lock import DeviceLock, EnumerationBarrier
+
+
+def test_devices_do_not_block_each_other():
+    barrier = EnumerationBarrier()
+    first = DeviceLock(barrier)
+    second = DeviceLock(barrier)
+
+    with first:
+        assert second.lock.acquire(blocking=False)
+        second.lock.release()
+        with second:
+            assert barrier.readers == 2
+
+
+def test_enumeration_waits_for_devices():
+    barrier = EnumerationBarrier()
+    device = DeviceLock(barrier)
+    enumerated = threading.Event()
+
+    def enumerate():
+        with barrier:
+            enumerated.set()
+
+    with device:
+        thread = threading.Thread(target=enumerate)
+        thread.start()
+        assert not enumerated.wait(0.1)
+    assert enumerated.wait(1)
+    thread.join()
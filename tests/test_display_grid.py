@@ -0,0 +1,248 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display.clock import NANOSECONDS_PER_MILLISECOND, SimulatedClock
+from streamdeck_ui.display.display_grid import DisplayGrid
+from streamdeck_ui.display.image_filter import ImageFilter
+from streamdeck_ui.display.key_writer import KeyWriter
+from streamdeck_ui.display.text_filter import TextFilter
+from streamdeck_ui.mock_streamdeck import StreamDeckMock
+
+
+class RecordingStreamDeckMock(StreamDeckMock):
+    def __init__(self):
+        super().__init__(None)
+        self.images = []
+
+    def set_key_image(self, key, image):
+        self.images.append((key, image))
+
+
+class BlockingStreamDeckMock(RecordingStreamDeckMock):
+    def __init__(self):
+        super().__init__()
+        self.proceed = threading.Event()
+
+    def set_key_image(self, key, image):
+        self.proceed.wait()
+        super().set_key_image(key, image)
+
+
+def create_display(pages: int = 2, renderer: str = "serial", **kwargs) -> DisplayGrid:
+    display = DisplayGrid(threading.Lock(), RecordingStreamDeckMock(), pages, None, renderer=renderer, **kwargs)
+    for page in range(pages):
+        for button in range(display.streamdeck.key_count()):
+            display.replace(page, button, [])
+    display.set_page(0)
+    return display
+
+
+def test_identical_images_are_not_written_again():
+    display = create_display()
+    display.start()
+    assert display.write_stats() == {"sent": 24, "skipped": 0, "dropped": 0, "queued": 0}
+
+    # Every key of the other page is blank as well
+    display.set_page(1)
+    display.synchronize()
+    display.stop()
+    assert display.write_stats() == {"sent": 24, "skipped": 24, "dropped": 0, "queued": 0}
+    assert len(display.streamdeck.images) == 24
+
+
+def test_prerendered_page_switch_only_uses_cached_frames():
+    display = create_display()
+    for button in range(display.streamdeck.key_count()):
+        display.replace(1, button, [TextFilter(str(button), DEFAULT_FONT, "")])
+    display.start()
+    display.prerender([1])
+    display.synchronize()
+    misses = display.frame_cache.stats()["misses"]
+
+    display.set_page(1)
+    display.synchronize()
+    display.stop()
+    assert display.frame_cache.stats()["misses"] == misses
+    assert display.write_stats()["sent"] == 48
+
+
+def test_pipelines_of_other_pages_are_built_lazily():
+    display = create_display()
+    filters = [TextFilter("lazy", DEFAULT_FONT, "")]
+    display.replace(1, 0, filters)
+    display.replace(0, 0, [TextFilter("now", DEFAULT_FONT, "")])
+    assert display.pending[(1, 0)] is filters
+    assert not display.pages[1][0].filters
+    assert (0, 0) not in display.pending
+    assert display.pages[0][0].filters
+
+    display.start()
+    display.set_page(1)
+    display.synchronize()
+    display.stop()
+    assert not display.pending
+    assert display.pages[1][0].filters[1][0] is filters[0]
+
+
+def test_animations_follow_the_clock_without_drift():
+    clock = SimulatedClock(5 * NANOSECONDS_PER_MILLISECOND)
+    display = create_display(clock=clock)
+    animation = ImageFilter(os.path.join(os.path.dirname(__file__), "assets", "dog.gif"))
+    display.replace(0, 0, [animation])
+    durations = [duration * NANOSECONDS_PER_MILLISECOND for _, duration, _ in animation.frames]
+
+    def render():
+        ((_, _, native_image, next_change),) = display._render_frame(0, display.pages[0], {0}, clock(), False)
+        return native_image, next_change
+
+    # The animation starts when it is first shown
+    native_image, next_change = render()
+    assert native_image is not None
+    assert next_change == clock() + durations[0]
+
+    clock.advance(durations[0] - 1)
+    assert render() == (None, next_change)
+
+    # A late frame does not push the frames after it back
+    deadline = next_change
+    clock.advance(1 + 3 * NANOSECONDS_PER_MILLISECOND)
+    native_image, next_change = render()
+    assert native_image is not None
+    assert next_change == deadline + durations[1]
+
+
+@pytest.mark.parametrize("renderer", ["thread", "process"])
+def test_parallel_renderers(renderer: str):
+    display = create_display(renderer=renderer)
+    for button in range(display.streamdeck.key_count()):
+        display.replace(0, button, [TextFilter(str(button), DEFAULT_FONT, "")])
+    display.start()
+    display.stop()
+    assert display.get_image(0, 0).size == display.size
+    display.close()
+    assert sorted(key for key, _ in display.streamdeck.images) == list(range(24))
+    assert len({bytes(image) for _, image in display.streamdeck.images}) == 24
+
+
+def test_failed_render_process_falls_back_to_rendering_in_process():
+    display = create_display(renderer="process")
+    display.start()
+    blank = display.streamdeck.images[0][1]
+    for worker in display.process_renderer.workers:
+        worker.kill()
+        worker.join()
+
+    display.replace(0, 0, [TextFilter("after", DEFAULT_FONT, "")])
+    display.synchronize()
+    display.stop()
+    assert display.process_renderer is None
+    assert display.get_image(0, 0).size == display.size
+    assert [image for key, image in display.streamdeck.images if key == 0][-1] != blank
+    display.close()
+
+
+def test_superseded_images_are_dropped():
+    streamdeck = RecordingStreamDeckMock()
+    writer = KeyWriter(threading.Lock(), streamdeck, lambda: None)
+    writer.submit(0, b"first")
+    writer.submit(0, b"second")
+    writer.submit(1, b"other")
+    assert writer.stats() == {"sent": 0, "skipped": 0, "dropped": 1, "queued": 2}
+
+    writer.start()
+    writer.flush()
+    writer.submit(0, b"second")
+    writer.stop()
+    assert streamdeck.images == [(0, b"second"), (1, b"other")]
+    assert writer.stats() == {"sent": 2, "skipped": 1, "dropped": 1, "queued": 0}
+
+
+def test_key_presses_are_written_first():
+    streamdeck = RecordingStreamDeckMock()
+    clock = SimulatedClock()
+    writer = KeyWriter(threading.Lock(), streamdeck, lambda: None, clock)
+    writer.submit(0, b"frame")
+    writer.submit(1, b"frame")
+    writer.submit(2, b"pressed", pressed_at=0)
+    clock.advance(3 * NANOSECONDS_PER_MILLISECOND)
+
+    writer.start()
+    writer.flush()
+    writer.stop()
+    assert [key for key, _ in streamdeck.images] == [2, 0, 1]
+    assert writer.press_latency_stats() == {"presses": 1, "mean_ms": 3, "max_ms": 3}
+
+
+def test_quick_tap_while_the_writer_is_busy():
+    streamdeck = BlockingStreamDeckMock()
+    writer = KeyWriter(threading.Lock(), streamdeck, lambda: None)
+    writer.start()
+    writer.key_images[0] = b"released"
+    writer.submit(1, b"frame")
+    writer.submit(0, b"pressed", pressed_at=0)
+    # Released again before the press was sent, the key already shows that image
+    writer.submit(0, b"released", pressed_at=1)
+    assert not writer.presses
+    writer.submit(2, b"frame")
+
+    streamdeck.proceed.set()
+    writer.flush()
+    assert writer.writer_thread.is_alive()
+    writer.stop()
+    assert [key for key, _ in streamdeck.images] == [1, 2]
+    assert writer.stats()["queued"] == 0
+
+
+def test_prepared_key_presses_are_sent_right_away():
+    display = create_display()
+    display.replace(0, 0, [TextFilter("Press", DEFAULT_FONT, "")])
+    display._render_frame(0, display.pages[0], {0}, 0, True)
+    display._prepare_keypresses(0, [0], threading.Event())
+
+    display.set_keypress(0, True)
+    # Sent without waiting for the render thread
+    assert not display.presses
+    pressed = display.writer.pending[0]
+    assert 0 in display.writer.presses
+
+    # The pipeline renders the same image once it catches up
+    ((_, _, native_image, _),) = display._render_frame(0, display.pages[0], {0}, 0, False)
+    assert bytes(native_image) == bytes(pressed)
+
+
+def test_update_is_done_once_the_images_were_sent():
+    display = create_display()
+    display.start()
+    written = len(display.streamdeck.images)
+
+    display.replace(0, 3, [TextFilter("New", DEFAULT_FONT, "")])
+    assert display.update().result(timeout=5)
+    assert [key for key, _ in display.streamdeck.images[written:]] == [3]
+
+    display.stop()
+    assert not display.update().result(timeout=5)
+
+
+def test_replaced_images_keep_their_place_in_line():
+    streamdeck = BlockingStreamDeckMock()
+    writer = KeyWriter(threading.Lock(), streamdeck, lambda: None)
+    writer.start()
+    writer.submit(9, b"first")
+    writer.submit(0, b"old")
+    writer.submit(1, b"frame")
+    futures = [Future()]
+    writer.when_sent(futures)
+    # The key waited for changed again before it was sent
+    writer.submit(0, b"new")
+    writer.submit(2, b"later")
+    assert not futures[0].done()
+
+    streamdeck.proceed.set()
+    assert futures[0].result(timeout=5)
+    assert (0, b"new") in streamdeck.images
+    assert (0, b"old") not in streamdeck.images
+    writer.stop()
@@ -1,9 +1,11 @@
+import gc
 import os
-from fractions import Fraction
 
 import pytest
+from PIL import Image
 
-from streamdeck_ui.display import empty_filter, image_filter, pipeline
+from streamdeck_ui.config import DEFAULT_FONT
+from streamdeck_ui.display import clock, empty_filter, icon_cache, image_filter, image_source, keypress_filter, pipeline, pulse_filter, text_filter
 
 
 def get_asset(file_name):
@@ -14,11 +16,18 @@ def get_asset(file_name):
 def test_default():
     default = empty_filter.EmptyFilter()
     default.initialize((16, 16))
-    image, _ = default.transform(lambda: None, lambda hash: None, True, Fraction(0))
+    image = default.transform(None, pipeline.no_output, True, 0)
     assert image is not None
     assert default.is_complete is False
 
 
+def test_first_filter_draws_on_a_blank_image():
+    for filter in [image_filter.ImageFilter(get_asset("smile.png")), text_filter.TextFilter("label", DEFAULT_FONT, "")]:
+        filter.initialize((16, 16))
+        image = filter.transform(None, pipeline.no_output, True, 0)
+        assert image.size == (16, 16)
+
+
 # TODO: Incorrect file locations default to "empty". Probably better that it throws.
 @pytest.mark.parametrize("image", ["smile.png", "smile.jpg", "smile.svg", "dog.gif"])
 def test_image_filter(image: str):
@@ -29,14 +38,14 @@ def test_image_filter(image: str):
     filter.initialize(size)
 
     pipe.add(filter)
-    time = Fraction(0)
+    time = 0
 
     filter = image_filter.ImageFilter(get_asset(image))
     filter.initialize(size)
     pipe.add(filter)
-    image, _ = pipe.execute(time)
-    image, _ = pipe.execute(1)
-    image, _ = pipe.execute(2)
+    image = pipe.execute(time)
+    image = pipe.execute(clock.NANOSECONDS_PER_SECOND)
+    image = pipe.execute(2 * clock.NANOSECONDS_PER_SECOND)
 
 
 def test_pipeline():
@@ -50,6 +59,325 @@ def test_pipeline():
     filter = image_filter.ImageFilter(os.path.join(os.path.dirname(__file__), "assets/smile.png"))
     filter.initialize(size)
     pipe.add(filter)
-    time = Fraction(0)
-    final_image, _ = pipe.execute(time)
+    time = 0
+    final_image = pipe.execute(time)
     assert final_image is not None
+
+
+def test_pipeline_cache_is_bounded():
+    size = (72, 72)
+    frame_size = pipeline.image_size(Image.new("RGB", size))
+    pipe = pipeline.Pipeline(cache_size=frame_size * 4)
+
+    filter = empty_filter.EmptyFilter()
+    filter.initialize(size)
+    pipe.add(filter)
+
+    filter = image_filter.ImageFilter(get_asset("dog.gif"))
+    filter.initialize(size)
+    pipe.add(filter)
+
+    for time in range(50):
+        pipe.execute(time * 100_000_000)
+
+    assert pipe.output_cache.size <= frame_size * 4
+    assert pipe.output_cache.stats()["evictions"] > 0
+
+
+def test_pipeline_next_change():
+    size = (72, 72)
+    pipe = pipeline.Pipeline()
+
+    filter = empty_filter.EmptyFilter()
+    filter.initialize(size)
+    pipe.add(filter)
+
+    filter = image_filter.ImageFilter(get_asset("smile.jpg"))
+    filter.initialize(size)
+    pipe.add(filter)
+    pipe.execute(0)
+    assert pipe.next_change(0) is None
+
+    filter = image_filter.ImageFilter(get_asset("dog.gif"))
+    filter.initialize(size)
+    pipe.add(filter)
+    # Animations start when they are first shown
+    pipe.execute(1)
+    assert pipe.next_change(1) == 1 + filter.current_frame[1] * clock.NANOSECONDS_PER_MILLISECOND
+
+
+@pytest.mark.parametrize("image", ["smile.png", "smile.svg", "dog.gif"])
+def test_image_source_uses_icon_cache(image: str, tmp_path, monkeypatch):
+    cache = icon_cache.IconCache(str(tmp_path), 1024 * 1024)
+    monkeypatch.setattr(image_source, "icon_cache", cache)
+    size = (72, 72)
+
+    decoded = image_source.ImageSource(get_asset(image), size, 1024 * 1024, 1)
+    assert len(os.listdir(tmp_path)) == 1
+
+    def fail(self, image_hash):
+        raise AssertionError("Icon decoded again")
+
+    monkeypatch.setattr(image_source.ImageSource, "_load_frames", fail)
+    cached = image_source.ImageSource(get_asset(image), size, 1024 * 1024, 1)
+
+    assert len(cached.frames) == len(decoded.frames)
+    for (cached_frame, cached_duration, cached_hash), (frame, duration, hashcode) in zip(cached.frames, decoded.frames):
+        assert cached_frame.mode == frame.mode
+        assert cached_frame.tobytes() == frame.tobytes()
+        assert cached_frame.getpalette() == frame.getpalette()
+        assert (cached_duration, cached_hash) == (duration, hashcode)
+
+
+def test_icon_cache_removes_least_recently_used(tmp_path):
+    frames = [(Image.new("RGB", (72, 72)), -1)]
+    cache = icon_cache.IconCache(str(tmp_path), 4 * 72 * 72 * 3 - 1)
+    for key in ["a", "b", "c"]:
+        cache.store(key, frames)
+    os.utime(tmp_path / "a", (0, 0))
+    os.utime(tmp_path / "b", (1, 1))
+    assert cache.load("a") is not None
+
+    cache.store("d", frames)
+
+    assert sorted(os.listdir(tmp_path)) == ["a", "c", "d"]
+
+
+def test_icon_cache_only_scans_when_over_budget(tmp_path, monkeypatch):
+    frames = [(Image.new("RGB", (72, 72)), -1)]
+    cache = icon_cache.IconCache(str(tmp_path), 3 * 72 * 72 * 3 + 1000)
+    # Another process is still writing this entry
+    (tmp_path / "other.tmp").write_bytes(bytes(100_000))
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(icon_cache.os, "scandir", lambda path: scans.append(path) or scandir(path))
+
+    for key in ["a", "b", "c"]:
+        cache.store(key, frames)
+    assert len(scans) == 1
+
+    os.utime(tmp_path / "a", (0, 0))
+    cache.store("d", frames)
+    assert len(scans) == 2
+    assert sorted(os.listdir(tmp_path)) == ["b", "c", "d", "other.tmp"]
+
+
+def test_icon_cache_removes_temporary_file_when_store_fails(tmp_path, monkeypatch):
+    cache = icon_cache.IconCache(str(tmp_path), 1024 * 1024)
+
+    def fail(source, destination):
+        raise OSError("Disk full")
+
+    monkeypatch.setattr(icon_cache.os, "replace", fail)
+    cache.store("a", [(Image.new("RGB", (72, 72)), -1)])
+
+    assert os.listdir(tmp_path) == []
+
+
+def create_animation_pipeline(*filters):
+    size = (72, 72)
+    pipe = pipeline.Pipeline()
+    for filter in [empty_filter.EmptyFilter(), image_filter.ImageFilter(get_asset("dog.gif")), *filters]:
+        filter.initialize(size)
+        pipe.add(filter)
+    return pipe
+
+
+def test_pipeline_compiled_animation_replays_frames():
+    executed = create_animation_pipeline(text_filter.TextFilter("Dog", DEFAULT_FONT, "bottom"), keypress_filter.KeypressFilter())
+    compiled = create_animation_pipeline(text_filter.TextFilter("Dog", DEFAULT_FONT, "bottom"), keypress_filter.KeypressFilter())
+    assert compiled.compile(lambda image: image.tobytes())
+
+    for time in range(20):
+        image = executed.execute(time * 100_000_000)
+        changed, frame = compiled.replay(time * 100_000_000)
+        assert changed == (image is not None)
+        assert frame == executed.last_result().tobytes()
+        assert compiled.last_result().tobytes() == frame
+
+    # A pressed key is not part of the compiled frames, the filters have to run
+    keypress = compiled.filters[-1][0]
+    keypress.active = True
+    assert compiled.replay(3 * clock.NANOSECONDS_PER_SECOND) is None
+    image = compiled.execute(3 * clock.NANOSECONDS_PER_SECOND)
+    assert image is not None
+
+
+def test_pipeline_clear_caches_drops_compiled_frames():
+    compiled = create_animation_pipeline()
+    assert compiled.compile(lambda image: image.tobytes())
+    assert compiled.replay(0) is not None
+
+    compiled.clear_caches()
+    assert len(compiled.output_cache) == 0
+    assert compiled.replay(clock.NANOSECONDS_PER_SECOND) is None
+    assert compiled.execute(clock.NANOSECONDS_PER_SECOND) is not None
+
+
+def test_pipeline_compile_requires_pure_filters():
+    assert not create_animation_pipeline(pulse_filter.PulseFilter()).compile(lambda image: image.tobytes())
+    assert not create_animation_pipeline(image_filter.ImageFilter(get_asset("dog.gif"))).compile(lambda image: image.tobytes())
+
+
+def test_image_filter_streams_large_animations(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_source, "icon_cache", icon_cache.IconCache(str(tmp_path), 1024 * 1024))
+    size = (72, 72)
+    decoded = image_filter.ImageFilter(get_asset("dog.gif"))
+    decoded.initialize(size)
+    streamed = image_filter.ImageFilter(get_asset("dog.gif"), memory_limit=72 * 72)
+    streamed.initialize(size)
+
+    assert isinstance(streamed.frames, image_source.StreamedFrames)
+    assert len(streamed.frames) == len(decoded.frames)
+    for index in [*range(len(decoded.frames)), 3, 0]:
+        frame, duration, hashcode = streamed.frames[index]
+        decoded_frame, decoded_duration, decoded_hashcode = decoded.frames[index]
+        assert frame.tobytes() == decoded_frame.tobytes()
+        assert (duration, hashcode) == (decoded_duration, decoded_hashcode)
+        assert len(streamed.frames.window) <= image_source.STREAM_WINDOW
+
+
+def test_streamed_animations_are_read_by_each_filter(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_source, "icon_cache", icon_cache.IconCache(str(tmp_path), 1024 * 1024))
+    first, second = image_filter.ImageFilter(get_asset("dog.gif"), memory_limit=72 * 72), image_filter.ImageFilter(get_asset("dog.gif"), memory_limit=72 * 72)
+    first.initialize((72, 72))
+    second.initialize((72, 72))
+    assert first.source is second.source
+    assert first.frames is not second.frames
+
+    # Reading far ahead doesn't move the window of the other filter
+    last = len(second.frames) - 1
+    assert second.frames[last][2] == first.source.frames.hashcodes[last]
+    assert 0 in first.frames.window
+    assert last in second.frames.window
+
+
+def test_streamed_animation_file_is_closed_with_its_reader(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_source, "icon_cache", icon_cache.IconCache(str(tmp_path), 1024 * 1024))
+    streamed = image_filter.ImageFilter(get_asset("dog.gif"), memory_limit=72 * 72)
+    streamed.initialize((72, 72))
+    closed = []
+    open_image = Image.open
+
+    def open_file(file):
+        image = open_image(file)
+        close = image.close
+        image.close = lambda: closed.append(file) or close()
+        return image
+
+    monkeypatch.setattr(image_source.Image, "open", open_file)
+    reader = streamed.frames.reader()
+    reader[0]
+    assert closed == []
+
+    del reader
+    gc.collect()
+    assert closed == [get_asset("dog.gif")]
+
+
+def test_image_sources_are_shared():
+    size = (72, 72)
+    registry = image_source.ImageSourceRegistry()
+    owners = [pipeline.Pipeline() for _ in range(3)]
+    sources = [registry.acquire(owner, get_asset("dog.gif"), size, 1024 * 1024) for owner in owners]
+
+    assert sources[0] is sources[1] is sources[2]
+    stats = registry.stats()
+    assert (stats["sources"], stats["users"]) == (1, 3)
+    assert stats["bytes_saved"] == 2 * stats["bytes"]
+
+    del owners[:]
+    assert registry.stats()["sources"] == 0
+
+
+def test_compiled_frames_are_shared():
+    pipes = [create_animation_pipeline(text_filter.TextFilter("Dog", DEFAULT_FONT, "bottom")) for _ in range(2)]
+    encoded = []
+    for pipe in pipes:
+        assert pipe.compile(lambda image: encoded.append(image) or image.tobytes(), encoding="raw")
+
+    assert pipes[0].compiled is pipes[1].compiled
+    assert len(encoded) == len(pipes[0].compiled)
+    assert image_source.image_sources.stats()["bytes_saved"] >= pipes[0].compiled.bytes
+
+    other = create_animation_pipeline(text_filter.TextFilter("Cat", DEFAULT_FONT, "bottom"))
+    assert other.compile(lambda image: image.tobytes(), encoding="raw")
+    assert other.compiled is not pipes[0].compiled
+
+
+def test_pipeline_passes_unchanged_images_through():
+    size = (72, 72)
+    pipe = pipeline.Pipeline()
+    for filter in [empty_filter.EmptyFilter(), image_filter.ImageFilter(get_asset("smile.png")), keypress_filter.KeypressFilter()]:
+        filter.initialize(size)
+        pipe.add(filter)
+
+    image = pipe.execute(0)
+    hashcode = pipe.hashcode
+    # The released key passes the icon through, rather than a copy of it
+    assert image is pipe.filters[1][1]
+    assert pipe.execute(1) is None
+    assert pipe.hashcode == hashcode
+
+
+def test_text_filters_share_rendered_labels():
+    text_filter.label_cache.clear()
+    labels = [text_filter.TextFilter(text, DEFAULT_FONT, "bottom") for text in ["Mute", "Back", "Mute"]]
+    for label in labels:
+        label.initialize((72, 72))
+
+    assert labels[0].image is labels[2].image
+    assert labels[0].image is not labels[1].image
+    assert len(text_filter.label_cache) == 2
+
+    other_size = text_filter.TextFilter("Mute", DEFAULT_FONT, "bottom")
+    other_size.initialize((96, 96))
+    assert other_size.image.size == (96, 96)
+    assert text_filter.load_font.cache_info().currsize >= 1
+
+
+def test_atlas_labels_look_like_rendered_labels():
+    atlas = text_filter.glyph_atlas(DEFAULT_FONT)
+    for text in ["1234", "4321"]:
+        rendered = text_filter.TextFilter(text, DEFAULT_FONT, "middle")
+        rendered.initialize((72, 72))
+        composed = text_filter.TextFilter(text, DEFAULT_FONT, "middle", text_filter.TEXT_MODE_ATLAS)
+        composed.initialize((72, 72))
+        assert composed.hashcode != rendered.hashcode
+        for rendered_band, composed_band in zip(rendered.image.split(), composed.image.split()):
+            assert max(abs(a - b) for a, b in zip(rendered_band.getdata(), composed_band.getdata())) <= 1
+
+    assert set("1234") <= set(atlas.glyphs)
+
+
+@pytest.mark.parametrize("curve", pulse_filter.PULSE_CURVES)
+def test_pulse_reuses_its_brightness_levels(curve: str):
+    size = (72, 72)
+    pipe = pipeline.Pipeline(cache_size=0)
+    pulse = pulse_filter.PulseFilter(clock.NANOSECONDS_PER_SECOND, curve, levels=4)
+    for filter in [empty_filter.EmptyFilter(), image_filter.ImageFilter(get_asset("smile.png")), pulse]:
+        filter.initialize(size)
+        pipe.add(filter)
+
+    images = []
+    time = 0
+    for _ in range(2 * len(pulse.steps)):
+        images.append(pipe.execute(time))
+        time = pipe.next_change(time)
+    assert time == 2 * clock.NANOSECONDS_PER_SECOND
+    # Starts bright, and is dimmest halfway through the period
+    assert pulse.steps[0] == len(pulse.brightness_levels) - 1
+    assert pulse.steps[len(pulse.steps) // 2] == 0
+    table = pulse_filter.brightness_table(pulse.dim_brightness, ("R", "G", "B", "A"))
+    assert table[:256] == [int(value * pulse.dim_brightness) for value in range(256)]
+    assert table[3 * 256 :] == list(range(256))
+    bright, dim = images[0], images[len(pulse.steps) // 2]
+    assert bright.mode == "RGB"
+    assert bright.tobytes() == pipe.filters[1][1].tobytes()
+    assert dim.tobytes() == bright.point(table[: 3 * 256]).tobytes()
+    assert dim.tobytes() != bright.tobytes()
+
+    # The second period only reuses the levels of the first
+    first, second = images[: len(pulse.steps)], images[len(pulse.steps) :]
+    assert all(image is None or any(image is other for other in first) for image in second)
+    assert any(image is not None for image in second)
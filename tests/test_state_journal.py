@@ -0,0 +1,148 @@
+import copy
+import json
+import os
+
+from streamdeck_ui.button_state import ButtonState
+from streamdeck_ui.state_journal import StateJournal
+
+
+def create_state():
+    return {"deck": {"brightness": 50, "buttons": {page: {button: ButtonState.from_dict({"text": f"{page}:{button}"}) for button in range(15)} for page in range(10)}}}
+
+
+def export(state, state_file, sequence=0):
+    with open(state_file, "w") as output:
+        json.dump({"journal_sequence": sequence, "state": state}, output, default=ButtonState.to_dict)
+
+
+def load(state_file):
+    with open(state_file) as state_input:
+        config = json.load(state_input)
+    state = config["state"]
+    state["deck"]["buttons"] = {int(page): {int(button): ButtonState.from_dict(value) for button, value in buttons.items()} for page, buttons in state["deck"]["buttons"].items()}
+    return state, config["journal_sequence"]
+
+
+def save(journal, state, state_file):
+    journal.snapshot(lambda: copy.deepcopy(state))
+    journal.write(lambda exported, sequence: export(exported, state_file, sequence))
+
+
+def test_changes_are_appended_and_replayed(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    state = create_state()
+    journal = StateJournal(state_file)
+    journal.mark(state, None, None, [])
+    save(journal, state, state_file)
+    snapshot = os.path.getmtime(state_file)
+
+    state["deck"]["buttons"][3][4].text = "changed"
+    state["deck"]["brightness"] = 80
+    journal.mark(state, "deck", 3, [4])
+    journal.mark(state, "deck", None, [])
+    save(journal, state, state_file)
+    state["deck"]["buttons"][3][4].command = "ls"
+    journal.mark(state, "deck", 3, [4])
+    save(journal, state, state_file)
+
+    assert os.path.getmtime(state_file) == snapshot
+    with open(journal.path) as journal_file:
+        assert len(journal_file.readlines()) == 3
+    loaded, sequence = load(state_file)
+    assert journal.replay(loaded, sequence) == 3
+    assert loaded == state
+
+
+def test_journal_is_folded_into_the_state_file(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    state = create_state()
+    journal = StateJournal(state_file, max_bytes=200)
+    export(state, state_file)
+
+    for button in range(10):
+        state["deck"]["buttons"][0][button].text = "changed"
+        journal.mark(state, "deck", 0, [button])
+        save(journal, state, state_file)
+
+    assert os.path.getsize(journal.path) <= 200
+    loaded, sequence = load(state_file)
+    journal.replay(loaded, sequence)
+    assert loaded == state
+
+
+def test_state_is_only_copied_when_the_state_file_is_rewritten(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    state = create_state()
+    journal = StateJournal(state_file)
+    snapshots = []
+
+    def export_state():
+        snapshots.append(copy.deepcopy(state))
+        return snapshots[-1]
+
+    journal.mark(state, None, None, [])
+    journal.snapshot(export_state)
+    state["deck"]["brightness"] = 80
+    journal.mark(state, "deck", None, [])
+    journal.snapshot(export_state)
+    assert len(snapshots) == 1
+
+    journal.write(lambda exported, sequence: export(exported, state_file, sequence))
+    for button in range(5):
+        state["deck"]["buttons"][1][button].text = "changed"
+        journal.mark(state, "deck", 1, [button])
+        journal.snapshot(export_state)
+        journal.write(lambda exported, sequence: export(exported, state_file, sequence))
+
+    assert len(snapshots) == 1
+    loaded, sequence = load(state_file)
+    assert journal.replay(loaded, sequence) == 6
+    assert loaded == state
+
+
+def test_journal_left_by_a_crash_does_not_revert_the_state_file(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    state = create_state()
+    journal = StateJournal(state_file)
+    save(journal, state, state_file)
+    state["deck"]["buttons"][0][1].text = "old"
+    journal.mark(state, "deck", 0, [1])
+    save(journal, state, state_file)
+
+    # The state file is rewritten, and the application stops before the journal is emptied
+    state["deck"]["buttons"][0][1].text = "new"
+    journal.mark(state, None, None, [])
+    journal.clear = lambda: None
+    save(journal, state, state_file)
+    assert os.path.isfile(journal.path)
+
+    restarted = StateJournal(state_file)
+    loaded, sequence = load(state_file)
+    assert restarted.replay(loaded, sequence) == 0
+    assert loaded == state
+
+    # Changes after the restart are numbered after the ones in the state file
+    state["deck"]["buttons"][0][2].text = "after"
+    restarted.mark(state, "deck", 0, [2])
+    save(restarted, state, state_file)
+    loaded, sequence = load(state_file)
+    assert StateJournal(state_file).replay(loaded, sequence) == 1
+    assert loaded == state
+
+
+def test_cut_short_append_is_ignored(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    journal = StateJournal(state_file)
+    with open(journal.path, "w") as journal_file:
+        journal_file.write(json.dumps({"deck": "deck", "page": 0, "button": 1, "state": {"text": "kept"}, "sequence": 1}) + "\n")
+        journal_file.write('{"deck": "deck", "page": 0, "butt')
+
+    state = create_state()
+    assert journal.replay(state) == 1
+    assert state["deck"]["buttons"][0][1].to_dict() == {"text": "kept"}
+
+    # The next append starts on a line of its own
+    journal.mark(state, "deck", 0, [2])
+    journal.write(lambda exported, sequence: None)
+    state = create_state()
+    assert StateJournal(state_file).replay(state) == 2
@@ -0,0 +1,42 @@
+from time import sleep
+
+from streamdeck_ui.state_persister import StatePersister
+
+
+def test_changes_are_written_together():
+    saves = []
+    persister = StatePersister(lambda: None, saves.append, delay=0.1)
+    for _ in range(50):
+        persister.request()
+    assert not saves
+
+    sleep(0.3)
+    assert len(saves) == 1
+    assert persister.stats() == {"requested": 50, "performed": 1, "failed": 0}
+    persister.stop()
+
+
+def test_flush_writes_waiting_changes_right_away():
+    saves = []
+    persister = StatePersister(lambda: None, saves.append, delay=10)
+    persister.flush()
+    assert not saves
+
+    persister.request()
+    persister.stop()
+    assert len(saves) == 1
+    assert not persister.dirty
+
+
+def test_state_is_taken_when_it_changes():
+    state = {"brightness": 10}
+    saves = []
+    persister = StatePersister(lambda: dict(state), saves.append, delay=10)
+    persister.request()
+    state["brightness"] = 20
+    persister.request()
+    # Changed after the last request, so not part of this write
+    state["brightness"] = 30
+    persister.stop()
+    assert saves == [{"brightness": 20}]
+    assert persister.stats() == {"requested": 2, "performed": 1, "failed": 0}